@@ -0,0 +1,17 @@
+#!/bin/sh
+# Équivalent de create_user.yml en un seul aller-retour.
+# Usage : create_user.sh <user>  (mot de passe dans $TARGET_PASS, sinon lu sur stdin)
+set -e
+U="$1"
+[ -n "$U" ] || { echo "usage: create_user.sh <user>" >&2; exit 2; }
+if [ -n "${TARGET_PASS+x}" ]; then
+    P="$TARGET_PASS"
+else
+    IFS= read -r P || true
+fi
+
+if ! id -u "$U" >/dev/null 2>&1; then
+    adduser -D -s /bin/sh "$U" 2>/dev/null || useradd -m -s /bin/sh "$U"
+fi
+printf '%s:%s\n' "$U" "$P" | chpasswd -c SHA512 2>/dev/null \
+    || printf '%s:%s\n' "$U" "$P" | chpasswd
@@ -0,0 +1,23 @@
+#!/bin/sh
+# Équivalent de delete_user.yml en un seul aller-retour :
+# kill, attente bornée de la fin des processus, suppression, vérification.
+# Usage : delete_user.sh <user> [<user> ...]
+[ $# -gt 0 ] || { echo "usage: delete_user.sh <user> [<user> ...]" >&2; exit 2; }
+rc=0
+for U in "$@"; do
+    pkill -KILL -u "$U" 2>/dev/null || true
+    i=0
+    while pgrep -u "$U" >/dev/null 2>&1 && [ $i -lt 50 ]; do
+        sleep 0.1
+        i=$((i + 1))
+    done
+
+    userdel -r -f "$U" 2>/dev/null || deluser --remove-home "$U" 2>/dev/null || true
+    rm -rf "/home/$U" "/var/spool/cron/crontabs/$U"
+
+    if id -u "$U" >/dev/null 2>&1; then
+        echo "user $U still present" >&2
+        rc=1
+    fi
+done
+exit $rc
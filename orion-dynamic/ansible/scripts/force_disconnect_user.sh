@@ -0,0 +1,24 @@
+#!/bin/sh
+# Équivalent de force_disconnect_user.yml : SIGTERM, attente bornée, SIGKILL,
+# fermeture des sessions sshd puis suppression du compte.
+# Usage : force_disconnect_user.sh <user>
+U="$1"
+[ -n "$U" ] || { echo "usage: force_disconnect_user.sh <user>" >&2; exit 2; }
+
+pkill -TERM -u "$U" 2>/dev/null || true
+i=0
+while pgrep -u "$U" >/dev/null 2>&1 && [ $i -lt 20 ]; do
+    sleep 0.1
+    i=$((i + 1))
+done
+pkill -KILL -u "$U" 2>/dev/null || true
+# Sessions sshd du compte exact ("sshd: <user> [priv]", "sshd: <user>@pts/0", ou
+# sshd-session: depuis OpenSSH 9.8) : avec des slots partagés, "bob" ne doit pas
+# atteindre les sessions de "bobby"
+ps -o pid= -o args= 2>/dev/null | awk -v u="$U" '
+    ($2 == "sshd:" || $2 == "sshd-session:") && ($3 == u || index($3, u "@") == 1) { print $1 }
+' | xargs -r kill -KILL 2>/dev/null || true
+
+userdel -r -f "$U" 2>/dev/null || deluser --remove-home "$U" 2>/dev/null || true
+rm -rf "/home/$U"
+! id -u "$U" >/dev/null 2>&1
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark du profil d'exécution Ansible.
+
+Mesure le temps mural d'un run Ansible (create_user.yml puis delete_user.yml) sur un
+worker, d'abord avec le comportement historique (répertoire temporaire par run,
+réglages par défaut, artefacts écrits), puis avec le profil de l'API/du Scheduler
+(ansible.cfg avec pipelining et ControlPersist, private_data_dir réutilisé,
+événements non écrits sur disque).
+
+    ./benchmarks/bench_ansible_profile.py --host 127.0.0.1 --port 22221 --runs 10
+
+À lancer depuis orion-dynamic/ (les playbooks sont lus dans ./ansible).
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import ansible_runner
+
+CFG = """[defaults]
+host_key_checking = False
+retry_files_enabled = False
+gathering = explicit
+
+[ssh_connection]
+pipelining = True
+ssh_args = -o ControlMaster=auto -o ControlPersist=300s
+control_path_dir = {control_dir}
+control_path = %(directory)s/%%C
+"""
+
+
+def inventory(args):
+    return {'all': {'hosts': {'target_node': {
+        'ansible_host': args.host,
+        'ansible_port': args.port,
+        'ansible_user': args.ssh_user,
+        'ansible_password': args.ssh_pass,
+        'ansible_ssh_common_args': '-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null',
+    }}}}
+
+
+def run_default(args, playbook):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        return ansible_runner.run(private_data_dir=tmpdir, playbook=playbook, inventory=inventory(args),
+                                  extravars={"target_user": "benchuser", "target_pass": "benchpass"},
+                                  quiet=True)
+
+
+def make_profile_runner(workdir):
+    control_dir = os.path.join(workdir, 'cp')
+    os.makedirs(control_dir, exist_ok=True)
+    cfg = os.path.join(workdir, 'ansible.cfg')
+    with open(cfg, 'w') as f:
+        f.write(CFG.format(control_dir=control_dir))
+    private_data_dir = os.path.join(workdir, 'runner')
+
+    def run_profile(args, playbook):
+        return ansible_runner.run(private_data_dir=private_data_dir, playbook=playbook, inventory=inventory(args),
+                                  extravars={"target_user": "benchuser", "target_pass": "benchpass"},
+                                  envvars={'ANSIBLE_CONFIG': cfg}, event_handler=lambda event: False,
+                                  quiet=True, suppress_output_file=True, rotate_artifacts=1)
+    return run_profile
+
+
+def measure(name, runner, args):
+    playbooks = [os.path.abspath(os.path.join(args.playbooks, p)) for p in ('create_user.yml', 'delete_user.yml')]
+    timings = []
+    for _ in range(args.runs):
+        for playbook in playbooks:
+            started = time.perf_counter()
+            r = runner(args, playbook)
+            timings.append(time.perf_counter() - started)
+            if r.rc != 0:
+                print(f"[{name}] échec de {os.path.basename(playbook)} (RC={r.rc})")
+    timings.sort()
+    print(f"{name:8s} runs={len(timings)} p50={statistics.median(timings) * 1000:.0f} ms "
+          f"moy={statistics.mean(timings) * 1000:.0f} ms max={timings[-1] * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=22221)
+    parser.add_argument("--ssh-user", default="root")
+    parser.add_argument("--ssh-pass", default="password")
+    parser.add_argument("--playbooks", default="ansible", help="dossier des playbooks")
+    parser.add_argument("--runs", type=int, default=10, help="paires create/delete par mode")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-ansible-")
+    try:
+        measure("défaut", run_default, args)
+        measure("profil", make_profile_runner(workdir), args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark d'allocation concurrente (/rent).
+
+N clients louent des nœuds en parallèle ; on mesure le débit de /rent et la
+latence. Pour mesurer l'allocateur et non Ansible, les rents sont asynchrones
+par défaut : la mesure couvre la réservation, pas le provisioning. À la fin,
+toutes les locations obtenues sont libérées.
+
+Pour voir l'effet du nombre de réplicas API, lancer une fois par taille :
+
+    docker compose up -d --scale api=1 && ./benchmarks/bench_concurrent_rent.py --clients 16
+    docker compose up -d --scale api=2 && ./benchmarks/bench_concurrent_rent.py --clients 16
+    docker compose up -d --scale api=4 && ./benchmarks/bench_concurrent_rent.py --clients 16
+
+La flotte doit avoir au moins --rents nœuds libres (./data-plane/launch_workers.sh N).
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import urllib3
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+def login(api, username, password):
+    requests.post(f"{api}/signup", json={"username": username, "password": password}, verify=False, timeout=10)
+    res = requests.post(f"{api}/login", json={"username": username, "password": password}, verify=False, timeout=10)
+    res.raise_for_status()
+    return res.json()["token"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", default="https://localhost/api")
+    parser.add_argument("--clients", type=int, default=8, help="clients concurrents")
+    parser.add_argument("--rents", type=int, default=32, help="nombre total de /rent")
+    parser.add_argument("--count", type=int, default=1, help="nœuds par /rent")
+    parser.add_argument("--sync", action="store_true", help="rent synchrone (inclut le provisioning)")
+    args = parser.parse_args()
+
+    tokens = [login(args.api, f"bench{i:03d}", "benchpass") for i in range(args.clients)]
+
+    lock = threading.Lock()
+    latencies, rentals = [], []
+    status_counts = {}
+    remaining = [args.rents]
+
+    def client_loop(token):
+        headers = {"Authorization": f"Bearer {token}"}
+        session = requests.Session()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            res = session.post(f"{args.api}/rent", headers=headers, verify=False, timeout=300, json={
+                "duration_hours": 1, "count": args.count, "async": not args.sync})
+            elapsed = time.perf_counter() - started
+            with lock:
+                status_counts[res.status_code] = status_counts.get(res.status_code, 0) + 1
+                if res.status_code in (200, 202):
+                    latencies.append(elapsed)
+                    rentals.extend((token, a["rental_id"]) for a in res.json()["allocated"])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        list(pool.map(client_loop, tokens))
+    wall = time.perf_counter() - started
+
+    print(f"clients={args.clients} rents={args.rents} count={args.count} mode={'sync' if args.sync else 'async'}")
+    print(f"statuts HTTP : {status_counts}")
+    if latencies:
+        latencies.sort()
+        print(f"débit : {len(latencies) / wall:.1f} rents/s ({wall:.2f} s au total)")
+        print(f"latence : p50={statistics.median(latencies) * 1000:.0f} ms "
+              f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f} ms "
+              f"max={latencies[-1] * 1000:.0f} ms")
+
+    # Laisser les jobs de provisioning se terminer avant de libérer
+    if not args.sync and rentals:
+        time.sleep(5)
+    for token, rental_id in rentals:
+        requests.post(f"{args.api}/release/{rental_id}", headers={"Authorization": f"Bearer {token}"},
+                      verify=False, timeout=120)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+"""
+Plans d'exécution des requêtes chaudes de l'API et du Scheduler.
+
+Charge une flotte synthétique (par défaut 50 000 nœuds et 5 000 000 de locations, dont
+l'historique non archivé) dans une base MariaDB jetable, puis passe chaque requête chaude
+sous ANALYZE FORMAT=JSON : type d'accès par table, lignes examinées, filesort, lignes
+verrouillées (lectures FOR UPDATE, via information_schema.INNODB_TRX) et latence.
+
+Sert de catalogue à tests/test_query_plans.py (budgets de lignes, pas de scan complet) et
+produit en ligne de commande un rapport de latence par requête :
+
+    PLAN_DB_HOST=127.0.0.1 PLAN_DB_USER=root PLAN_DB_PASSWORD=root \\
+        ./benchmarks/query_plans.py --load --repeat 20
+
+La base PLAN_DB_NAME (défaut orion_plan) est supprimée et recréée par --load : ne jamais
+la faire pointer vers une base réelle. Le serveur doit être un MariaDB (moteur Sequence
+pour seq_1_to_N, ANALYZE FORMAT=JSON).
+
+Le catalogue ne recopie pas le SQL : chaque entrée appelle le vrai chemin de code de
+api.py ou scheduler.py (routes Flask comprises) sur la base des plans, et la requête est
+relevée au moment où le code l'émet (fragment `marker`, repris de la fonction `source`).
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from unittest.mock import patch
+
+import mysql.connector
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../control-plane/api')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../control-plane/scheduler')))
+
+import api
+import scheduler
+
+PLAN_DB_HOST = os.getenv('PLAN_DB_HOST')
+PLAN_DB_PORT = int(os.getenv('PLAN_DB_PORT', '3306'))
+PLAN_DB_USER = os.getenv('PLAN_DB_USER', 'root')
+PLAN_DB_PASSWORD = os.getenv('PLAN_DB_PASSWORD', '')
+PLAN_DB_NAME = os.getenv('PLAN_DB_NAME', 'orion_plan')
+
+# Taille de la flotte synthétique
+PLAN_NODES = int(os.getenv('PLAN_NODES', '50000'))
+PLAN_RENTALS = int(os.getenv('PLAN_RENTALS', '5000000'))
+PLAN_USERS = int(os.getenv('PLAN_USERS', '10000'))
+
+INIT_SQL = os.path.abspath(os.path.join(os.path.dirname(__file__), '../control-plane/db_init/init.sql'))
+LOAD_CHUNK = 1000000
+
+
+@dataclass
+class Fleet:
+    nodes: int = PLAN_NODES
+    rentals: int = PLAN_RENTALS
+    users: int = PLAN_USERS
+
+
+@dataclass
+class Query:
+    """
+    Requête chaude : chemin de code qui l'émet, fragment qui la repère dans ce chemin
+    et budgets. `run(conn, p)` appelle l'API ou le Scheduler avec `conn` comme connexion DB.
+    """
+    name: str
+    source: str
+    marker: str
+    run: object = None               # callable(conn, p) (p : paramètres de la flotte)
+    max_rows: object = 100           # lignes examinées (toutes tables), int ou callable(fleet)
+    max_locked: object = None        # lignes verrouillées (lectures FOR UPDATE / écritures)
+    full_scan_ok: tuple = ()         # alias de table autorisés en scan complet
+    allow_filesort: bool = False
+    locking: bool = False
+
+    def budget(self, value, fleet):
+        return value(fleet) if callable(value) else value
+
+
+@dataclass
+class PlanResult:
+    examined: float = 0
+    tables: list = field(default_factory=list)   # (alias, access_type, key, lignes examinées)
+    filesort: bool = False
+    locked: int = None
+    time_ms: float = 0
+
+
+# -----------------------
+# Enregistrement des requêtes émises par le code
+# -----------------------
+class StatementRecorded(BaseException):
+    """
+    Levée à l'émission de la requête cherchée : arrête le chemin de code avant toute suite
+    (provisioning, sondes SSH). BaseException : les `except Exception` du code la laissent passer.
+    """
+
+    def __init__(self, sql, params):
+        super().__init__(sql)
+        self.sql = sql
+        self.params = params
+
+def normalize_sql(sql):
+    return ' '.join(sql.split())
+
+class RecordingCursor:
+    def __init__(self, raw, recorder):
+        self._raw = raw
+        self._recorder = recorder
+
+    def execute(self, operation, params=(), *args, **kwargs):
+        self._recorder.check(operation, params)
+        return self._raw.execute(operation, params, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+class RecordingConnection:
+    """
+    Connexion prêtée à l'API ou au Scheduler : les requêtes s'exécutent sur la base des plans
+    dans une seule transaction, annulée par record_statement (commit, rollback et close du
+    code sont sans effet).
+    """
+
+    def __init__(self, raw, marker):
+        self._raw = raw
+        self._marker = normalize_sql(marker)
+        self.statements = []
+
+    def cursor(self, *args, **kwargs):
+        return RecordingCursor(self._raw.cursor(*args, **kwargs), self)
+
+    def check(self, sql, params):
+        self.statements.append((sql, params))
+        if self._marker in normalize_sql(sql):
+            raise StatementRecorded(sql, params)
+
+    def start_transaction(self, *args, **kwargs):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+def record_statement(conn, query, p):
+    """(sql, params) de la requête `query.marker` telle que le code l'émet, ou None si absente."""
+    recorder = RecordingConnection(conn, query.marker)
+    try:
+        query.run(recorder, p)
+    except StatementRecorded as recorded:
+        return recorded.sql, recorded.params
+    finally:
+        conn.rollback()
+    return None
+
+def call_route(conn, p, method, path, role='user', **kwargs):
+    """Route de l'API via le client de test Flask (jeton JWT réel), `conn` comme connexion DB."""
+    token = api.generate_jwt(p['user_id'], f"user{p['user_id']}", role)
+    with patch('api.get_db_connection', return_value=conn):
+        api.app.test_client().open(path, method=method, headers={"Authorization": f"Bearer {token}"}, **kwargs)
+
+def call_job(conn, job):
+    """Tâche du Scheduler avec `conn` comme connexion DB."""
+    with patch('scheduler.get_db_connection', return_value=conn):
+        job()
+
+def refresh_lease_timer(conn, p):
+    timer = scheduler.LeaseTimer(lambda: None)
+    timer.version = p['version']
+    timer.refresh(conn.cursor(dictionary=True))
+
+def heartbeat(conn, p):
+    hostname, ip, ssh_port = p['identity']
+    call_route(conn, p, 'POST', '/workers/heartbeat',
+               json={"hostname": hostname, "ip": ip, "ssh_port": ssh_port,
+                     "cpu_cores": 4, "memory_mb": 4096, "disk_gb": 50})
+
+
+# -----------------------
+# Catalogue des requêtes chaudes
+# -----------------------
+CATALOG = [
+    # --- API ---
+    Query("rent_claim_one", "api.claim_free_nodes", "ORDER BY idle, cpu_cores, memory_mb, disk_gb, id",
+          lambda c, p: api.claim_free_nodes(c.cursor(dictionary=True), 1, user_id=p['user_id']),
+          max_rows=50, max_locked=10, locking=True),
+    Query("rent_claim_batch_min_cpu", "api.claim_free_nodes", "ORDER BY idle, cpu_cores, memory_mb, disk_gb, id",
+          lambda c, p: api.claim_free_nodes(c.cursor(dictionary=True), 8, min_cpu=2, user_id=p['user_id']),
+          # Minima non indexables (part par slot) : les nœuds plus petits sont lus avant
+          max_rows=lambda f: f.nodes // 5, max_locked=lambda f: f.nodes // 5, locking=True),
+    Query("release_select", "api.release_lease", "JOIN nodes n ON r.node_id = n.id WHERE r.id = %s FOR UPDATE",
+          lambda c, p: call_route(c, p, 'POST', f"/release/{p['rental_id']}"),
+          max_rows=5, max_locked=5, locking=True),
+    Query("extend_select", "api.extend_lease", "FROM rentals WHERE id=%s FOR UPDATE",
+          lambda c, p: call_route(c, p, 'POST', f"/extend/{p['rental_id']}", json={"additional_hours": 1}),
+          max_rows=1, max_locked=1, locking=True),
+    Query("heartbeat_change_log", "api.worker_heartbeat", "INSERT INTO change_log", heartbeat,
+          max_rows=2, max_locked=5, locking=True),
+    Query("heartbeat", "api.worker_heartbeat", "UPDATE nodes SET", heartbeat,
+          max_rows=1, max_locked=2, locking=True),
+    Query("list_nodes_admin", "api.fetch_node_rows", "LEFT JOIN users u ON r.user_id = u.id",
+          lambda c, p: call_route(c, p, 'GET', '/nodes', role='admin'),
+          max_rows=lambda f: f.nodes * 4, full_scan_ok=('n',)),
+    Query("list_nodes_user", "api.fetch_node_rows", "r.user_id = %s",
+          lambda c, p: call_route(c, p, 'GET', '/nodes'), max_rows=100),
+    Query("list_nodes_admin_page", "api.fetch_node_rows", "page JOIN nodes n ON n.id = page.id",
+          lambda c, p: call_route(c, p, 'GET', '/nodes?status=alive&after=1000&limit=500', role='admin'),
+          # Page matérialisée (au plus `limit` lignes) relue en entier puis triée
+          max_rows=5000, full_scan_ok=('<derived2>',), allow_filesort=True),
+    Query("nodes_log_retention", "api.change_log_retains", "MIN(version) AS oldest",
+          lambda c, p: call_route(c, p, 'GET', f"/nodes?since={p['version']}", role='admin'),
+          # Première entrée de la clé primaire
+          max_rows=1),
+    Query("nodes_delta_changes", "api.read_changes", "FROM change_log WHERE version > %s ORDER BY version",
+          lambda c, p: call_route(c, p, 'GET', f"/nodes?since={p['version']}", role='admin'),
+          max_rows=10000),
+    Query("nodes_delta_rentals", "api.nodes_of_changes", "FROM rentals_archive WHERE id IN",
+          lambda c, p: call_route(c, p, 'GET', f"/nodes?since={p['version']}", role='admin'),
+          # Une lecture par clé primaire et par table pour chaque location journalisée
+          max_rows=5000),
+    Query("nodes_delta_rented", "api.rented_node_ids", "SELECT DISTINCT node_id FROM rentals",
+          lambda c, p: call_route(c, p, 'GET', f"/nodes?since={p['version']}&status=alive"),
+          max_rows=100),
+    Query("nodes_settled_version", "api.settled_change_version", "ORDER BY version DESC",
+          lambda c, p: call_route(c, p, 'GET', '/nodes', role='admin'),
+          # Parcours de la clé primaire à rebours (accès 'index') arrêté à la première ligne stable
+          max_rows=100, full_scan_ok=('change_log',)),
+    Query("nodes_etag_pending", "api.nodes_etag", "COUNT(*) AS pending",
+          lambda c, p: call_route(c, p, 'GET', '/nodes', role='admin'), max_rows=2000),
+
+    # --- Scheduler ---
+    Query("health_revive_change_log", "scheduler.job_health_check", "SELECT 'node', id FROM nodes WHERE status='unknown'",
+          lambda c, p: call_job(c, scheduler.job_health_check),
+          max_rows=lambda f: f.nodes // 5, max_locked=lambda f: f.nodes // 5, locking=True),
+    Query("health_revive_by_heartbeat", "scheduler.job_health_check", "UPDATE nodes SET status='alive'",
+          lambda c, p: call_job(c, scheduler.job_health_check),
+          max_rows=lambda f: f.nodes // 5, max_locked=lambda f: f.nodes // 5, locking=True),
+    Query("health_select_silent", "scheduler.job_health_check", "SELECT id, ip, ssh_port, status FROM nodes",
+          lambda c, p: call_job(c, scheduler.job_health_check),
+          max_rows=500, max_locked=500, locking=True),
+    Query("migrate_dead_nodes", "scheduler.job_migrate_dead_nodes", "SELECT id FROM nodes WHERE status='dead'",
+          lambda c, p: call_job(c, scheduler.job_migrate_dead_nodes),
+          max_rows=lambda f: f.nodes // 10, max_locked=lambda f: f.nodes // 10, locking=True),
+    Query("reassign_rentals", "scheduler.reassign_rental_on_node_failure", "WHERE r.node_id=%s AND r.active=TRUE",
+          lambda c, p: scheduler.reassign_rental_on_node_failure(p['dead_node'], c.cursor(dictionary=True)),
+          max_rows=20, max_locked=20, locking=True),
+    Query("reassign_replacements", "scheduler.reassign_rental_on_node_failure", "AND id != %s",
+          lambda c, p: scheduler.reassign_rental_on_node_failure(p['dead_node'], c.cursor(dictionary=True)),
+          max_rows=50, max_locked=20, locking=True),
+    Query("migration_retry_claim", "scheduler.claim_pending_migrations",
+          "WHERE status='provisioning' AND retry_after <= NOW()",
+          lambda c, p: scheduler.claim_pending_migrations(c),
+          max_rows=100, max_locked=100, locking=True),
+    Query("migration_retry_details", "scheduler.claim_pending_migrations", "FROM rental_migrations m",
+          lambda c, p: scheduler.claim_pending_migrations(c), max_rows=500),
+    Query("expiry_claim", "scheduler.claim_expired_leases", "SET expiry_claim=%s",
+          lambda c, p: scheduler.claim_expired_leases(c, p['claim']),
+          max_rows=500, max_locked=500, locking=True),
+    Query("expiry_claimed_select", "scheduler.claim_expired_leases", "WHERE r.expiry_claim=%s",
+          lambda c, p: scheduler.claim_expired_leases(c, p['claim']), max_rows=200),
+    Query("cleanup_dirty_nodes", "scheduler.job_cleanup_resurrected_nodes", "WHERE status='alive' AND needs_cleanup=TRUE",
+          lambda c, p: call_job(c, scheduler.job_cleanup_resurrected_nodes),
+          max_rows=lambda f: f.nodes // 50, max_locked=lambda f: f.nodes // 50, locking=True),
+    Query("cleanup_accounts", "scheduler.job_cleanup_resurrected_nodes", "FROM node_accounts a",
+          lambda c, p: call_job(c, scheduler.job_cleanup_resurrected_nodes),
+          # Tous les nœuds dirty (1 % de la flotte) : comptes du registre et locations actives de chacun
+          max_rows=lambda f: f.nodes // 100 * 40),
+    Query("lease_timer_load", "scheduler.LeaseTimer.load", "SELECT id, leased_until FROM rentals WHERE active=TRUE",
+          lambda c, p: scheduler.LeaseTimer(lambda: None).load(c.cursor(dictionary=True)),
+          max_rows=lambda f: f.nodes * 2),
+    Query("lease_timer_refresh", "scheduler.LeaseTimer.refresh", "AND entity='rental'",
+          refresh_lease_timer, max_rows=2000),
+    Query("archive_chunk", "scheduler.archive_rental_chunk", "WHERE active=FALSE AND ended_at <",
+          lambda c, p: scheduler.archive_rental_chunk(c),
+          max_rows=1000, max_locked=1000, locking=True),
+    Query("change_log_purge_scan", "scheduler.purge_change_log_chunk", "AS expired FROM change_log",
+          lambda c, p: scheduler.purge_change_log_chunk(c),
+          # Début de la clé primaire (accès 'index'), arrêté au LIMIT
+          max_rows=2000, full_scan_ok=('change_log',)),
+    Query("change_log_purge_delete", "scheduler.purge_change_log_chunk", "DELETE FROM change_log WHERE version <= %s",
+          lambda c, p: scheduler.purge_change_log_chunk(c),
+          max_rows=2000, max_locked=2000, locking=True),
+    Query("provisioning_sweep", "scheduler.fail_stale_provisioning_jobs", "WHERE j.status IN ('pending', 'running')",
+          lambda c, p: scheduler.fail_stale_provisioning_jobs(c),
+          # Jobs non terminés seulement (index status, updated_at), pas l'historique des jobs
+          max_rows=500, max_locked=200, locking=True),
+]
+
+
+# -----------------------
+# Analyse des plans
+# -----------------------
+def iter_tables(node):
+    """Nœuds 'table' d'un plan ANALYZE FORMAT=JSON (sous-requêtes comprises)."""
+    if isinstance(node, dict):
+        if 'table_name' in node and 'access_type' in node:
+            yield node
+        for value in node.values():
+            yield from iter_tables(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from iter_tables(value)
+
+def has_key(node, key):
+    if isinstance(node, dict):
+        return key in node or any(has_key(v, key) for v in node.values())
+    if isinstance(node, list):
+        return any(has_key(v, key) for v in node)
+    return False
+
+def summarize_plan(plan):
+    """Lignes examinées (r_loops x r_rows), accès par table et filesort d'un plan ANALYZE."""
+    result = PlanResult(time_ms=plan.get('query_block', {}).get('r_total_time_ms', 0))
+    for table in iter_tables(plan):
+        rows = (table.get('r_loops') or 0) * (table.get('r_rows') or 0)
+        result.examined += rows
+        result.tables.append((table['table_name'], table['access_type'], table.get('key'), rows))
+    result.filesort = has_key(plan, 'filesort')
+    return result
+
+def check_plan(query, result, fleet):
+    """Écarts d'un plan par rapport aux budgets de la requête (liste vide si conforme)."""
+    violations = []
+    for alias, access_type, key, rows in result.tables:
+        if access_type in ('ALL', 'index') and alias not in query.full_scan_ok:
+            violations.append(f"scan complet de {alias} ({access_type}, {rows:.0f} lignes)")
+    if result.filesort and not query.allow_filesort:
+        violations.append("filesort")
+    max_rows = query.budget(query.max_rows, fleet)
+    if result.examined > max_rows:
+        violations.append(f"{result.examined:.0f} lignes examinées > budget {max_rows}")
+    max_locked = query.budget(query.max_locked, fleet)
+    if max_locked is not None and result.locked is not None and result.locked > max_locked:
+        violations.append(f"{result.locked} lignes verrouillées > budget {max_locked}")
+    return violations
+
+
+# -----------------------
+# Base de test
+# -----------------------
+def connect(database=None):
+    # consume_results : un chemin de code arrêté par StatementRecorded peut laisser un résultat non lu
+    return mysql.connector.connect(host=PLAN_DB_HOST, port=PLAN_DB_PORT, user=PLAN_DB_USER,
+                                   password=PLAN_DB_PASSWORD, database=database, consume_results=True)
+
+def init_statements():
+    """Instructions de init.sql, appliquées à PLAN_DB_NAME."""
+    with open(INIT_SQL) as f:
+        lines = [line for line in f if not line.strip().startswith('--')]
+    for statement in ''.join(lines).split(';'):
+        statement = statement.strip()
+        if statement and not statement.upper().startswith('USE '):
+            yield statement
+
+def load_fleet(fleet):
+    """
+    Recrée PLAN_DB_NAME et charge la flotte :
+    - 5 % de nœuds dead, 5 % unknown, le reste alive ; 1 % dirty ;
+    - 70 % occupés (1 slot), 10 % à 4 slots dont 2 occupés, 20 % libres ;
+    - une location active par slot occupé (1 % expirées), le reste en historique clos ;
+    - une migration par location active des nœuds dead, 2 % encore à reprendre ;
+    - 100 000 lignes de change_log sur un peu plus d'une journée (purge à faire) ;
+    - 100 000 jobs de provisioning terminés, 100 jobs asynchrones figés depuis une heure.
+    """
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute(f"DROP DATABASE IF EXISTS {PLAN_DB_NAME}")
+    cur.execute(f"CREATE DATABASE {PLAN_DB_NAME}")
+    cur.execute(f"USE {PLAN_DB_NAME}")
+    for statement in init_statements():
+        cur.execute(statement)
+    cur.execute("SET SESSION foreign_key_checks=0, unique_checks=0")
+
+    cur.execute(f"""
+        INSERT INTO users (id, username, password_hash)
+        SELECT seq, CONCAT('user', seq), 'x' FROM seq_1_to_{fleet.users}
+    """)
+    cur.execute(f"""
+        INSERT INTO nodes (id, hostname, ip, ssh_port, status, last_checked, last_heartbeat, dead_since,
+                           cpu_cores, memory_mb, disk_gb, slots, slots_used, allocated, needs_cleanup)
+        SELECT seq, CONCAT('worker-', seq),
+               CONCAT('10.', seq DIV 65536, '.', seq DIV 256 MOD 256, '.', seq MOD 256), 22,
+               CASE seq MOD 20 WHEN 0 THEN 'dead' WHEN 1 THEN 'unknown' ELSE 'alive' END,
+               NOW() - INTERVAL seq MOD 30 SECOND,
+               IF(seq MOD 20 IN (0, 1), NOW() - INTERVAL 1 HOUR, NOW()),
+               IF(seq MOD 20 = 0, NOW() - INTERVAL 1 HOUR, NULL),
+               ELT(1 + seq MOD 4, 1, 2, 4, 8), ELT(1 + seq MOD 4, 1024, 2048, 4096, 8192),
+               ELT(1 + seq MOD 3, 10, 20, 50),
+               IF(seq MOD 10 = 9, 4, 1),
+               CASE WHEN seq MOD 10 < 7 THEN 1 WHEN seq MOD 10 = 9 THEN 2 ELSE 0 END,
+               seq MOD 10 < 7,
+               seq MOD 100 = 8
+        FROM seq_1_to_{fleet.nodes}
+    """)
+    cur.execute(f"""
+        INSERT INTO rentals (node_id, user_id, leased_from, leased_until, active)
+        SELECT n.id, 1 + (n.id * 4 + s.seq) MOD {fleet.users}, NOW() - INTERVAL 1 HOUR,
+               IF(n.id MOD 100 = 3, NOW() - INTERVAL 1 MINUTE, NOW() + INTERVAL 1 HOUR), TRUE
+        FROM nodes n JOIN seq_1_to_4 s ON s.seq <= n.slots_used
+    """)
+    active = cur.rowcount
+    conn.commit()
+
+    history = max(0, fleet.rentals - active)
+    for start in range(1, history + 1, LOAD_CHUNK):
+        end = min(history, start + LOAD_CHUNK - 1)
+        cur.execute(f"""
+            INSERT INTO rentals (node_id, user_id, leased_from, leased_until, active, ended_at)
+            SELECT 1 + seq MOD {fleet.nodes}, 1 + seq MOD {fleet.users},
+                   NOW() - INTERVAL seq MOD 720 HOUR - INTERVAL 1 HOUR,
+                   NOW() - INTERVAL seq MOD 720 HOUR, FALSE, NOW() - INTERVAL seq MOD 720 HOUR
+            FROM seq_{start}_to_{end}
+        """)
+        conn.commit()
+
+    cur.execute("""
+        INSERT IGNORE INTO node_accounts (node_id, username)
+        SELECT r.node_id, u.username FROM rentals r JOIN users u ON u.id = r.user_id WHERE r.active = TRUE
+    """)
+    cur.execute("INSERT IGNORE INTO node_accounts (node_id, username) SELECT id, 'ghost' FROM nodes WHERE needs_cleanup")
+    cur.execute("""
+        INSERT INTO rental_migrations (old_rental_id, new_rental_id, dead_node_id, new_node_id, status,
+                                       dead_since, restored_at, retry_after)
+        SELECT r.id, r.id, r.node_id, r.node_id, IF(r.id MOD 50 = 0, 'provisioning', 'restored'),
+               NOW() - INTERVAL 1 HOUR, IF(r.id MOD 50 = 0, NULL, NOW() - INTERVAL 50 MINUTE),
+               NOW() - INTERVAL 1 MINUTE
+        FROM rentals r JOIN nodes n ON n.id = r.node_id
+        WHERE r.active = TRUE AND n.status = 'dead'
+    """)
+    cur.execute("""
+        INSERT INTO change_log (entity, entity_id, created_at)
+        SELECT 'rental', seq, NOW() - INTERVAL (100000 - seq) SECOND FROM seq_1_to_100000
+    """)
+    cur.execute("""
+        INSERT INTO provisioning_jobs (id, user_id, status, created_at, updated_at)
+        SELECT MD5(seq), 1 + seq MOD 100, IF(seq <= 100, 'running', 'succeeded'),
+               NOW() - INTERVAL 1 HOUR, NOW() - INTERVAL 1 HOUR
+        FROM seq_1_to_100000
+    """)
+    cur.execute("""
+        INSERT INTO provisioning_job_items (job_id, rental_id, node_id, status, updated_at)
+        SELECT MD5(seq), seq, 1 + seq MOD 100, IF(seq <= 100, 'provisioning', 'ready'), NOW() - INTERVAL 1 HOUR
+        FROM seq_1_to_100000
+    """)
+    conn.commit()
+    cur.execute("ANALYZE TABLE nodes, rentals, users, node_accounts, rental_migrations, change_log, "
+                "provisioning_jobs, provisioning_job_items PERSISTENT FOR ALL")
+    cur.fetchall()
+    cur.close()
+    conn.close()
+
+def fleet_loaded():
+    try:
+        conn = connect(PLAN_DB_NAME)
+    except mysql.connector.Error:
+        return False
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM nodes")
+        return cur.fetchone()[0] > 0
+    except mysql.connector.Error:
+        return False
+    finally:
+        conn.close()
+
+def fleet_params(conn):
+    """Paramètres représentatifs tirés de la flotte chargée."""
+    cur = conn.cursor()
+
+    def scalar(sql, params=()):
+        cur.execute(sql, params)
+        return cur.fetchone()[0]
+
+    cur.execute("SELECT hostname, ip, ssh_port FROM nodes WHERE id=1")
+    identity = cur.fetchone()
+    params = {
+        'user_id': 1,
+        'rental_id': scalar("SELECT MIN(id) FROM rentals WHERE active=TRUE"),
+        'dead_node': scalar("SELECT MIN(id) FROM nodes WHERE status='dead' AND slots_used > 0"),
+        'identity': tuple(identity),
+        'claim': 'plan' * 8,
+        'version': max(0, scalar("SELECT COALESCE(MAX(version), 0) FROM change_log") - 1000),
+    }
+    cur.close()
+    return params
+
+def analyze(conn, query, statement):
+    """
+    Exécute la requête relevée (record_statement) sous ANALYZE FORMAT=JSON dans une
+    transaction annulée ensuite (les écritures ne sont pas conservées). Pour les requêtes
+    verrouillantes, relève les lignes verrouillées par la transaction.
+    """
+    sql, params = statement
+    cur = conn.cursor()
+    conn.start_transaction()
+    try:
+        cur.execute("ANALYZE FORMAT=JSON " + sql, params)
+        result = summarize_plan(json.loads(cur.fetchone()[0]))
+        if query.locking:
+            cur.execute("SELECT trx_rows_locked FROM information_schema.INNODB_TRX "
+                        "WHERE trx_mysql_thread_id = CONNECTION_ID()")
+            row = cur.fetchone()
+            result.locked = row[0] if row else 0
+    finally:
+        conn.rollback()
+        cur.close()
+    return result
+
+def measure_latency(conn, statement, repeat):
+    """Latences (ms) de `repeat` exécutions, chacune dans une transaction annulée."""
+    sql, params = statement
+    cur = conn.cursor()
+    timings = []
+    for _ in range(repeat):
+        conn.start_transaction()
+        started = time.perf_counter()
+        cur.execute(sql, params)
+        if cur.with_rows:
+            cur.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+        conn.rollback()
+    cur.close()
+    return sorted(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--load", action="store_true", help="recrée la base et charge la flotte")
+    parser.add_argument("--repeat", type=int, default=10, help="exécutions par requête pour la latence")
+    args = parser.parse_args()
+    if not PLAN_DB_HOST:
+        parser.error("PLAN_DB_HOST non défini")
+
+    fleet = Fleet()
+    if args.load or not fleet_loaded():
+        started = time.perf_counter()
+        load_fleet(fleet)
+        print(f"flotte chargée : {fleet.nodes} nœuds, {fleet.rentals} locations "
+              f"({time.perf_counter() - started:.0f} s)")
+
+    conn = connect(PLAN_DB_NAME)
+    p = fleet_params(conn)
+    failures = 0
+    print(f"{'requête':30s} {'examinées':>10s} {'verrous':>8s} {'p50 ms':>8s} {'p95 ms':>8s}  plan")
+    for query in CATALOG:
+        statement = record_statement(conn, query, p)
+        if statement is None:
+            failures += 1
+            print(f"{query.name:30s} !! requête absente du chemin de {query.source}")
+            continue
+        result = analyze(conn, query, statement)
+        timings = measure_latency(conn, statement, args.repeat)
+        violations = check_plan(query, result, fleet)
+        failures += bool(violations)
+        access = ', '.join(f"{alias}:{access_type}({key or '-'})" for alias, access_type, key, _ in result.tables)
+        print(f"{query.name:30s} {result.examined:10.0f} {str(result.locked if result.locked is not None else '-'):>8s} "
+              f"{statistics.median(timings):8.2f} {timings[max(0, int(len(timings) * 0.95) - 1)]:8.2f}  {access}")
+        for violation in violations:
+            print(f"    !! {violation}")
+    conn.close()
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
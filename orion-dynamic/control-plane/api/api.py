@@ -2,16 +2,28 @@
 import os
 import logging
 import tempfile
+import shutil
 import secrets
 import string
+import shlex
+import hashlib
+import json
+import queue
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
 import jwt
 import bcrypt
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from datetime import datetime, timedelta, timezone
 import mysql.connector
 from mysql.connector import errorcode
+from mysql.connector.constants import ClientFlag
 import ansible_runner
+import paramiko
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from cryptography.fernet import Fernet
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -36,6 +48,68 @@ DB_NAME = os.getenv('DB_NAME', 'orion_db')
 WORKER_SSH_USER = os.getenv('WORKER_SSH_USER', 'root')
 WORKER_SSH_PASS = os.getenv('WORKER_SSH_PASS', 'password')
 
+# Profil d'exécution Ansible : ansible.cfg généré, répertoires ansible-runner réutilisés
+# et sockets SSH ControlPersist partagés entre les runs
+ANSIBLE_PROFILE_DIR = os.getenv('ANSIBLE_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'orion-ansible'))
+ANSIBLE_CONTROL_PERSIST = os.getenv('ANSIBLE_CONTROL_PERSIST', '300s')
+# fast : suppression de compte en un seul aller-retour (delete_user_fast.yml) ; classic : delete_user.yml
+DEPROVISION_MODE = os.getenv('DEPROVISION_MODE', 'fast').lower()
+FAST_PLAYBOOKS = {'delete_user.yml': 'delete_user_fast.yml'}
+ANSIBLE_CFG_TEMPLATE = """[defaults]
+host_key_checking = False
+retry_files_enabled = False
+gathering = explicit
+
+[ssh_connection]
+pipelining = True
+ssh_args = -o ControlMaster=auto -o ControlPersist={persist}
+control_path_dir = {control_dir}
+control_path = %(directory)s/%%C
+"""
+
+# Backend de provisioning : 'ansible' (défaut), 'ssh' (scripts shell via session SSH réutilisée)
+# ou 'docker' (scripts shell via l'API exec de Docker, workers conteneurs locaux)
+PROVISIONER_BACKEND = os.getenv('PROVISIONER_BACKEND', 'ansible').lower()
+PROVISION_SCRIPTS_DIR = os.getenv('PROVISION_SCRIPTS_DIR', '/ansible/scripts')
+SSH_CONNECT_TIMEOUT = 5
+SSH_COMMAND_TIMEOUT = int(os.getenv('SSH_COMMAND_TIMEOUT', '60'))
+SSH_SESSION_IDLE_TIMEOUT = int(os.getenv('SSH_SESSION_IDLE_TIMEOUT', '300'))
+
+# /rent asynchrone : réservation courte + provisioning en arrière-plan
+RENT_ASYNC_DEFAULT = os.getenv('RENT_ASYNC_DEFAULT', 'false').lower() == 'true'
+PROVISION_WORKERS = int(os.getenv('PROVISION_WORKERS', '4'))
+# Nombre max de nœuds provisionnés en parallèle pour une même location
+PROVISION_CONCURRENCY = int(os.getenv('PROVISION_CONCURRENCY', '8'))
+# Allocation : nouvelles tentatives quand des nœuds libres sont verrouillés par un autre /rent
+ALLOC_MAX_ATTEMPTS = int(os.getenv('ALLOC_MAX_ATTEMPTS', '3'))
+ALLOC_RETRY_DELAY = float(os.getenv('ALLOC_RETRY_DELAY', '0.05'))  # s, croissant à chaque tentative
+# Slots par nœud déduits de la capacité déclarée (0 = critère ignoré ; sans critère, 1 slot
+# sauf si l'agent configure lui-même `slots`)
+SLOT_CPU_CORES = int(os.getenv('SLOT_CPU_CORES', '0'))
+SLOT_MEMORY_MB = int(os.getenv('SLOT_MEMORY_MB', '0'))
+# Flux de changements (/nodes?since=) : âge au-delà duquel une ligne de change_log est stable
+# (même valeur que le scheduler) et nombre max de changements relus avant de renvoyer
+# plutôt un instantané complet
+CHANGE_LOG_SETTLE = int(os.getenv('CHANGE_LOG_SETTLE', '5'))
+NODES_DELTA_LIMIT = int(os.getenv('NODES_DELTA_LIMIT', '5000'))
+# Pagination de /nodes : taille de page par défaut (si seul `after` est donné, et pages d'un
+# instantané `since=0`) et maximale, qui plafonne aussi la liste sans `limit`
+NODES_PAGE_DEFAULT = int(os.getenv('NODES_PAGE_DEFAULT', '500'))
+NODES_PAGE_MAX = int(os.getenv('NODES_PAGE_MAX', '1000'))
+# Flux SSE (/events) : période de lecture de change_log par le diffuseur du process,
+# intervalle des commentaires keepalive, événements en attente max par abonné et délai de
+# reconnexion conseillé au navigateur ; durée de vie du jeton de flux (?token=, visible dans
+# les journaux d'accès : réservé à /events et de courte durée)
+EVENTS_POLL_INTERVAL = float(os.getenv('EVENTS_POLL_INTERVAL', '0.5'))
+EVENTS_KEEPALIVE = int(os.getenv('EVENTS_KEEPALIVE', '15'))
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', '100'))
+EVENTS_RETRY_MS = int(os.getenv('EVENTS_RETRY_MS', '3000'))
+EVENTS_TOKEN_TTL = int(os.getenv('EVENTS_TOKEN_TTL', '30'))
+# Flux /events ouverts par process : chacun occupe un thread gunicorn pendant toute sa durée,
+# au-delà les nouveaux abonnés reçoivent 503 pour laisser des threads aux autres routes
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', '16'))
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv('EVENTS_MAX_SUBSCRIBERS') or max(1, GUNICORN_THREADS // 4))
+
 JWT_SECRET = os.getenv('JWT_SECRET', 'change_me_in_prod')
 JWT_EXPIRE_SECONDS = int(os.getenv('JWT_EXPIRE_SECONDS', '3600'))  # 1h default
 
@@ -46,6 +120,9 @@ if not ENCRYPTION_KEY:
     ENCRYPTION_KEY = Fernet.generate_key().decode()
 cipher_suite = Fernet(ENCRYPTION_KEY.encode())
 
+# Exécuteur des jobs de provisioning (un par worker gunicorn, threads créés à la demande)
+provisioning_executor = ThreadPoolExecutor(max_workers=PROVISION_WORKERS, thread_name_prefix='provision')
+
 # -----------------------
 # Password encryption helpers
 # -----------------------
@@ -62,18 +139,185 @@ def decrypt_password(encrypted_password):
     return cipher_suite.decrypt(encrypted_password.encode()).decode()
 
 # -----------------------
-# DB helper
+# DB helper (pool de connexions par worker gunicorn)
 # -----------------------
-def get_db_connection():
-    try:
-        conn = mysql.connector.connect(
+# Par défaut une connexion par thread gunicorn : un /rent synchrone garde la sienne pendant
+# tout le provisioning, les autres requêtes ne doivent pas l'attendre
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE') or GUNICORN_THREADS)
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))   # attente max d'une connexion libre (s)
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '300'))   # inactivité max avant fermeture (s)
+
+
+class PooledConnection:
+    """Connexion empruntée au pool : close() la rend au pool au lieu de la fermer."""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        self._pool.release(raw)
+
+
+class DBConnectionPool:
+    """
+    Pool borné de connexions MariaDB.
+    - checkout : réutilise la dernière connexion rendue (LIFO), vérifie qu'elle est
+      vivante (ping) et la recycle si elle est restée inactive trop longtemps ;
+    - si le pool est plein, attend au plus `timeout` secondes puis lève PoolError.
+    """
+
+    def __init__(self, max_size, timeout, recycle):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pid = os.getpid()
+        self._idle = []   # pile de (connexion, instant de retour au pool)
+        self._size = 0    # connexions ouvertes (libres + empruntées)
+        self._cond = threading.Condition()
+        self._counters = {
+            "checkouts": 0, "waits": 0, "wait_time_ms": 0.0, "exhausted": 0,
+            "created": 0, "recycled": 0, "dead": 0,
+        }
+
+    def _connect(self):
+        # FOUND_ROWS : rowcount d'un UPDATE = lignes trouvées, pas seulement modifiées.
+        # Deux heartbeats dans la même seconde ne changent rien mais le nœud existe bien.
+        return mysql.connector.connect(
             host=DB_HOST,
             user=DB_USER,
             password=DB_PASS,
             database=DB_NAME,
-            autocommit=False
+            autocommit=False,
+            client_flags=[ClientFlag.FOUND_ROWS]
         )
-        return conn
+
+    @staticmethod
+    def _close_quietly(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _discard(self, raw):
+        self._close_quietly(raw)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            self._counters["checkouts"] += 1
+            if not self._idle and self._size >= self.max_size:
+                self._counters["waits"] += 1
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters["exhausted"] += 1
+                        raise mysql.connector.errors.PoolError(
+                            f"Pool DB saturé ({self.max_size} connexions)")
+                    self._cond.wait(remaining)
+                self._counters["wait_time_ms"] += (time.monotonic() - start) * 1000
+            if self._idle:
+                raw, released_at = self._idle.pop()
+            else:
+                raw, released_at = None, None
+                self._size += 1
+
+        # Validation hors verrou : le ping ne doit pas bloquer les autres threads
+        if raw is not None:
+            if time.monotonic() - released_at > self.recycle:
+                self._count("recycled")
+                self._close_quietly(raw)
+                raw = None
+            else:
+                try:
+                    raw.ping(reconnect=False)
+                except Exception:
+                    self._count("dead")
+                    self._close_quietly(raw)
+                    raw = None
+
+        if raw is None:
+            try:
+                raw = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            self._count("created")
+        return PooledConnection(self, raw)
+
+    def release(self, raw):
+        # Une transaction laissée ouverte par un handler ne doit pas fuiter vers le suivant
+        try:
+            if raw.in_transaction:
+                raw.rollback()
+        except Exception:
+            self._count("dead")
+            self._discard(raw)
+            return
+
+        now = time.monotonic()
+        stale = []
+        with self._cond:
+            self._idle.append((raw, now))
+            # Les connexions du fond de la pile sont les plus anciennes
+            while self._idle and now - self._idle[0][1] > self.recycle:
+                stale.append(self._idle.pop(0)[0])
+                self._size -= 1
+                self._counters["recycled"] += 1
+            self._cond.notify()
+        for old in stale:
+            self._close_quietly(old)
+
+    def _count(self, key):
+        with self._cond:
+            self._counters[key] += 1
+
+    def snapshot(self):
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "pid": self.pid,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": idle,
+                "in_use": self._size - idle,
+                **self._counters,
+            }
+
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Pool du process courant ; recréé après un fork (workers gunicorn)."""
+    global _db_pool
+    pool = _db_pool
+    if pool is None or pool.pid != os.getpid():
+        with _db_pool_lock:
+            if _db_pool is None or _db_pool.pid != os.getpid():
+                # Ne pas fermer les connexions héritées : les sockets appartiennent au parent
+                _db_pool = DBConnectionPool(DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_RECYCLE)
+            pool = _db_pool
+    return pool
+
+def get_db_connection():
+    try:
+        return get_db_pool().acquire()
+    except mysql.connector.errors.PoolError as err:
+        app.logger.warning(f"Aucune connexion DB disponible: {err}")
+        return None
     except mysql.connector.Error as err:
         app.logger.error(f"Erreur de connexion a la DB: {err}")
         return None
@@ -83,6 +327,78 @@ def get_db_connection():
 # -----------------------
 # Ansible runner (existing)
 # -----------------------
+class AnsibleEventCollector:
+    """
+    event_handler d'ansible-runner : retient les échecs de tâches (hors ignore_errors).
+    Seul playbook_on_stats est écrit dans les artefacts (job_events) : Runner.stats le
+    relit pour le bilan par hôte, les autres événements restent en mémoire.
+    """
+    FAILURE_EVENTS = ('runner_on_failed', 'runner_on_unreachable')
+    KEPT_EVENTS = ('playbook_on_stats',)
+
+    def __init__(self):
+        self.failures = []
+
+    def __call__(self, event):
+        if event.get('event') in self.FAILURE_EVENTS:
+            data = event.get('event_data') or {}
+            if not data.get('ignore_errors'):
+                res = data.get('res') or {}
+                detail = res.get('msg') or res.get('stderr') or ''
+                self.failures.append(f"{data.get('host')} / {data.get('task')}: {detail}")
+        return event.get('event') in self.KEPT_EVENTS
+
+_ansible_local = threading.local()
+_ansible_cfg_lock = threading.Lock()
+
+def get_ansible_config():
+    """
+    ansible.cfg du profil, généré une fois : pipelining (un seul aller-retour SSH par
+    tâche) et sockets ControlPersist réutilisés d'un run à l'autre vers un même worker.
+    """
+    path = os.path.join(ANSIBLE_PROFILE_DIR, 'ansible.cfg')
+    with _ansible_cfg_lock:
+        if not os.path.exists(path):
+            control_dir = os.path.join(ANSIBLE_PROFILE_DIR, 'cp')
+            os.makedirs(control_dir, mode=0o700, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}"
+            with open(tmp_path, 'w') as f:
+                f.write(ANSIBLE_CFG_TEMPLATE.format(persist=ANSIBLE_CONTROL_PERSIST, control_dir=control_dir))
+            os.replace(tmp_path, path)
+    return path
+
+def get_private_data_dir():
+    """Répertoire ansible-runner réutilisé par thread, au lieu d'un répertoire temporaire par run."""
+    if getattr(_ansible_local, 'pid', None) != os.getpid():
+        _ansible_local.path = os.path.join(ANSIBLE_PROFILE_DIR, f"runner-{os.getpid()}-{threading.get_ident()}")
+        _ansible_local.pid = os.getpid()
+        os.makedirs(_ansible_local.path, mode=0o700, exist_ok=True)
+    return _ansible_local.path
+
+def run_ansible_profiled(playbook_name, inventory, **kwargs):
+    """ansible_runner.run avec le profil de performance ; retourne (runner, échecs)."""
+    private_data_dir = get_private_data_dir()
+    collector = AnsibleEventCollector()
+    if DEPROVISION_MODE == 'fast':
+        playbook_name = FAST_PLAYBOOKS.get(playbook_name, playbook_name)
+    try:
+        r = ansible_runner.run(
+            private_data_dir=private_data_dir,
+            playbook=f"/ansible/{playbook_name}",
+            inventory=inventory,
+            envvars={'ANSIBLE_CONFIG': get_ansible_config()},
+            event_handler=collector,
+            quiet=True,
+            suppress_output_file=True,
+            rotate_artifacts=1,
+            **kwargs
+        )
+    finally:
+        # Inventaire et extravars contiennent des mots de passe : ne pas les laisser sur disque
+        for sub in ('inventory', 'env'):
+            shutil.rmtree(os.path.join(private_data_dir, sub), ignore_errors=True)
+    return r, collector.failures
+
 def run_ansible_provision(playbook_name, host_ip, host_port, client_user, client_pass):
     inventory = {
         'all': {
@@ -103,27 +419,210 @@ def run_ansible_provision(playbook_name, host_ip, host_port, client_user, client
         "target_pass": client_pass
     }
 
-    playbook_path = f"/ansible/{playbook_name}"
     app.logger.info(f"Execution d'Ansible ({playbook_name}) sur {host_ip}:{host_port} pour {client_user}...")
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        r = ansible_runner.run(
-            private_data_dir=tmpdir,
-            playbook=playbook_path,
-            inventory=inventory,
-            extravars=extravars
-        )
-        if r.rc != 0:
-            try:
-                app.logger.error(f"echec d'Ansible pour {host_ip}:{host_port}. RC={r.rc}")
-                app.logger.error(f"STDOUT: {r.stdout.read()}")
-                app.logger.error(f"STDERR: {r.stderr.read()}")
-            except Exception:
-                pass
-            return False
+    r, failures = run_ansible_profiled(playbook_name, inventory, extravars=extravars)
+    if r.rc != 0:
+        app.logger.error(f"echec d'Ansible pour {host_ip}:{host_port}. RC={r.rc}")
+        for failure in failures:
+            app.logger.error(f"Tâche en échec : {failure}")
+        return False
     app.logger.info(f"Ansible a termine avec succes pour {client_user} sur {host_ip}:{host_port}.")
     return True
 
+# -----------------------
+# Provisioner SSH direct (session paramiko réutilisée)
+# -----------------------
+class SSHSessionPool:
+    """
+    Garde une session SSH ouverte par worker (host, port) et y ouvre un canal par
+    opération, ce qui évite le démarrage d'ansible-playbook et le handshake SSH à
+    chaque provisioning. Les sessions inactives depuis `idle_timeout` sont fermées.
+    """
+
+    def __init__(self, idle_timeout):
+        self.idle_timeout = idle_timeout
+        self.pid = os.getpid()
+        self._sessions = {}   # (host, port) -> [client, dernier usage]
+        self._locks = {}      # (host, port) -> verrou de création de la session
+        self._lock = threading.Lock()
+
+    def _connect(self, host, port):
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(hostname=host, port=port, username=WORKER_SSH_USER,
+                       password=WORKER_SSH_PASS, timeout=SSH_CONNECT_TIMEOUT,
+                       allow_agent=False, look_for_keys=False)
+        client.get_transport().set_keepalive(30)
+        return client
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, (client, last_used) in list(self._sessions.items()):
+                if now - last_used > self.idle_timeout:
+                    expired.append(client)
+                    del self._sessions[key]
+        for client in expired:
+            client.close()
+
+    def _get(self, host, port):
+        key = (host, port)
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._sessions.get(key)
+            if entry:
+                transport = entry[0].get_transport()
+                if transport is not None and transport.is_active():
+                    entry[1] = time.monotonic()
+                    return entry[0]
+                entry[0].close()
+            client = self._connect(host, port)
+            with self._lock:
+                self._sessions[key] = [client, time.monotonic()]
+            return client
+
+    def drop(self, host, port):
+        with self._lock:
+            entry = self._sessions.pop((host, port), None)
+        if entry:
+            entry[0].close()
+
+    def run(self, host, port, command, stdin_data=None):
+        """Exécute `command` sur le worker ; retourne (rc, stdout, stderr)."""
+        self._evict_idle()
+        for attempt in (1, 2):
+            client = self._get(host, port)
+            try:
+                stdin, stdout, stderr = client.exec_command(command, timeout=SSH_COMMAND_TIMEOUT)
+                if stdin_data is not None:
+                    stdin.write(stdin_data)
+                stdin.channel.shutdown_write()
+                out = stdout.read().decode(errors='replace')
+                err = stderr.read().decode(errors='replace')
+                return stdout.channel.recv_exit_status(), out, err
+            except (paramiko.SSHException, EOFError, OSError):
+                # Session cassée (worker redémarré, timeout...) : une seule nouvelle tentative
+                self.drop(host, port)
+                if attempt == 2:
+                    raise
+
+
+_ssh_sessions = None
+_ssh_sessions_lock = threading.Lock()
+
+def get_ssh_sessions():
+    """Sessions SSH du process courant ; recréées après un fork."""
+    global _ssh_sessions
+    with _ssh_sessions_lock:
+        if _ssh_sessions is None or _ssh_sessions.pid != os.getpid():
+            _ssh_sessions = SSHSessionPool(SSH_SESSION_IDLE_TIMEOUT)
+        return _ssh_sessions
+
+_script_cache = {}
+
+def load_provision_script(playbook_name):
+    """Script shell équivalent au playbook (ansible/scripts/<nom>.sh), ou None."""
+    name = os.path.splitext(playbook_name)[0] + '.sh'
+    if name not in _script_cache:
+        path = os.path.join(PROVISION_SCRIPTS_DIR, name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            _script_cache[name] = f.read()
+    return _script_cache[name]
+
+def build_script_command(script, *args):
+    """Commande `sh -c <script> sh <args>` (avec sudo si l'utilisateur SSH n'est pas root)."""
+    command = ' '.join(['sh', '-c', shlex.quote(script), 'sh'] + [shlex.quote(a) for a in args])
+    if WORKER_SSH_USER != 'root':
+        command = 'sudo -n ' + command
+    return command
+
+def run_ssh_provision(playbook_name, host_ip, host_port, client_user, client_pass):
+    """
+    Exécute l'équivalent shell d'un playbook via une session SSH réutilisée.
+    Retourne False si le script échoue ; lève une exception si le worker est injoignable.
+    """
+    script = load_provision_script(playbook_name)
+    if script is None:
+        raise ValueError(f"Aucun script SSH pour {playbook_name}")
+    command = build_script_command(script, client_user)
+    stdin_data = f"{client_pass or ''}\n"
+
+    started = time.monotonic()
+    rc, out, err = get_ssh_sessions().run(host_ip, host_port, command, stdin_data)
+    elapsed_ms = (time.monotonic() - started) * 1000
+    if rc != 0:
+        app.logger.error(f"echec SSH ({playbook_name}) pour {host_ip}:{host_port}. RC={rc}")
+        app.logger.error(f"STDOUT: {out}")
+        app.logger.error(f"STDERR: {err}")
+        return False
+    app.logger.info(f"{playbook_name} via SSH pour {client_user} sur {host_ip}:{host_port} en {elapsed_ms:.0f} ms.")
+    return True
+
+# -----------------------
+# Provisioner Docker exec (workers conteneurs sur le même hôte)
+# -----------------------
+_docker_client = None
+
+def get_docker_client():
+    """Client Docker Engine (socket monté), créé à la demande : dépendance optionnelle."""
+    global _docker_client
+    if _docker_client is None:
+        import docker
+        _docker_client = docker.from_env()
+    return _docker_client
+
+def run_docker_provision(playbook_name, container_name, client_user, client_pass):
+    """
+    Exécute l'équivalent shell d'un playbook dans le conteneur du worker via l'API exec
+    de Docker, sans SSH. Le mot de passe passe par l'environnement de l'exec (TARGET_PASS).
+    Retourne False si le script échoue ; lève une exception si le conteneur est introuvable.
+    """
+    script = load_provision_script(playbook_name)
+    if script is None:
+        raise ValueError(f"Aucun script pour {playbook_name}")
+    users = client_user if isinstance(client_user, (list, tuple)) else [client_user]
+    container = get_docker_client().containers.get(container_name)
+
+    started = time.monotonic()
+    rc, output = container.exec_run(["sh", "-c", script, "sh", *users], user="root",
+                                    environment={"TARGET_PASS": client_pass or ""})
+    elapsed_ms = (time.monotonic() - started) * 1000
+    if rc != 0:
+        app.logger.error(f"echec Docker exec ({playbook_name}) dans {container_name}. RC={rc}")
+        app.logger.error(f"OUTPUT: {output}")
+        return False
+    app.logger.info(f"{playbook_name} via Docker exec pour {client_user} dans {container_name} en {elapsed_ms:.0f} ms.")
+    return True
+
+def run_provision(playbook_name, host_ip, host_port, client_user, client_pass, container_name=None):
+    """
+    Point d'entrée du provisioning : backend PROVISIONER_BACKEND, Ansible en repli.
+    Le backend docker n'est utilisé que pour les nœuds dont le conteneur est connu.
+    """
+    if PROVISIONER_BACKEND == 'docker' and container_name:
+        try:
+            return run_docker_provision(playbook_name, container_name, client_user, client_pass)
+        except Exception as e:
+            app.logger.warning(f"Provisioner Docker indisponible pour {container_name} ({e}), repli sur Ansible")
+    elif PROVISIONER_BACKEND == 'ssh':
+        try:
+            return run_ssh_provision(playbook_name, host_ip, host_port, client_user, client_pass)
+        except Exception as e:
+            app.logger.warning(f"Provisioner SSH indisponible pour {host_ip}:{host_port} ({e}), repli sur Ansible")
+    return run_ansible_provision(
+        playbook_name=playbook_name,
+        host_ip=host_ip,
+        host_port=host_port,
+        client_user=client_user,
+        client_pass=client_pass
+    )
+
 # -----------------------
 # Auth helpers / decorators
 # -----------------------
@@ -140,6 +639,19 @@ def generate_jwt(user_id, username, role):
         token = token.decode()
     return token
 
+def generate_stream_token(user):
+    """Jeton du flux /events : réservé à cet usage (`purpose`) et valable EVENTS_TOKEN_TTL secondes."""
+    payload = {
+        "user_id": user["user_id"],
+        "role": user["role"],
+        "purpose": "events",
+        "exp": datetime.now(timezone.utc) + timedelta(seconds=EVENTS_TOKEN_TTL)
+    }
+    token = jwt.encode(payload, JWT_SECRET, algorithm="HS256")
+    if isinstance(token, bytes):
+        token = token.decode()
+    return token
+
 def decode_jwt(token):
     return jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
 
@@ -156,6 +668,9 @@ def require_auth(f):
             return jsonify({"error": "Token expire"}), 401
         except Exception:
             return jsonify({"error": "Token invalide"}), 401
+        if payload.get("purpose"):
+            # Jeton à usage restreint (flux /events) : pas un jeton de session
+            return jsonify({"error": "Token invalide"}), 401
 
         # Attach user info to request
         request.user = {
@@ -192,6 +707,103 @@ def get_user_by_id(conn, user_id):
     cur.close()
     return user
 
+def record_change(cur, entity, entity_ids):
+    """
+    Journalise dans change_log les entités modifiées, dans la transaction de la
+    modification : le scheduler relit ce journal pour suivre les fins de bail, le
+    dashboard pour ne recharger que les nœuds modifiés (/nodes?since=).
+    """
+    if entity_ids:
+        cur.executemany("INSERT INTO change_log (entity, entity_id) VALUES (%s, %s)",
+                        [(entity, entity_id) for entity_id in entity_ids])
+
+def ledger_add_accounts(cur, node_ids, username):
+    """
+    Registre node_accounts : comptes clients pouvant exister sur chaque nœud. Inscrits
+    avant le provisioning, retirés après une suppression réussie ; le nettoyage d'un
+    nœud dirty ne supprime que ces comptes-là.
+    """
+    if node_ids:
+        cur.executemany("INSERT IGNORE INTO node_accounts (node_id, username) VALUES (%s, %s)",
+                        [(node_id, username) for node_id in node_ids])
+
+def claim_free_nodes(cur, count, min_cpu=0, min_memory_mb=0, min_disk_gb=0, user_id=None):
+    """
+    Verrouille jusqu'à `count` nœuds ayant un slot libre dans la transaction courante.
+    SKIP LOCKED : les nœuds déjà verrouillés par un autre /rent sont ignorés au lieu
+    d'être attendus. Si le lot est incomplet alors que des nœuds
+    libres existent, on réessaie : ceux verrouillés par un rent annulé se libèrent.
+    Les nœuds déjà obtenus restent verrouillés et sont renvoyés à nouveau.
+    Les nœuds partiellement occupés passent avant les nœuds vides (remplissage des slots),
+    puis best fit : parmi les nœuds dont la part par slot satisfait les minima de ressources,
+    les plus petits d'abord, pour garder les gros nœuds disponibles.
+    Un nœud où `user_id` a déjà une location active est exclu (un compte par client et par nœud).
+    """
+    conditions = """
+            status='alive' AND allocated=FALSE AND needs_cleanup=FALSE
+              AND cpu_cores >= %s * slots AND memory_mb >= %s * slots AND disk_gb >= %s * slots"""
+    params = [int(min_cpu), int(min_memory_mb), int(min_disk_gb)]
+    if user_id is not None:
+        conditions += """
+              AND NOT EXISTS (SELECT 1 FROM rentals r WHERE r.node_id = nodes.id AND r.user_id = %s AND r.active = TRUE)"""
+        params.append(user_id)
+    params = tuple(params)
+
+    nodes = []
+    for attempt in range(ALLOC_MAX_ATTEMPTS):
+        cur.execute(f"""
+            SELECT * FROM nodes
+            WHERE {conditions}
+            ORDER BY idle, cpu_cores, memory_mb, disk_gb, id
+            LIMIT {int(count)}
+            FOR UPDATE SKIP LOCKED
+        """, params)
+        nodes = cur.fetchall()
+        if len(nodes) >= count or attempt == ALLOC_MAX_ATTEMPTS - 1:
+            break
+
+        # Lecture non verrouillante : inutile d'insister s'il n'y a pas assez de nœuds libres
+        cur.execute(f"""
+            SELECT id FROM nodes
+            WHERE {conditions}
+            LIMIT {int(count)}
+        """, params)
+        if len(cur.fetchall()) < count:
+            break
+        app.logger.info(f"Allocation partielle ({len(nodes)}/{count}), nouvelle tentative...")
+        time.sleep(ALLOC_RETRY_DELAY * (attempt + 1))
+    return nodes
+
+CAPACITY_FIELDS = ('cpu_cores', 'memory_mb', 'disk_gb')
+
+def parse_capacity(data):
+    """Capacité déclarée par un agent (champs présents uniquement). ValueError si invalide."""
+    capacity = {}
+    for field in CAPACITY_FIELDS:
+        if data.get(field) is not None:
+            value = int(data[field])
+            if value < 0:
+                raise ValueError(field)
+            capacity[field] = value
+    return capacity
+
+def compute_slots(data, capacity):
+    """
+    Nombre de slots (locataires simultanés) d'un nœud : `slots` configuré par l'agent,
+    sinon déduit de la capacité (SLOT_CPU_CORES, SLOT_MEMORY_MB). None si indéterminé.
+    """
+    if data.get('slots') is not None:
+        slots = int(data['slots'])
+        if slots < 1:
+            raise ValueError('slots')
+        return slots
+    shares = []
+    if SLOT_CPU_CORES > 0 and capacity.get('cpu_cores'):
+        shares.append(capacity['cpu_cores'] // SLOT_CPU_CORES)
+    if SLOT_MEMORY_MB > 0 and capacity.get('memory_mb'):
+        shares.append(capacity['memory_mb'] // SLOT_MEMORY_MB)
+    return max(1, min(shares)) if shares else None
+
 # -----------------------
 # Schemas de validation
 # -----------------------
@@ -294,7 +906,11 @@ def rent_nodes():
     {
       "duration_hours": 2,
       "count": 1,
-      "ssh_password": "chosen_by_user"  # optional; if not provided API generates one per node
+      "ssh_password": "chosen_by_user",  # optional; if not provided API generates one per node
+      "async": false,                    # optional; true => 202 + job de provisioning en arrière-plan
+      "min_cpu": 2,                      # optional; minima de ressources par nœud (best fit)
+      "min_memory_mb": 2048,
+      "min_disk_gb": 10
     }
     """
     import secrets, string
@@ -319,7 +935,16 @@ def rent_nodes():
     except Exception:
         count = 1
 
+    # Minima de ressources par nœud (optionnels)
+    try:
+        requirements = {key: int(data.get(key) or 0) for key in ("min_cpu", "min_memory_mb", "min_disk_gb")}
+        if any(v < 0 for v in requirements.values()):
+            raise ValueError()
+    except Exception:
+        return jsonify({"error": "min_cpu, min_memory_mb et min_disk_gb doivent être des entiers positifs"}), 400
+
     ssh_password_given = data.get("ssh_password")  # optional
+    async_mode = str(data.get("async", RENT_ASYNC_DEFAULT)).lower() in ("1", "true", "yes")
 
     conn = get_db_connection()
     if not conn:
@@ -329,21 +954,15 @@ def rent_nodes():
         conn.start_transaction()
         cur = conn.cursor(dictionary=True)
 
-        # Récupérer les noeuds libres
-        cur.execute(f"""
-            SELECT * FROM nodes
-            WHERE status='alive' AND allocated=FALSE AND needs_cleanup=FALSE
-            ORDER BY last_checked DESC
-            LIMIT {count}
-            FOR UPDATE
-        """)
-        nodes = cur.fetchall()
+        # Réserver les noeuds libres (sans attendre les autres locataires)
+        nodes = claim_free_nodes(cur, count, user_id=request.user["user_id"], **requirements)
 
         if not nodes or len(nodes) < count:
             conn.rollback()
             return jsonify({"error": "Pas assez de workers libres", "found": len(nodes)}), 503
 
         allocated = []
+        targets = []
         now = datetime.now(timezone.utc)
         lease_end = now + timedelta(hours=duration_hours)
 
@@ -368,22 +987,18 @@ def rent_nodes():
             """
             cur.execute(insert_rental, (node_id, request.user["user_id"], now, lease_end, encrypted_pass))
             rental_id = cur.lastrowid
-            cur.execute("UPDATE nodes SET allocated=TRUE WHERE id=%s", (node_id,))
-            
-            # Provisioning
-            success = run_ansible_provision(
-                playbook_name='create_user.yml',
-                host_ip=host_ip,
-                host_port=port,
-                client_user=client_name,
-                client_pass=client_pass
-            )
-
-            if not success:
-                app.logger.error(f"Provisioning failed for node {node_id}, rolling back transaction")
-                conn.rollback()
-                return jsonify({"error": "Échec du provisioning; transaction annulée"}), 500
+            # Un slot de plus ; le nœud n'est "allocated" (exclu de /rent) qu'une fois plein
+            cur.execute("UPDATE nodes SET slots_used = slots_used + 1, allocated = (slots_used >= slots) WHERE id=%s",
+                        (node_id,))
 
+            targets.append({
+                "rental_id": rental_id,
+                "node_id": node_id,
+                "host_ip": host_ip,
+                "ssh_port": port,
+                "client_pass": client_pass,
+                "container_name": node.get("container_name"),
+            })
             allocated.append({
                 "rental_id": rental_id,
                 "host_ip": "host.docker.internal" if node["ip"].startswith("172.17.") else node["ip"],
@@ -393,6 +1008,40 @@ def rent_nodes():
                 "leased_until": lease_end.isoformat(),
             })
 
+        if async_mode:
+            # Réservation courte : on commit tout de suite (libère les verrous sur nodes)
+            # et le provisioning part en arrière-plan.
+            job_id = uuid.uuid4().hex
+            cur.execute(
+                "INSERT INTO provisioning_jobs (id, user_id, status) VALUES (%s, %s, 'pending')",
+                (job_id, request.user["user_id"])
+            )
+            cur.executemany(
+                "INSERT INTO provisioning_job_items (job_id, rental_id, node_id, status) VALUES (%s, %s, %s, 'pending')",
+                [(job_id, t["rental_id"], t["node_id"]) for t in targets]
+            )
+            record_change(cur, 'rental', [t["rental_id"] for t in targets])
+            ledger_add_accounts(cur, [t["node_id"] for t in targets], client_name)
+            conn.commit()
+            provisioning_executor.submit(run_provisioning_job, job_id, client_name, targets)
+
+            for a in allocated:
+                a["status"] = "pending"
+            return jsonify({"job_id": job_id, "status": "pending", "allocated": allocated}), 202
+
+        # Provisioning synchrone (transaction et verrous conservés jusqu'au commit)
+        leaked = []
+        failed = provision_nodes(client_name, targets, leaked=leaked)
+        if failed:
+            app.logger.error(f"Provisioning failed for nodes {[t['node_id'] for t in failed]}, rolling back transaction")
+            conn.rollback()
+            # Le rollback efface aussi le registre : les comptes restés en place y sont
+            # réinscrits, une fois les verrous relâchés
+            mark_leaked_accounts([t["node_id"] for t in leaked], client_name)
+            return jsonify({"error": "Échec du provisioning; transaction annulée"}), 500
+
+        record_change(cur, 'rental', [t["rental_id"] for t in targets])
+        ledger_add_accounts(cur, [t["node_id"] for t in targets], client_name)
         conn.commit()
         return jsonify({"allocated": allocated}), 200
 
@@ -411,6 +1060,271 @@ def rent_nodes():
         conn.close()
 
 
+# -----------------------
+# Provisioning parallèle d'une location
+# -----------------------
+def run_on_nodes(playbook_name, client_user, targets, on_status=None, fail_fast=False):
+    """
+    Lance un playbook sur plusieurs nœuds en parallèle (au plus PROVISION_CONCURRENCY à la fois).
+    Retourne (succeeded, failed). Avec fail_fast, les nœuds pas encore démarrés sont
+    abandonnés dès le premier échec.
+    """
+    def run_one(t):
+        if on_status:
+            on_status(t, 'provisioning')
+        try:
+            ok = run_provision(
+                playbook_name=playbook_name,
+                host_ip=t["host_ip"],
+                host_port=t["ssh_port"],
+                client_user=client_user,
+                client_pass=t["client_pass"],
+                container_name=t.get("container_name")
+            )
+        except Exception as e:
+            app.logger.error(f"Exception Ansible ({playbook_name}) sur le nœud {t['node_id']}: {e}")
+            ok = False
+        if on_status:
+            on_status(t, 'ready' if ok else 'failed')
+        return ok
+
+    succeeded, failed = [], []
+    if not targets:
+        return succeeded, failed
+
+    workers = max(1, min(PROVISION_CONCURRENCY, len(targets)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='provision-node') as pool:
+        futures = {pool.submit(run_one, t): t for t in targets}
+        for fut in as_completed(futures):
+            if fut.cancelled():
+                continue
+            t = futures[fut]
+            if fut.result():
+                succeeded.append(t)
+            else:
+                failed.append(t)
+                if fail_fast:
+                    for other in futures:
+                        other.cancel()
+    return succeeded, failed
+
+def provision_nodes(client_user, targets, on_status=None, leaked=None):
+    """
+    Crée le compte client sur tous les nœuds d'une location, en parallèle.
+    Tout ou rien : si un nœud échoue, les comptes déjà créés sont supprimés.
+    Retourne la liste des nœuds en échec (vide si succès) ; les nœuds dont le compte
+    n'a pas pu être supprimé sont ajoutés à `leaked`.
+    """
+    started = time.monotonic()
+    succeeded, failed = run_on_nodes('create_user.yml', client_user, targets,
+                                     on_status=on_status, fail_fast=True)
+    if failed and succeeded:
+        app.logger.warning(f"Rollback du provisioning de {client_user} sur {len(succeeded)} nœud(s)")
+        _, rollback_failed = run_on_nodes('delete_user.yml', client_user, succeeded)
+        for t in rollback_failed:
+            app.logger.error(f"Rollback impossible sur le nœud {t['node_id']} (compte laissé au nettoyage du scheduler)")
+        if leaked is not None:
+            leaked.extend(rollback_failed)
+        if on_status:
+            for t in succeeded:
+                on_status(t, 'cancelled')
+    app.logger.info(
+        f"Provisioning de {len(targets)} nœud(s) pour {client_user} en {time.monotonic() - started:.1f}s "
+        f"({len(failed)} échec(s))")
+    return failed
+
+
+# -----------------------
+# Provisioning asynchrone (jobs /rent)
+# -----------------------
+def update_provisioning_job(sql, params):
+    """Exécute une mise à jour d'état de job dans sa propre transaction."""
+    conn = get_db_connection()
+    if not conn:
+        app.logger.error("Mise à jour du job de provisioning impossible: DB non disponible")
+        return False
+    cur = None
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        conn.commit()
+        return True
+    except Exception as e:
+        app.logger.error(f"Erreur mise à jour job de provisioning: {e}")
+        try:
+            conn.rollback()
+        except:
+            pass
+        return False
+    finally:
+        if cur:
+            cur.close()
+        conn.close()
+
+def set_job_status(job_id, status, error=None):
+    # Un job terminé (ou passé en échec par le balayage du scheduler) ne change plus d'état
+    return update_provisioning_job(
+        "UPDATE provisioning_jobs SET status=%s, error=%s WHERE id=%s AND status IN ('pending', 'running')",
+        (status, error, job_id))
+
+def set_job_item_status(job_id, rental_id, status, error=None):
+    return update_provisioning_job(
+        "UPDATE provisioning_job_items SET status=%s, error=%s WHERE job_id=%s AND rental_id=%s",
+        (status, error, job_id, rental_id))
+
+def mark_leaked_accounts(node_ids, username):
+    """
+    Inscrit au registre, dans sa propre transaction, un compte que le rollback d'un /rent
+    n'a pas pu supprimer et marque ses nœuds dirty : le scheduler le supprimera.
+    """
+    if not node_ids:
+        return True
+    conn = get_db_connection()
+    if not conn:
+        app.logger.error(f"Comptes {username} non inscrits au registre (nœuds {node_ids}): DB non disponible")
+        return False
+    cur = None
+    try:
+        conn.start_transaction()
+        cur = conn.cursor()
+        cur.execute(f"UPDATE nodes SET needs_cleanup=TRUE WHERE id IN ({','.join(['%s'] * len(node_ids))})",
+                    tuple(node_ids))
+        ledger_add_accounts(cur, node_ids, username)
+        record_change(cur, 'node', node_ids)
+        conn.commit()
+        return True
+    except Exception as e:
+        app.logger.error(f"Erreur inscription des comptes {username} au registre (nœuds {node_ids}): {e}")
+        try:
+            conn.rollback()
+        except:
+            pass
+        return False
+    finally:
+        if cur:
+            cur.close()
+        conn.close()
+
+def abort_provisioning_job(job_id, targets, error):
+    """
+    Passe un job échoué en 'failed' et annule ses locations : rentals désactivés, nœuds
+    libérés et marqués dirty pour que le scheduler supprime les comptes déjà créés.
+    Sans effet si le scheduler a déjà balayé le job (locations déjà annulées).
+    """
+    conn = get_db_connection()
+    if not conn:
+        app.logger.error(f"Annulation du job {job_id} impossible: DB non disponible")
+        return False
+    cur = None
+    try:
+        conn.start_transaction()
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE provisioning_jobs SET status='failed', error=%s WHERE id=%s AND status IN ('pending', 'running')",
+            (error, job_id))
+        if cur.rowcount == 0:
+            app.logger.warning(f"Job {job_id} déjà terminé (balayé par le scheduler), rien à annuler")
+            conn.rollback()
+            return True
+        rental_ids = [t["rental_id"] for t in targets]
+        node_ids = [t["node_id"] for t in targets]
+        cur.execute(
+            f"UPDATE rentals SET active=FALSE, ended_at=NOW() WHERE id IN ({','.join(['%s'] * len(rental_ids))})",
+            tuple(rental_ids))
+        cur.execute(
+            f"UPDATE nodes SET slots_used = GREATEST(slots_used - 1, 0), allocated=FALSE, needs_cleanup=TRUE "
+            f"WHERE id IN ({','.join(['%s'] * len(node_ids))})",
+            tuple(node_ids))
+        cur.execute(
+            "UPDATE provisioning_job_items SET status='cancelled' WHERE job_id=%s AND status IN ('pending', 'ready')",
+            (job_id,))
+        record_change(cur, 'rental', rental_ids)
+        conn.commit()
+        return True
+    except Exception as e:
+        app.logger.error(f"Erreur annulation job {job_id}: {e}")
+        try:
+            conn.rollback()
+        except:
+            pass
+        return False
+    finally:
+        if cur:
+            cur.close()
+        conn.close()
+
+def run_provisioning_job(job_id, client_user, targets):
+    """
+    Exécuté par provisioning_executor après un /rent asynchrone.
+    Tout ou rien : si un nœud échoue, les locations du job sont annulées.
+    """
+    app.logger.info(f"Job de provisioning {job_id}: {len(targets)} nœud(s) pour {client_user}")
+    set_job_status(job_id, 'running')
+
+    failed = provision_nodes(
+        client_user, targets,
+        on_status=lambda t, status: set_job_item_status(job_id, t["rental_id"], status)
+    )
+    if failed:
+        node_ids = ', '.join(str(t['node_id']) for t in failed)
+        abort_provisioning_job(job_id, targets, f"Échec du provisioning sur le(s) nœud(s) {node_ids}")
+        app.logger.error(f"Job de provisioning {job_id} échoué (nœuds {node_ids}), locations annulées")
+        return False
+
+    set_job_status(job_id, 'succeeded')
+    app.logger.info(f"Job de provisioning {job_id} terminé avec succès")
+    return True
+
+@app.route("/rent/jobs/<job_id>", methods=["GET"])
+@require_auth
+def get_rent_job(job_id):
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "DB non disponible"}), 500
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute(
+            "SELECT id, user_id, status, error, created_at, updated_at FROM provisioning_jobs WHERE id=%s",
+            (job_id,))
+        job = cur.fetchone()
+        if not job:
+            return jsonify({"error": "Job introuvable"}), 404
+        if request.user["role"] != "admin" and job["user_id"] != request.user["user_id"]:
+            return jsonify({"error": "Pas la permission"}), 403
+
+        cur.execute("""
+            SELECT rental_id, node_id, status, error, updated_at
+            FROM provisioning_job_items
+            WHERE job_id=%s
+            ORDER BY rental_id
+        """, (job_id,))
+        items = cur.fetchall()
+
+        return jsonify({
+            "job_id": job["id"],
+            "status": job["status"],
+            "error": job["error"],
+            "created_at": job["created_at"].isoformat() if job["created_at"] else None,
+            "updated_at": job["updated_at"].isoformat() if job["updated_at"] else None,
+            "nodes": [{
+                "rental_id": i["rental_id"],
+                "node_id": i["node_id"],
+                "status": i["status"],
+                "error": i["error"],
+                "updated_at": i["updated_at"].isoformat() if i["updated_at"] else None,
+            } for i in items],
+        }), 200
+    except Exception as e:
+        app.logger.error(f"Erreur get_rent_job: {e}")
+        return jsonify({"error": "Erreur serveur interne"}), 500
+    finally:
+        try:
+            cur.close()
+        except:
+            pass
+        conn.close()
+
+
 @app.route("/release/<int:rental_id>", methods=["POST"])
 @require_auth
 def release_lease(rental_id):
@@ -423,7 +1337,7 @@ def release_lease(rental_id):
         
         # 1. Récupérer le rental avec les infos du user
         cur.execute("""
-            SELECT r.*, u.username, n.ip, n.hostname, n.ssh_port
+            SELECT r.*, u.username, n.ip, n.hostname, n.ssh_port, n.container_name
             FROM rentals r
             JOIN users u ON r.user_id = u.id
             JOIN nodes n ON r.node_id = n.id
@@ -460,21 +1374,31 @@ def release_lease(rental_id):
             except Exception as e:
                 app.logger.warning(f"Impossible de déchiffrer le password: {e}")
         
-        # Supprimer l'utilisateur via Ansible
+        # Supprimer l'utilisateur sur le worker
+        deleted = False
         try:
-            run_ansible_provision(
+            deleted = run_provision(
                 'delete_user.yml', 
                 host_ip, 
                 rental["ssh_port"], 
                 client_user, 
-                client_pass  # Password déchiffré (ou vide si non disponible)
+                client_pass,  # Password déchiffré (ou vide si non disponible)
+                container_name=rental.get("container_name")
             )
         except Exception as e:
             app.logger.warning(f"Cleanup Ansible a échoué (non bloquant): {e}")
 
-        # 5. Désactiver le rental et libérer le nœud
-        cur.execute("UPDATE rentals SET active = FALSE WHERE id = %s", (rental_id,))
-        cur.execute("UPDATE nodes SET allocated = FALSE WHERE id = %s", (rental["node_id"],))
+        # 5. Désactiver le rental et libérer le slot ; si le compte n'a pas pu être supprimé,
+        # il reste au registre et le nœud est marqué dirty pour le scheduler
+        record_change(cur, 'rental', [rental_id])
+        if deleted:
+            cur.execute("DELETE FROM node_accounts WHERE node_id = %s AND username = %s",
+                        (rental["node_id"], client_user))
+        cur.execute("UPDATE rentals SET active = FALSE, ended_at = NOW() WHERE id = %s", (rental_id,))
+        # Slot libéré ; le drapeau dirty posé par un autre locataire du nœud est conservé
+        cur.execute("UPDATE nodes SET slots_used = GREATEST(slots_used - 1, 0), allocated = FALSE, "
+                    "needs_cleanup = (needs_cleanup OR %s) WHERE id = %s",
+                    (not deleted, rental["node_id"]))
         
         conn.commit()
         return jsonify({"message": "Lease libérée avec succès"}), 200
@@ -511,8 +1435,9 @@ def extend_lease(rental_id):
         conn.start_transaction()
         cur = conn.cursor(dictionary=True)
         
-        # 1. Récupérer le rental
-        cur.execute("SELECT * FROM rentals WHERE id=%s FOR UPDATE", (rental_id,))
+        # 1. Récupérer le rental (réclamation d'expiration encore valable, à l'heure de la DB)
+        cur.execute("SELECT *, (expiry_claim IS NOT NULL AND expiry_claimed_until >= NOW()) AS expiry_claimed "
+                    "FROM rentals WHERE id=%s FOR UPDATE", (rental_id,))
         rental = cur.fetchone()
         
         if not rental:
@@ -529,11 +1454,21 @@ def extend_lease(rental_id):
             conn.rollback()
             return jsonify({"error": "Ce bail n'est pas actif"}), 400
 
+        # Bail réclamé par le scheduler pour expiration : le compte est en cours de suppression.
+        # Une réclamation dont le délai de visibilité est dépassé est abandonnée (même règle
+        # que claim_expired_leases) : la prolongation l'efface, le réplica retardataire
+        # ne pourra plus clore le bail.
+        if rental.get("expiry_claimed"):
+            conn.rollback()
+            return jsonify({"error": "Ce bail est en cours d'expiration"}), 409
+
         # 4. Calculer la nouvelle date de fin
         new_end = rental["leased_until"] + timedelta(hours=add_hours)
         
         # 5. Mettre à jour
-        cur.execute("UPDATE rentals SET leased_until = %s WHERE id = %s", (new_end, rental_id))
+        record_change(cur, 'rental', [rental_id])
+        cur.execute("UPDATE rentals SET leased_until = %s, expiry_claim = NULL, expiry_claimed_until = NULL "
+                    "WHERE id = %s", (new_end, rental_id))
         
         conn.commit()
         return jsonify({
@@ -556,70 +1491,596 @@ def extend_lease(rental_id):
             pass
         conn.close()
 
+NODE_COLUMNS = """
+    n.id as node_id, n.hostname, n.ssh_port, n.status, n.allocated,
+    n.cpu_cores, n.memory_mb, n.disk_gb, n.slots, n.slots_used"""
+LEASE_COLUMNS = """,
+    r.id as rental_id, r.user_id as rental_user_id, r.leased_from, r.leased_until, r.active"""
+
+# Champs d'un nœud dans /nodes (projection `fields`) et filtres acceptés
+NODE_FIELDS = ("node_id", "hostname", "ssh_port", "status", "allocated", "cpu_cores", "memory_mb",
+               "disk_gb", "slots", "slots_used", "lease", "leases")
+NODE_STATUSES = ("alive", "dead", "unknown")
+
+def parse_bool_arg(value, name):
+    if value.lower() in ("true", "1"):
+        return True
+    if value.lower() in ("false", "0"):
+        return False
+    raise ValueError(f"{name} doit valoir true ou false")
+
+def parse_nodes_query(args):
+    """
+    Filtres (status, allocated, needs_cleanup, renter), pagination (limit, after) et
+    projection (fields) de /nodes. ValueError si un paramètre est invalide.
+    """
+    query = {"where": [], "params": [], "limit": None, "after": None, "fields": None}
+    if args.get("status"):
+        statuses = args["status"].split(",")
+        if any(s not in NODE_STATUSES for s in statuses):
+            raise ValueError(f"status doit être parmi {', '.join(NODE_STATUSES)}")
+        query["where"].append(f"n.status IN ({','.join(['%s'] * len(statuses))})")
+        query["params"] += statuses
+    for name in ("allocated", "needs_cleanup"):
+        if args.get(name):
+            query["where"].append(f"n.{name} = %s")
+            query["params"].append(parse_bool_arg(args[name], name))
+    if args.get("renter"):
+        query["where"].append("""EXISTS (
+                SELECT 1 FROM rentals rr JOIN users ru ON ru.id = rr.user_id
+                WHERE rr.node_id = n.id AND rr.active = TRUE AND ru.username = %s)""")
+        query["params"].append(args["renter"])
+
+    if "limit" in args or "after" in args:
+        try:
+            query["limit"] = int(args.get("limit", NODES_PAGE_DEFAULT))
+            query["after"] = int(args.get("after", 0))
+        except ValueError:
+            raise ValueError("limit et after doivent être des entiers")
+        if not 1 <= query["limit"] <= NODES_PAGE_MAX or query["after"] < 0:
+            raise ValueError(f"limit doit être entre 1 et {NODES_PAGE_MAX}, after positif")
+
+    if args.get("fields"):
+        fields = args["fields"].split(",")
+        if any(f not in NODE_FIELDS for f in fields):
+            raise ValueError(f"fields doit être parmi {', '.join(NODE_FIELDS)}")
+        query["fields"] = ["node_id"] + [f for f in fields if f != "node_id"]
+    return query
+
+def fetch_node_rows(cur, user, node_ids=None, query=None):
+    """
+    Lignes nœud ⟕ location active (⟕ locataire pour l'admin) ; un utilisateur ne voit que
+    les nœuds où il a une location active. `node_ids` restreint la lecture (flux de changements),
+    `query` (parse_nodes_query) ajoute filtres, page et projection.
+
+    Pagination par clé (id > after) : la page de nœuds est choisie dans une table dérivée
+    avant les jointures, un nœud n'est jamais coupé entre deux pages quel que soit son
+    nombre de locations. Sans `lease`/`leases` dans la projection, la vue admin ne joint pas
+    les locations.
+    """
+    query = query or {"where": [], "params": [], "limit": None, "after": None, "fields": None}
+    admin = user["role"] == "admin"
+    where, params = list(query["where"]), list(query["params"])
+    if node_ids is not None:
+        where.append(f"n.id IN ({','.join(['%s'] * len(node_ids))})")
+        params += node_ids
+    with_leases = not admin or query["fields"] is None or {"lease", "leases"} & set(query["fields"])
+
+    columns = NODE_COLUMNS
+    joins = ""
+    if with_leases:
+        columns += LEASE_COLUMNS
+        joins = "LEFT JOIN rentals r ON r.node_id = n.id AND r.active = TRUE"
+        if admin:
+            columns += ", u.username as renter_username"
+            joins += " LEFT JOIN users u ON r.user_id = u.id"
+
+    source, source_params = "nodes n", []
+    outer, outer_params = [], []
+    if not admin:
+        outer, outer_params = ["r.user_id = %s"], [user["user_id"]]
+    if query["limit"] is None:
+        outer += where
+        outer_params += params
+        order = ""
+    else:
+        page = ["n.id > %s"] + where
+        page_params = [query["after"]] + params
+        if not admin:
+            page.append("EXISTS (SELECT 1 FROM rentals ur WHERE ur.node_id = n.id AND ur.user_id = %s AND ur.active = TRUE)")
+            page_params.append(user["user_id"])
+        source = f"""(
+                SELECT n.id FROM nodes n
+                WHERE {' AND '.join(page)}
+                ORDER BY n.id
+                LIMIT %s
+            ) page JOIN nodes n ON n.id = page.id"""
+        source_params = page_params + [query["limit"]]
+        order = "ORDER BY n.id"
+
+    cur.execute(f"""
+        SELECT {columns}
+        FROM {source}
+        {joins}
+        {"WHERE " + " AND ".join(outer) if outer else ""}
+        {order}
+    """, (*source_params, *outer_params))
+    return cur.fetchall()
+
+def group_node_rows(rows):
+    """Regroupe les lignes par nœud (une entrée de `leases` par slot occupé)."""
+    nodes = {}
+    for r in rows:
+        nid = r["node_id"]
+        if nid not in nodes:
+            nodes[nid] = {
+                "node_id": nid,
+                "hostname": r["hostname"],
+                "ssh_port": r["ssh_port"],
+                "status": r["status"],
+                "allocated": bool(r["allocated"]),
+                "cpu_cores": r.get("cpu_cores"),
+                "memory_mb": r.get("memory_mb"),
+                "disk_gb": r.get("disk_gb"),
+                "slots": r.get("slots"),
+                "slots_used": r.get("slots_used"),
+                "lease": None,
+                # Nœud multi-locataires : une entrée par slot occupé
+                "leases": []
+            }
+
+        if r.get("rental_id"):
+            lease = {
+                "rental_id": r["rental_id"],
+                "user_id": r["rental_user_id"],
+                "renter_username": r.get("renter_username"),
+                "leased_from": r["leased_from"].isoformat() if r["leased_from"] else None,
+                "leased_until": r["leased_until"].isoformat() if r["leased_until"] else None,
+                "active": bool(r["active"]),
+            }
+            nodes[nid]["leases"].append(lease)
+            if nodes[nid]["lease"] is None:
+                nodes[nid]["lease"] = lease
+    return list(nodes.values())
+
+def settled_change_version(cur):
+    """
+    Dernière version stable de change_log (plus vieille que CHANGE_LOG_SETTLE) : une
+    transaction plus lente peut encore committer une version inférieure aux plus récentes.
+    Lecture à rebours sur la clé primaire, arrêtée à la première ligne stable.
+    """
+    cur.execute("""
+        SELECT version FROM change_log
+        WHERE created_at < NOW() - INTERVAL %s SECOND
+        ORDER BY version DESC
+        LIMIT 1
+    """, (CHANGE_LOG_SETTLE,))
+    row = cur.fetchone()
+    return row["version"] if row else 0
+
+def read_changes(cur, since):
+    """Lignes de change_log après `since` (au plus NODES_DELTA_LIMIT + 1), avec leur stabilité."""
+    cur.execute("""
+        SELECT version, entity, entity_id, created_at < NOW() - INTERVAL %s SECOND AS settled
+        FROM change_log
+        WHERE version > %s
+        ORDER BY version
+        LIMIT %s
+    """, (CHANGE_LOG_SETTLE, since, NODES_DELTA_LIMIT + 1))
+    return cur.fetchall()
+
+def settled_prefix_version(changes, since):
+    """
+    Version jusqu'à laquelle un lecteur est à jour : elle n'avance que sur les lignes stables,
+    les plus récentes seront relues (une version inférieure peut encore être committée).
+    """
+    version = since
+    for change in changes:
+        if not change["settled"]:
+            break
+        version = change["version"]
+    return version
+
+def nodes_of_changes(cur, changes):
+    """
+    Nœuds touchés par des lignes de change_log (une location journalisée touche son nœud) :
+    (ids triés, {node_id: locataires des locations journalisées sur ce nœud}).
+    """
+    node_ids = {c["entity_id"] for c in changes if c["entity"] == 'node'}
+    rental_ids = list({c["entity_id"] for c in changes if c["entity"] == 'rental'})
+    renters = {}
+    if rental_ids:
+        # Une location déjà archivée a quitté rentals
+        placeholders = ','.join(['%s'] * len(rental_ids))
+        cur.execute(f"""
+            SELECT node_id, user_id FROM rentals WHERE id IN ({placeholders})
+            UNION
+            SELECT node_id, user_id FROM rentals_archive WHERE id IN ({placeholders})
+        """, (*rental_ids, *rental_ids))
+        for row in cur.fetchall():
+            node_ids.add(row["node_id"])
+            renters.setdefault(row["node_id"], set()).add(row.get("user_id"))
+    return sorted(node_ids), renters
+
+def removed_node_ids(node_ids, shown, renters, user, still_rented=()):
+    """
+    Nœuds touchés qui ne sont plus dans la vue de `user`. Un utilisateur ne reçoit que
+    les nœuds qu'il pouvait voir : une de ses locations y a changé (rendue, expirée,
+    migrée), ou il y loue encore mais le nœud ne passe plus les filtres (`still_rented`).
+    """
+    removed = [nid for nid in node_ids if nid not in shown]
+    if user["role"] == "admin":
+        return removed
+    return [nid for nid in removed if user["user_id"] in renters.get(nid, ()) or nid in still_rented]
+
+def rented_node_ids(cur, user, node_ids):
+    """Nœuds parmi `node_ids` où `user` a une location active, sans filtre."""
+    if not node_ids:
+        return set()
+    cur.execute(f"""
+        SELECT DISTINCT node_id FROM rentals
+        WHERE user_id = %s AND active = TRUE AND node_id IN ({','.join(['%s'] * len(node_ids))})
+    """, (user["user_id"], *node_ids))
+    return {row["node_id"] for row in cur.fetchall()}
+
+def change_log_retains(cur, since):
+    """
+    Vrai si change_log contient encore tous les changements après `since` : le scheduler
+    purge le journal par préfixe de versions, un `since` antérieur à la plus ancienne
+    ligne conservée a pu perdre des changements.
+    """
+    cur.execute("SELECT MIN(version) AS oldest FROM change_log")
+    row = cur.fetchone()
+    return row is None or row["oldest"] is None or since >= row["oldest"] - 1
+
+def changed_node_ids(cur, since):
+    """
+    Nœuds touchés depuis la version `since` : (ids, locataires par nœud, version jusqu'à
+    laquelle le client est à jour), ou None si le retard dépasse NODES_DELTA_LIMIT ou la rétention du journal
+    (instantané complet).
+    """
+    if not change_log_retains(cur, since):
+        return None
+    changes = read_changes(cur, since)
+    if len(changes) > NODES_DELTA_LIMIT:
+        return None
+    return (*nodes_of_changes(cur, changes), settled_prefix_version(changes, since))
+
+def project_nodes(nodes, fields):
+    if fields is None:
+        return nodes
+    return [{f: node[f] for f in fields} for node in nodes]
+
+def next_page_after(nodes, limit):
+    """Page pleine : la suivante commence après son dernier nœud, sinon None (dernière page)."""
+    return nodes[-1]["node_id"] if len(nodes) == limit else None
+
+def build_nodes_body(cur, user, since, query):
+    """Corps de /nodes : liste plafonnée ou page (sans `since`), page d'instantané ou delta."""
+    if since is None:
+        if query["limit"] is not None:
+            nodes = project_nodes(group_node_rows(fetch_node_rows(cur, user, query=query)), query["fields"])
+            return jsonify({"nodes": nodes, "next_after": next_page_after(nodes, query["limit"])}), 200
+        # Sans `limit` : liste plafonnée à NODES_PAGE_MAX nœuds, la suite est signalée en en-tête
+        capped = dict(query, limit=NODES_PAGE_MAX, after=0)
+        nodes = project_nodes(group_node_rows(fetch_node_rows(cur, user, query=capped)), query["fields"])
+        if not nodes:
+            return jsonify({"message": "Vous n'avez actuellement aucune location de node."}), 200
+        response = jsonify(nodes)
+        next_after = next_page_after(nodes, NODES_PAGE_MAX)
+        if next_after is not None:
+            args = request.args.to_dict()
+            args.update(after=next_after, limit=NODES_PAGE_MAX)
+            response.headers["X-Next-After"] = str(next_after)
+            # Référence relative (?…) : reste valable derrière le préfixe /api du proxy
+            response.headers["Link"] = f'<?{urlencode(args)}>; rel="next"'
+        return response, 200
+
+    delta = changed_node_ids(cur, since) if since else None
+    if delta is None:
+        # Version lue avant la page : les changements concurrents seront renvoyés. Les pages
+        # suivantes (since=0&after=) gardent la version de la première page côté client.
+        version = settled_change_version(cur)
+        page = dict(query, limit=query["limit"] or NODES_PAGE_DEFAULT, after=query["after"] or 0)
+        nodes = project_nodes(group_node_rows(fetch_node_rows(cur, user, query=page)), query["fields"])
+        return jsonify({"version": version, "full": True, "nodes": nodes,
+                        "next_after": next_page_after(nodes, page["limit"])}), 200
+
+    # Un nœud qui ne passe plus les filtres est renvoyé dans `removed` ; le delta, borné
+    # par NODES_DELTA_LIMIT, n'est pas paginé
+    node_ids, renters, version = delta
+    changed = dict(query, limit=None, after=None)
+    nodes = group_node_rows(fetch_node_rows(cur, user, node_ids, changed)) if node_ids else []
+    nodes = project_nodes(nodes, query["fields"])
+    visible = {n["node_id"] for n in nodes}
+    still_rented = ()
+    if user["role"] != "admin" and query["where"]:
+        still_rented = rented_node_ids(cur, user, [nid for nid in node_ids if nid not in visible])
+    return jsonify({
+        "version": version,
+        "full": False,
+        "nodes": nodes,
+        "removed": removed_node_ids(node_ids, visible, renters, user, still_rented),
+    }), 200
+
+def nodes_query_digest(since, query):
+    """Empreinte de la requête /nodes normalisée (since, filtres, page, projection)."""
+    normalized = json.dumps({"since": since, "where": query["where"], "params": query["params"],
+                             "limit": query["limit"], "after": query["after"], "fields": query["fields"]},
+                            sort_keys=True, default=str)
+    return hashlib.sha256(normalized.encode()).hexdigest()[:16]
+
+def nodes_etag(cur, user, since=None, query=None):
+    """
+    ETag fort de /nodes, dérivé de change_log sans relire les nœuds : dernière version
+    stable, plus version max et nombre des lignes plus récentes (une version inférieure
+    committée en retard change ce nombre). Propre à l'utilisateur, la vue étant filtrée,
+    et à la requête : deux corps différents ne partagent jamais un ETag.
+    """
+    settled = settled_change_version(cur)
+    cur.execute("""
+        SELECT COALESCE(MAX(version), 0) AS latest, COUNT(*) AS pending
+        FROM change_log WHERE version > %s
+    """, (settled,))
+    row = cur.fetchone()
+    digest = nodes_query_digest(since, query or parse_nodes_query({}))
+    return f"nodes-{user['role']}-{user['user_id']}-{settled}-{row['latest']}-{row['pending']}-{digest}"
+
+def conditional_response(etag, build):
+    """
+    GET conditionnel : 304 sans corps si If-None-Match contient déjà `etag`, sinon la réponse
+    de `build()` (corps, statut) avec son ETag. Les navigateurs revalident à chaque appel.
+    """
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        body, status = build()
+        response = app.make_response((body, status))
+        if status != 200:
+            return response
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
 @app.route("/nodes", methods=["GET"])
 @require_auth
 def list_nodes():
+    """
+    Sans paramètre : liste des nœuds, plafonnée à NODES_PAGE_MAX (suite en en-tête
+    `Link`/`X-Next-After`). Avec `since=<version>` : flux de changements,
+    {"version", "full", "nodes", "removed"}. `since=0` (ou un retard trop grand) renvoie
+    une page de l'instantané complet (`full`, `next_after`, suite par `since=0&after=`),
+    sinon seuls les nœuds modifiés depuis `since` sont relus ; `removed` liste les nœuds
+    disparus ou qui ne sont plus visibles.
+    Filtres `status`, `allocated`, `needs_cleanup`, `renter` et projection `fields` dans tous
+    les cas ; pagination `limit`/`after` sans `since` : enveloppe {"nodes", "next_after"}.
+    Réponses avec ETag : If-None-Match répond 304 avant toute lecture des nœuds.
+    """
+    since = request.args.get("since")
+    if since is not None:
+        try:
+            since = int(since)
+            if since < 0:
+                raise ValueError
+        except ValueError:
+            return jsonify({"error": "since doit être un entier positif"}), 400
+    try:
+        query = parse_nodes_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if since and query["after"]:
+        return jsonify({"error": "after ne se combine qu'avec since=0 (pages d'un instantané)"}), 400
+
     conn = get_db_connection()
     if not conn:
         return jsonify({"error": "DB non disponible"}), 500
+    cur = None
     try:
         cur = conn.cursor(dictionary=True)
-
-        if request.user["role"] == "admin":
-            cur.execute("""
-                SELECT n.id as node_id, n.hostname, n.ssh_port, n.status, n.allocated,
-                       r.id as rental_id, r.user_id as rental_user_id, r.leased_from, r.leased_until, r.active,
-                       u.username as renter_username
-                FROM nodes n
-                LEFT JOIN rentals r ON r.node_id = n.id AND r.active = TRUE
-                LEFT JOIN users u ON r.user_id = u.id
-            """)
-        else:
-            cur.execute("""
-                SELECT n.id as node_id, n.hostname, n.ssh_port, n.status, n.allocated,
-                       r.id as rental_id, r.user_id as rental_user_id, r.leased_from, r.leased_until, r.active
-                FROM nodes n
-                LEFT JOIN rentals r ON r.node_id = n.id AND r.active = TRUE
-                WHERE r.user_id = %s
-            """, (request.user["user_id"],))
-
-        rows = cur.fetchall()
-        cur.close()
-
-        if not rows:
-            return jsonify({"message": "Vous n'avez actuellement aucune location de node."}), 200
-
-        nodes = {}
-        for r in rows:
-            nid = r["node_id"]
-            if nid not in nodes:
-                nodes[nid] = {
-                    "node_id": nid,
-                    "hostname": r["hostname"],
-                    "ssh_port": r["ssh_port"],
-                    "status": r["status"],
-                    "allocated": bool(r["allocated"]),
-                    "lease": None
-                }
-
-            if r.get("rental_id"):
-                nodes[nid]["lease"] = {
-                    "rental_id": r["rental_id"],
-                    "user_id": r["rental_user_id"],
-                    "renter_username": r.get("renter_username"),
-                    "leased_from": r["leased_from"].isoformat() if r["leased_from"] else None,
-                    "leased_until": r["leased_until"].isoformat() if r["leased_until"] else None,
-                    "active": bool(r["active"]),
-                }
-
-        return jsonify(list(nodes.values())), 200
+        # Même transaction (instantané InnoDB) pour l'ETag et le corps
+        etag = nodes_etag(cur, request.user, since, query)
+        return conditional_response(etag, lambda: build_nodes_body(cur, request.user, since, query))
 
     except Exception as e:
         app.logger.error(f"Erreur list_nodes: {e}")
         return jsonify({"error": "Erreur serveur interne"}), 500
     finally:
+        if cur:
+            cur.close()
         conn.close()
 
+# -----------------------
+# Flux SSE (/events)
+# -----------------------
+ADMIN_VIEW = {"role": "admin", "user_id": None}
+
+def visible_nodes(nodes, user):
+    """Vue d'un abonné sur des nœuds lus avec la vue admin (même filtrage que /nodes)."""
+    if user["role"] == "admin":
+        return nodes
+    visible = []
+    for node in nodes:
+        leases = [dict(l, renter_username=None) for l in node["leases"] if l["user_id"] == user["user_id"]]
+        if leases:
+            visible.append(dict(node, leases=leases, lease=leases[0]))
+    return visible
+
+class ChangeBroadcaster:
+    """
+    Diffuse les changements de nœuds aux flux /events du process. Un seul thread relit
+    change_log toutes les EVENTS_POLL_INTERVAL secondes tant qu'il y a des abonnés, relit une
+    fois les nœuds touchés (vue admin) et dépose dans la file de chaque abonné sa vue filtrée :
+    aucune requête par abonné. Les lignes pas encore stables sont diffusées dès leur lecture
+    et mémorisées pour ne pas être renvoyées.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.version = None     # dernière version stable lue (None : à relire)
+        self._sent = set()      # versions plus récentes déjà diffusées
+        self._subscribers = {}  # file -> utilisateur
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, user):
+        """File d'événements du nouvel abonné, ou None si EVENTS_MAX_SUBSCRIBERS est atteint."""
+        q = queue.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        with self._lock:
+            if len(self._subscribers) >= EVENTS_MAX_SUBSCRIBERS:
+                return None
+            self._subscribers[q] = user
+        self._ensure_thread()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.pop(q, None)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="change-broadcaster")
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    # Plus d'abonné : le prochain repartira de la version stable courante
+                    self._thread = None
+                    self.version = None
+                    return
+            try:
+                self.poll()
+            except Exception as e:
+                app.logger.error(f"Erreur diffusion des changements: {e}")
+            time.sleep(EVENTS_POLL_INTERVAL)
+
+    def poll(self):
+        conn = get_db_connection()
+        if not conn:
+            return
+        cur = None
+        try:
+            cur = conn.cursor(dictionary=True)
+            if self.version is None:
+                self.version, self._sent = settled_change_version(cur), set()
+            changes = read_changes(cur, self.version)
+            if len(changes) > NODES_DELTA_LIMIT:
+                # Retard trop grand : les clients rechargent un instantané
+                self.version = None
+                self._broadcast("resync", lambda user: {})
+                return
+            fresh = [c for c in changes if c["version"] not in self._sent]
+            self.version = settled_prefix_version(changes, self.version)
+            self._sent = {c["version"] for c in changes if c["version"] > self.version}
+            if not fresh:
+                return
+            node_ids, renters = nodes_of_changes(cur, fresh)
+            nodes = group_node_rows(fetch_node_rows(cur, ADMIN_VIEW, node_ids)) if node_ids else []
+        finally:
+            if cur:
+                cur.close()
+            conn.close()
+
+        version = self.version
+
+        def view(user):
+            visible = visible_nodes(nodes, user)
+            shown = {n["node_id"] for n in visible}
+            return {"version": version, "nodes": visible,
+                    "removed": removed_node_ids(node_ids, shown, renters, user)}
+
+        self._broadcast("nodes", view)
+
+    def _broadcast(self, kind, view):
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        for q, user in subscribers:
+            try:
+                q.put_nowait((kind, view(user)))
+            except queue.Full:
+                # Abonné trop lent : ses événements en attente sont remplacés par un resync
+                while True:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        break
+                q.put_nowait(("resync", {}))
+
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+def get_change_broadcaster():
+    """Diffuseur du process courant ; recréé après un fork (workers gunicorn)."""
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None or _broadcaster.pid != os.getpid():
+            _broadcaster = ChangeBroadcaster()
+        return _broadcaster
+
+@app.route("/events/token", methods=["POST"])
+@require_auth
+def create_stream_token():
+    """Jeton court pour /events?token= : EventSource n'envoie pas d'en-tête Authorization."""
+    return jsonify({"token": generate_stream_token(request.user), "expires_in": EVENTS_TOKEN_TTL}), 200
+
+@app.route("/events", methods=["GET"])
+def stream_events():
+    """
+    Flux SSE des changements de nœuds et de locations : événements `nodes` (même contenu
+    qu'un delta de /nodes?since=, vue filtrée comme /nodes) et `resync` (recharger /nodes).
+    EventSource n'envoie pas d'en-tête : le paramètre `token` n'accepte qu'un jeton de flux
+    (POST /events/token), jamais le JWT de session qui finirait dans les journaux d'accès.
+    """
+    auth = request.headers.get("Authorization", "")
+    if auth.startswith("Bearer "):
+        token, purpose = auth.split(" ", 1)[1], None
+    else:
+        token, purpose = request.args.get("token"), "events"
+    if not token:
+        return jsonify({"error": "Token manquant ou mal forme"}), 401
+    try:
+        payload = decode_jwt(token)
+    except jwt.ExpiredSignatureError:
+        return jsonify({"error": "Token expire"}), 401
+    except Exception:
+        return jsonify({"error": "Token invalide"}), 401
+    if payload.get("purpose") != purpose:
+        return jsonify({"error": "Token invalide"}), 401
+    user = {"user_id": payload.get("user_id"), "role": payload.get("role", "user")}
+
+    broadcaster = get_change_broadcaster()
+    q = broadcaster.subscribe(user)
+    if q is None:
+        # Threads du process réservés aux autres routes : le dashboard repasse au polling
+        app.logger.warning(f"Flux /events refusé : {EVENTS_MAX_SUBSCRIBERS} abonnés déjà connectés")
+        response = jsonify({"error": "Trop de flux ouverts, réessayer plus tard"})
+        response.headers["Retry-After"] = str(EVENTS_RETRY_MS // 1000 or 1)
+        return response, 503
+
+    def stream():
+        try:
+            yield f"retry: {EVENTS_RETRY_MS}\n\n"
+            while True:
+                try:
+                    kind, event = q.get(timeout=EVENTS_KEEPALIVE)
+                except queue.Empty:
+                    # Commentaire SSE : garde la connexion ouverte et détecte les clients partis
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {kind}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broadcaster.unsubscribe(q)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route('/workers/register', methods=['POST'])
 def register_worker():
     """
@@ -633,9 +2094,18 @@ def register_worker():
     hostname = data['hostname']
     ip = data['ip']
     ssh_port = data['ssh_port']
-    
-
-    sql = "INSERT INTO nodes (hostname, ip, ssh_port, status) VALUES (%s, %s, %s, 'unknown')"
+    # Optionnel : conteneur Docker local du worker (backend de provisioning 'docker')
+    container_name = data.get('container_name')
+    try:
+        capacity = parse_capacity(data)
+        slots = compute_slots(data, capacity)
+    except (TypeError, ValueError):
+        return jsonify({"error": "cpu_cores, memory_mb, disk_gb et slots doivent être des entiers positifs"}), 400
+
+    sql = """
+        INSERT INTO nodes (hostname, ip, ssh_port, container_name, cpu_cores, memory_mb, disk_gb, slots, status)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'unknown')
+    """
     
     conn = None
     cursor = None
@@ -645,7 +2115,9 @@ def register_worker():
             return jsonify({"error": "Connexion à la base de données impossible"}), 500
 
         cursor = conn.cursor()
-        cursor.execute(sql, (hostname, ip, ssh_port))
+        cursor.execute(sql, (hostname, ip, ssh_port, container_name,
+                             *(capacity.get(f, 0) for f in CAPACITY_FIELDS), slots or 1))
+        record_change(cursor, 'node', [cursor.lastrowid])
         conn.commit()
 
         app.logger.info(f"Nouveau worker enregistré : {hostname} ({ip}):{ssh_port}")
@@ -663,9 +2135,73 @@ def register_worker():
     finally:
         if cursor:
             cursor.close()
-        if conn and conn.is_connected():
+        if conn:
             conn.close()
 
+@app.route('/workers/heartbeat', methods=['POST'])
+def worker_heartbeat():
+    """
+    Appelé périodiquement par les agents : met à jour nodes.last_heartbeat.
+    Le scheduler déduit la vivacité de la fraîcheur des heartbeats.
+    """
+    data = request.get_json(silent=True)
+    if not data or 'hostname' not in data or 'ip' not in data or 'ssh_port' not in data:
+        return jsonify({"error": "Données JSON manquantes: 'hostname', 'ip' et 'ssh_port' requis"}), 400
+    try:
+        capacity = parse_capacity(data)
+        slots = compute_slots(data, capacity)
+    except (TypeError, ValueError):
+        return jsonify({"error": "cpu_cores, memory_mb, disk_gb et slots doivent être des entiers positifs"}), 400
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "DB non disponible"}), 500
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        identity = (data['hostname'], data['ip'], data['ssh_port'])
+        # Description du nœud (renvoyée à chaque heartbeat)
+        described = {}
+        if data.get('container_name'):
+            # Tient à jour le conteneur d'un worker déjà enregistré (réponse 409 au register)
+            described['container_name'] = data['container_name']
+        described.update(capacity)
+        if slots is not None:
+            described['slots'] = slots
+        assignments = ["last_heartbeat=NOW()"] + [f"{field}=%s" for field in described]
+        if slots is not None:
+            # allocated est recalculé avec le nouveau nombre de slots (évaluation de gauche à droite)
+            assignments.append("allocated=(slots_used >= slots)")
+        params = list(described.values())
+        if described:
+            # Journalisée seulement si elle change : un heartbeat seul n'alimente pas le flux
+            cursor.execute(f"""
+                INSERT INTO change_log (entity, entity_id)
+                SELECT 'node', id FROM nodes
+                WHERE hostname=%s AND ip=%s AND ssh_port=%s
+                  AND NOT ({' AND '.join(f'{field} <=> %s' for field in described)})
+            """, (*identity, *params))
+        cursor.execute(
+            f"UPDATE nodes SET {', '.join(assignments)} WHERE hostname=%s AND ip=%s AND ssh_port=%s",
+            (*params, *identity)
+        )
+        conn.commit()
+        # Lignes trouvées (FOUND_ROWS, cf. DBConnectionPool._connect) : 0 = nœud inconnu
+        if cursor.rowcount == 0:
+            return jsonify({"error": "Worker inconnu"}), 404
+        return jsonify({"message": "ok"}), 200
+    except Exception as e:
+        app.logger.error(f"Erreur heartbeat: {e}")
+        try:
+            conn.rollback()
+        except:
+            pass
+        return jsonify({"error": "Erreur serveur interne"}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
 @app.route('/lease/<int:rental_id>/password', methods=['GET'])
 @require_auth
 def get_ssh_password(rental_id):
@@ -681,18 +2217,14 @@ def get_ssh_password(rental_id):
     # Rechercher le lease correspondant dans la base de données
     try:
         cur = conn.cursor(dictionary=True)
-        cur.execute("""
-            SELECT r.*, u.username, n.ip, n.hostname, n.ssh_port
-            FROM rentals r
-            JOIN users u ON r.user_id = u.id
-            JOIN nodes n ON r.node_id = n.id
-            WHERE r.id = %s
-        """, (rental_id,))
+        cur.execute("SELECT user_id, ssh_password FROM rentals WHERE id = %s", (rental_id,))
         rental = cur.fetchone()
         cur.close()
     except Exception as e:
         app.logger.error(f"Erreur lors de la récupération du lease: {e}")
         return jsonify({"error": "Erreur serveur interne"}), 500
+    finally:
+        conn.close()
 
     if not rental:
         app.logger.warning(f"Lease introuvable pour rental_id: {rental_id}")
@@ -703,17 +2235,32 @@ def get_ssh_password(rental_id):
         app.logger.warning(f"Accès non autorisé pour l'utilisateur {current_user} sur rental_id: {rental_id}")
         return jsonify({"error": "Accès non autorisé."}), 403
 
-    # Retourner le mot de passe SSH
+    # ETag dérivé du mot de passe chiffré : 304 sans déchiffrement si le client l'a déjà
     ssh_password = rental.get("ssh_password")
-    if ssh_password:
-        try:
-            ssh_password = decrypt_password(ssh_password)
-        except Exception as e:
-            app.logger.warning(f"Impossible de déchiffrer le mot de passe SSH: {e}")
-            ssh_password = None
+    digest = hashlib.sha256(f"{rental_id}:{ssh_password or ''}".encode()).hexdigest()[:32]
+
+    def build():
+        password = ssh_password
+        if password:
+            try:
+                password = decrypt_password(password)
+            except Exception as e:
+                app.logger.warning(f"Impossible de déchiffrer le mot de passe SSH: {e}")
+                password = None
+        return jsonify({"ssh_password": password}), 200
+
+    return conditional_response(f"password-{digest}", build)
 
-    return jsonify({"ssh_password": ssh_password}), 200
 
+# -----------------------
+# Metrics
+# -----------------------
+@app.route('/metrics/db-pool', methods=['GET'])
+@require_admin
+def db_pool_metrics():
+    """Compteurs du pool DB du worker gunicorn qui répond (un pool par process)."""
+    import socket
+    return jsonify({"hostname": socket.gethostname(), **get_db_pool().snapshot()}), 200
 
 # -----------------------
 # Health check for Caddy etc.
@@ -730,7 +2277,3 @@ def health_check():
 if __name__ == "__main__":
     app.logger.info("--- Demarrage du serveur Flask en mode DEBUG ---")
     app.run(host='0.0.0.0', port=8080, debug=True)
-
-
-
-
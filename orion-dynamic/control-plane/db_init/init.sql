@@ -11,12 +11,31 @@ CREATE TABLE IF NOT EXISTS nodes (
     hostname VARCHAR(255) NOT NULL,
     ip VARCHAR(45) NOT NULL,
     ssh_port INT NOT NULL,
+    -- Nom du conteneur Docker du worker (provisioning par Docker exec), si local
+    container_name VARCHAR(255) NULL,
+
+    -- Capacité déclarée par l'agent (enregistrement et heartbeats ; 0 = inconnue)
+    cpu_cores INT NOT NULL DEFAULT 0,
+    memory_mb INT NOT NULL DEFAULT 0,
+    disk_gb INT NOT NULL DEFAULT 0,
 
     -- Géré par le Scheduler
     status ENUM('unknown', 'alive', 'dead') NOT NULL DEFAULT 'unknown',
     last_checked TIMESTAMP NULL,
+    -- Détection de la panne (remis à NULL au retour du nœud)
+    dead_since TIMESTAMP NULL,
+
+    -- Dernier heartbeat reçu de l'agent
+    last_heartbeat TIMESTAMP NULL,
+
+    -- Slots de locataires : `slots` configuré par l'agent ou déduit de la capacité,
+    -- `slots_used` = locations actives sur le nœud
+    slots INT NOT NULL DEFAULT 1,
+    slots_used INT NOT NULL DEFAULT 0,
+    -- Nœud sans locataire : les nœuds partiellement occupés passent avant (tri par index)
+    idle BOOLEAN AS (slots_used = 0) STORED,
 
-    -- Alloué ou non (sera utilisé comme "lock" rapide)
+    -- Plus aucun slot libre (slots_used >= slots), sert de "lock" rapide pour /rent
     allocated BOOLEAN NOT NULL DEFAULT FALSE,
 
     -- Dirty flag pour le nettoyage après crash
@@ -30,9 +49,13 @@ CREATE TABLE IF NOT EXISTS nodes (
 
 -- Index pour la table nodes
 CREATE INDEX idx_nodes_status ON nodes(status);
-CREATE INDEX idx_nodes_allocated ON nodes(allocated);
-CREATE INDEX idx_nodes_needs_cleanup ON nodes(needs_cleanup);
+-- Nettoyage : les nœuds dirty sont rares, needs_cleanup en tête
+CREATE INDEX idx_nodes_cleanup ON nodes(needs_cleanup, status);
 CREATE INDEX idx_nodes_scheduler_id ON nodes(scheduler_id);
+CREATE INDEX idx_nodes_last_heartbeat ON nodes(last_heartbeat);
+-- Allocation : nœuds partiellement occupés d'abord puis best fit, dans l'ordre de l'index
+-- (pas de filesort : la lecture verrouillante s'arrête au LIMIT)
+CREATE INDEX idx_nodes_fit ON nodes(status, allocated, needs_cleanup, idle, cpu_cores, memory_mb, disk_gb);
 
 -- ===========================
 --  TABLE DES UTILISATEURS
@@ -60,15 +83,93 @@ CREATE TABLE IF NOT EXISTS rentals (
     leased_until TIMESTAMP NOT NULL,
 
     active BOOLEAN NOT NULL DEFAULT TRUE,
+    -- Fin effective (release, expiration, migration) : point de départ de l'archivage
+    ended_at TIMESTAMP NULL,
+
+    -- Réclamation d'expiration par un réplica du scheduler (jeton + délai de visibilité)
+    expiry_claim CHAR(32) NULL,
+    expiry_claimed_until TIMESTAMP NULL,
 
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (node_id) REFERENCES nodes(id) ON DELETE CASCADE
 );
 
 -- Index pour la table rentals
-CREATE INDEX idx_rentals_user_id ON rentals(user_id);
-CREATE INDEX idx_rentals_node_id ON rentals(node_id);
-CREATE INDEX idx_rentals_leased_until_active ON rentals(leased_until, active);
+-- active en seconde colonne : les jointures sur les locations actives ne lisent pas l'historique
+CREATE INDEX idx_rentals_user_id ON rentals(user_id, active);
+CREATE INDEX idx_rentals_node_id ON rentals(node_id, active);
+-- Expiration : égalité sur active puis plage triée sur leased_until
+CREATE INDEX idx_rentals_active_until ON rentals(active, leased_until);
+CREATE INDEX idx_rentals_expiry_claim ON rentals(expiry_claim);
+CREATE INDEX idx_rentals_archive ON rentals(active, ended_at);
+
+-- ===========================
+--  ARCHIVE DES LOCATIONS
+-- ===========================
+-- Locations closes depuis plus de RENTAL_ARCHIVE_AFTER secondes, déplacées par lots par le
+-- scheduler : `rentals` ne garde que les locations actives et récentes (chemins chauds),
+-- l'historique complet reste lisible via la vue rentals_history.
+CREATE TABLE IF NOT EXISTS rentals_archive (
+    id INT PRIMARY KEY,
+    user_id INT NOT NULL,
+    ssh_password VARCHAR(255) NULL,
+    node_id INT NOT NULL,
+    leased_from TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    leased_until TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ended_at TIMESTAMP NULL,
+    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_rentals_archive_user_id ON rentals_archive(user_id);
+CREATE INDEX idx_rentals_archive_node_id ON rentals_archive(node_id);
+CREATE INDEX idx_rentals_archive_ended_at ON rentals_archive(ended_at);
+
+CREATE OR REPLACE VIEW rentals_history AS
+    SELECT id, user_id, node_id, leased_from, leased_until, active, ended_at, NULL AS archived_at
+    FROM rentals
+    UNION ALL
+    SELECT id, user_id, node_id, leased_from, leased_until, FALSE, ended_at, archived_at
+    FROM rentals_archive;
+
+-- ===========================
+--  REGISTRE DES COMPTES PAR NŒUD
+-- ===========================
+-- Comptes clients pouvant exister sur chaque nœud : inscrits avant le provisioning,
+-- retirés après une suppression réussie. Le nettoyage d'un nœud dirty ne supprime
+-- que ces comptes, quel que soit l'historique de locations du nœud.
+CREATE TABLE IF NOT EXISTS node_accounts (
+    node_id INT NOT NULL,
+    username VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    PRIMARY KEY (node_id, username),
+    FOREIGN KEY (node_id) REFERENCES nodes(id) ON DELETE CASCADE
+);
+
+-- ===========================
+--  MIGRATIONS (FAILOVER)
+-- ===========================
+-- Une ligne par location déplacée d'un nœud mort : le temps de rétablissement est
+-- restored_at - dead_since (SLO de failover). Un compte dont la création échoue reste
+-- 'provisioning' et est retenté après retry_after, jusqu'à MIGRATION_MAX_ATTEMPTS essais.
+CREATE TABLE IF NOT EXISTS rental_migrations (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    old_rental_id INT NOT NULL,
+    new_rental_id INT NOT NULL,
+    dead_node_id INT NOT NULL,
+    new_node_id INT NOT NULL,
+    status ENUM('provisioning', 'restored', 'failed') NOT NULL DEFAULT 'provisioning',
+    dead_since TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    migrated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    restored_at TIMESTAMP NULL,
+    attempts INT NOT NULL DEFAULT 1,
+    retry_after TIMESTAMP NULL,
+
+    -- Pas de clé étrangère vers rentals : les locations closes partent dans rentals_archive
+    UNIQUE KEY uq_migration_new_rental (new_rental_id),
+    KEY idx_migration_old_rental (old_rental_id),
+    KEY idx_migration_retry (status, retry_after)
+);
 
 -- ===========================
 --  TABLE DES SCHEDULERS
@@ -78,3 +179,45 @@ CREATE TABLE IF NOT EXISTS scheduler_ranges (
     start_id INT NOT NULL,
     end_id INT NOT NULL
 );
+
+-- ===========================
+--  JOBS DE PROVISIONING (/rent asynchrone)
+-- ===========================
+CREATE TABLE IF NOT EXISTS provisioning_jobs (
+    id CHAR(32) PRIMARY KEY,
+    user_id INT NOT NULL,
+    status ENUM('pending', 'running', 'succeeded', 'failed') NOT NULL DEFAULT 'pending',
+    error VARCHAR(255) NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+-- Balayage des jobs figés par le scheduler : jobs non terminés, par ancienneté
+CREATE INDEX idx_provisioning_jobs_status ON provisioning_jobs(status, updated_at);
+
+CREATE TABLE IF NOT EXISTS provisioning_job_items (
+    job_id CHAR(32) NOT NULL,
+    rental_id INT NOT NULL,
+    node_id INT NOT NULL,
+    status ENUM('pending', 'provisioning', 'ready', 'failed', 'cancelled') NOT NULL DEFAULT 'pending',
+    error VARCHAR(255) NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    PRIMARY KEY (job_id, rental_id),
+    FOREIGN KEY (job_id) REFERENCES provisioning_jobs(id) ON DELETE CASCADE
+);
+
+-- ===========================
+--  JOURNAL DES CHANGEMENTS
+-- ===========================
+-- Une ligne par entité modifiée (location créée, prolongée, libérée, migrée...),
+-- écrite dans la transaction de la modification. Le scheduler le relit par version
+-- croissante pour tenir à jour son échéancier des fins de bail, et le purge par préfixe
+-- de versions au-delà de CHANGE_LOG_RETENTION.
+CREATE TABLE IF NOT EXISTS change_log (
+    version BIGINT AUTO_INCREMENT PRIMARY KEY,
+    entity VARCHAR(32) NOT NULL,
+    entity_id INT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
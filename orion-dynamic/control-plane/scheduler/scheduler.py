@@ -3,13 +3,20 @@ import os
 import logging
 import schedule
 import time
+import shlex
+import threading
 import tempfile
+import shutil
 import paramiko
 import mysql.connector
 from mysql.connector import errorcode
 import ansible_runner
 import socket
-from datetime import datetime
+import random
+import heapq
+import uuid
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
 from cryptography.fernet import Fernet
 
 # --- Logging ---
@@ -24,6 +31,97 @@ DB_NAME = os.getenv('DB_NAME')
 WORKER_SSH_USER = os.getenv('WORKER_SSH_USER', 'root')
 WORKER_SSH_PASS = os.getenv('WORKER_SSH_PASS', 'password')
 SSH_TIMEOUT = 5
+# Un worker dont le dernier heartbeat a moins de HEARTBEAT_TIMEOUT secondes est vivant
+HEARTBEAT_TIMEOUT = int(os.getenv('HEARTBEAT_TIMEOUT', '15'))
+# Health check : taille du lot réclamé par passage et sondes simultanées par réplica
+HEALTH_CHECK_BATCH = int(os.getenv('HEALTH_CHECK_BATCH', '50'))
+HEALTH_CHECK_CONCURRENCY = int(os.getenv('HEALTH_CHECK_CONCURRENCY', '16'))
+# Part des sondes de nœuds déjà 'alive' qui vont jusqu'à l'authentification SSH complète
+HEALTH_AUTH_SAMPLE_RATE = float(os.getenv('HEALTH_AUTH_SAMPLE_RATE', '0.1'))
+
+# Profil d'exécution Ansible : ansible.cfg généré, répertoires ansible-runner réutilisés
+# et sockets SSH ControlPersist partagés entre les runs
+ANSIBLE_PROFILE_DIR = os.getenv('ANSIBLE_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'orion-ansible'))
+ANSIBLE_CONTROL_PERSIST = os.getenv('ANSIBLE_CONTROL_PERSIST', '300s')
+# fast : suppression de compte en un seul aller-retour (delete_user_fast.yml) ; classic : delete_user.yml
+DEPROVISION_MODE = os.getenv('DEPROVISION_MODE', 'fast').lower()
+FAST_PLAYBOOKS = {'delete_user.yml': 'delete_user_fast.yml'}
+ANSIBLE_CFG_TEMPLATE = """[defaults]
+host_key_checking = False
+retry_files_enabled = False
+gathering = explicit
+
+[ssh_connection]
+pipelining = True
+ssh_args = -o ControlMaster=auto -o ControlPersist={persist}
+control_path_dir = {control_dir}
+control_path = %(directory)s/%%C
+"""
+
+# Backend de provisioning : 'ansible' (défaut), 'ssh' (scripts shell via session SSH réutilisée)
+# ou 'docker' (scripts shell via l'API exec de Docker, workers conteneurs locaux)
+PROVISIONER_BACKEND = os.getenv('PROVISIONER_BACKEND', 'ansible').lower()
+PROVISION_SCRIPTS_DIR = os.getenv('PROVISION_SCRIPTS_DIR', '/ansible/scripts')
+SSH_CONNECT_TIMEOUT = SSH_TIMEOUT
+SSH_COMMAND_TIMEOUT = int(os.getenv('SSH_COMMAND_TIMEOUT', '60'))
+SSH_SESSION_IDLE_TIMEOUT = int(os.getenv('SSH_SESSION_IDLE_TIMEOUT', '300'))
+
+# Parallélisme des lots (expiration, nettoyage) : forks Ansible / opérations SSH simultanées
+ANSIBLE_FORKS = int(os.getenv('ANSIBLE_FORKS', '20'))
+
+# Expiration : baux réclamés par passage et délai de visibilité d'une réclamation (secondes).
+# Passé ce délai, un bail réclamé par un réplica bloqué ou mort peut être repris par un autre.
+EXPIRY_BATCH = int(os.getenv('EXPIRY_BATCH', '50'))
+EXPIRY_CLAIM_TIMEOUT = int(os.getenv('EXPIRY_CLAIM_TIMEOUT', '300'))
+
+# Échéancier des baux : période de lecture de change_log, délai avant de redéclencher un
+# bail échu toujours actif, âge au-delà duquel une ligne du journal est considérée stable
+# (une transaction plus lente peut encore committer une version inférieure) et période
+# du scan complet des baux expirés, conservé comme filet de sécurité.
+LEASE_TIMER_POLL = float(os.getenv('LEASE_TIMER_POLL', '1'))
+LEASE_TIMER_RETRY = int(os.getenv('LEASE_TIMER_RETRY', '5'))
+LEASE_TIMER_BATCH = int(os.getenv('LEASE_TIMER_BATCH', '1000'))
+CHANGE_LOG_SETTLE = int(os.getenv('CHANGE_LOG_SETTLE', '5'))
+EXPIRY_RECONCILE_INTERVAL = int(os.getenv('EXPIRY_RECONCILE_INTERVAL', '300'))
+
+# Migrations : délai avant de retenter la création d'un compte remplaçant (secondes), nombre
+# maximal d'essais avant l'état 'failed' et migrations en attente reprises par passage
+MIGRATION_RETRY_DELAY = int(os.getenv('MIGRATION_RETRY_DELAY', '60'))
+MIGRATION_MAX_ATTEMPTS = int(os.getenv('MIGRATION_MAX_ATTEMPTS', '5'))
+MIGRATION_RETRY_BATCH = int(os.getenv('MIGRATION_RETRY_BATCH', '50'))
+
+# Archivage : âge minimal d'une location close (secondes), taille d'un lot (une transaction
+# courte par lot), nombre maximal de lots par passage et période du passage
+RENTAL_ARCHIVE_AFTER = int(os.getenv('RENTAL_ARCHIVE_AFTER', '86400'))
+RENTAL_ARCHIVE_CHUNK = int(os.getenv('RENTAL_ARCHIVE_CHUNK', '500'))
+RENTAL_ARCHIVE_MAX_CHUNKS = int(os.getenv('RENTAL_ARCHIVE_MAX_CHUNKS', '20'))
+RENTAL_ARCHIVE_INTERVAL = int(os.getenv('RENTAL_ARCHIVE_INTERVAL', '600'))
+
+# Purge de change_log : âge au-delà duquel une ligne est supprimée (un lecteur /nodes?since=
+# plus ancien repart d'un instantané complet), taille d'un lot, lots par passage et période
+CHANGE_LOG_RETENTION = int(os.getenv('CHANGE_LOG_RETENTION', '3600'))
+CHANGE_LOG_PURGE_CHUNK = int(os.getenv('CHANGE_LOG_PURGE_CHUNK', '1000'))
+CHANGE_LOG_PURGE_MAX_CHUNKS = int(os.getenv('CHANGE_LOG_PURGE_MAX_CHUNKS', '20'))
+CHANGE_LOG_PURGE_INTERVAL = int(os.getenv('CHANGE_LOG_PURGE_INTERVAL', '300'))
+
+# Jobs de provisioning asynchrones (/rent async) figés : un job 'pending' ou 'running' sans
+# mise à jour (job ou nœud) depuis PROVISIONING_JOB_TIMEOUT secondes a perdu son process API
+# (redémarrage, crash) ; il est passé en échec et ses locations annulées. Jobs par lot et
+# période du passage
+PROVISIONING_JOB_TIMEOUT = int(os.getenv('PROVISIONING_JOB_TIMEOUT', '1800'))
+PROVISIONING_SWEEP_BATCH = int(os.getenv('PROVISIONING_SWEEP_BATCH', '50'))
+PROVISIONING_SWEEP_INTERVAL = int(os.getenv('PROVISIONING_SWEEP_INTERVAL', '60'))
+
+# Exécutions simultanées autorisées par type de tâche (chaque tâche a sa propre file)
+HEALTH_LANE_CONCURRENCY = int(os.getenv('HEALTH_LANE_CONCURRENCY', '1'))
+MIGRATION_LANE_CONCURRENCY = int(os.getenv('MIGRATION_LANE_CONCURRENCY', '1'))
+EXPIRY_LANE_CONCURRENCY = int(os.getenv('EXPIRY_LANE_CONCURRENCY', '1'))
+CLEANUP_LANE_CONCURRENCY = int(os.getenv('CLEANUP_LANE_CONCURRENCY', '1'))
+ARCHIVE_LANE_CONCURRENCY = int(os.getenv('ARCHIVE_LANE_CONCURRENCY', '1'))
+PURGE_LANE_CONCURRENCY = int(os.getenv('PURGE_LANE_CONCURRENCY', '1'))
+SWEEP_LANE_CONCURRENCY = int(os.getenv('SWEEP_LANE_CONCURRENCY', '1'))
+# Période de journalisation des statistiques des tâches (secondes)
+JOB_STATS_INTERVAL = int(os.getenv('JOB_STATS_INTERVAL', '60'))
 
 # Clé de chiffrement (doit être la même que l'API)
 ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY')
@@ -45,6 +143,31 @@ def decrypt_password(encrypted_password):
         logging.error(f"Erreur déchiffrement: {e}")
         return None
 
+def ledger_add_account(cursor, node_id, username):
+    """Inscrit un compte client au registre node_accounts (avant son provisioning)."""
+    cursor.execute("INSERT IGNORE INTO node_accounts (node_id, username) VALUES (%s, %s)", (node_id, username))
+
+def record_change(cursor, entity, entity_ids):
+    """Journalise dans change_log les entités modifiées (même transaction que la modification)."""
+    if entity_ids:
+        cursor.executemany("INSERT INTO change_log (entity, entity_id) VALUES (%s, %s)",
+                           [(entity, entity_id) for entity_id in entity_ids])
+
+def settled_change_version(cursor):
+    """
+    Dernière version stable de change_log (plus vieille que CHANGE_LOG_SETTLE) : une
+    transaction plus lente peut encore committer une version inférieure aux plus récentes.
+    Lecture à rebours sur la clé primaire, arrêtée à la première ligne stable.
+    """
+    cursor.execute("""
+        SELECT version FROM change_log
+        WHERE created_at < NOW() - INTERVAL %s SECOND
+        ORDER BY version DESC
+        LIMIT 1
+    """, (CHANGE_LOG_SETTLE,))
+    row = cursor.fetchone()
+    return row['version'] if row else 0
+
 # -----------------------
 # DB connection
 # -----------------------
@@ -71,6 +194,84 @@ def resolve_worker_ip(ip):
     return ip
 
 # --- Ansible runner ---
+def user_vars(client_user):
+    """Variables Ansible du compte ciblé ; une liste de comptes devient target_users."""
+    if isinstance(client_user, (list, tuple)):
+        return {"target_users": list(client_user)}
+    return {"target_user": client_user}
+
+class AnsibleEventCollector:
+    """
+    event_handler d'ansible-runner : retient les échecs de tâches (hors ignore_errors).
+    Seul playbook_on_stats est écrit dans les artefacts (job_events) : Runner.stats le
+    relit pour le bilan par hôte, les autres événements restent en mémoire.
+    """
+    FAILURE_EVENTS = ('runner_on_failed', 'runner_on_unreachable')
+    KEPT_EVENTS = ('playbook_on_stats',)
+
+    def __init__(self):
+        self.failures = []
+
+    def __call__(self, event):
+        if event.get('event') in self.FAILURE_EVENTS:
+            data = event.get('event_data') or {}
+            if not data.get('ignore_errors'):
+                res = data.get('res') or {}
+                detail = res.get('msg') or res.get('stderr') or ''
+                self.failures.append(f"{data.get('host')} / {data.get('task')}: {detail}")
+        return event.get('event') in self.KEPT_EVENTS
+
+_ansible_local = threading.local()
+_ansible_cfg_lock = threading.Lock()
+
+def get_ansible_config():
+    """
+    ansible.cfg du profil, généré une fois : pipelining (un seul aller-retour SSH par
+    tâche) et sockets ControlPersist réutilisés d'un run à l'autre vers un même worker.
+    """
+    path = os.path.join(ANSIBLE_PROFILE_DIR, 'ansible.cfg')
+    with _ansible_cfg_lock:
+        if not os.path.exists(path):
+            control_dir = os.path.join(ANSIBLE_PROFILE_DIR, 'cp')
+            os.makedirs(control_dir, mode=0o700, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}"
+            with open(tmp_path, 'w') as f:
+                f.write(ANSIBLE_CFG_TEMPLATE.format(persist=ANSIBLE_CONTROL_PERSIST, control_dir=control_dir))
+            os.replace(tmp_path, path)
+    return path
+
+def get_private_data_dir():
+    """Répertoire ansible-runner réutilisé par thread, au lieu d'un répertoire temporaire par run."""
+    if getattr(_ansible_local, 'pid', None) != os.getpid():
+        _ansible_local.path = os.path.join(ANSIBLE_PROFILE_DIR, f"runner-{os.getpid()}-{threading.get_ident()}")
+        _ansible_local.pid = os.getpid()
+        os.makedirs(_ansible_local.path, mode=0o700, exist_ok=True)
+    return _ansible_local.path
+
+def run_ansible_profiled(playbook_name, inventory, **kwargs):
+    """ansible_runner.run avec le profil de performance ; retourne (runner, échecs)."""
+    private_data_dir = get_private_data_dir()
+    collector = AnsibleEventCollector()
+    if DEPROVISION_MODE == 'fast':
+        playbook_name = FAST_PLAYBOOKS.get(playbook_name, playbook_name)
+    try:
+        r = ansible_runner.run(
+            private_data_dir=private_data_dir,
+            playbook=f"/ansible/{playbook_name}",
+            inventory=inventory,
+            envvars={'ANSIBLE_CONFIG': get_ansible_config()},
+            event_handler=collector,
+            quiet=True,
+            suppress_output_file=True,
+            rotate_artifacts=1,
+            **kwargs
+        )
+    finally:
+        # Inventaire et extravars contiennent des mots de passe : ne pas les laisser sur disque
+        for sub in ('inventory', 'env'):
+            shutil.rmtree(os.path.join(private_data_dir, sub), ignore_errors=True)
+    return r, collector.failures
+
 def run_ansible_task(playbook_name, host_ip, host_port, client_user, client_pass):
     inventory = {
         'all': {
@@ -87,49 +288,328 @@ def run_ansible_task(playbook_name, host_ip, host_port, client_user, client_pass
     }
 
     extravars = {
-        "target_user": client_user,
+        **user_vars(client_user),
         "target_pass": client_pass
     }
 
-    playbook_path = f"/ansible/{playbook_name}"
     logging.info(f"Execution d'Ansible ({playbook_name}) sur {host_ip}:{host_port} pour {client_user}...")
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        r = ansible_runner.run(
-            private_data_dir=tmpdir,
-            playbook=playbook_path,
-            inventory=inventory,
-            extravars=extravars
-        )
-        if r.rc != 0:
-            try:
-                logging.info(f"echec d'Ansible pour {host_ip}:{host_port}. RC={r.rc}")
-                logging.info(f"STDOUT: {r.stdout.read()}")
-                logging.info(f"STDERR: {r.stderr.read()}")
-            except Exception:
-                pass
-            return False
+    r, failures = run_ansible_profiled(playbook_name, inventory, extravars=extravars)
+    if r.rc != 0:
+        logging.info(f"echec d'Ansible pour {host_ip}:{host_port}. RC={r.rc}")
+        for failure in failures:
+            logging.info(f"Tâche en échec : {failure}")
+        return False
     logging.info(f"Ansible a termine avec succes pour {client_user} sur {host_ip}:{host_port}.")
     return True
 
+# -----------------------
+# Provisioner SSH direct (session paramiko réutilisée)
+# -----------------------
+class SSHSessionPool:
+    """
+    Garde une session SSH ouverte par worker (host, port) et y ouvre un canal par
+    opération, ce qui évite le démarrage d'ansible-playbook et le handshake SSH à
+    chaque provisioning. Les sessions inactives depuis `idle_timeout` sont fermées.
+    """
+
+    def __init__(self, idle_timeout):
+        self.idle_timeout = idle_timeout
+        self.pid = os.getpid()
+        self._sessions = {}   # (host, port) -> [client, dernier usage]
+        self._locks = {}      # (host, port) -> verrou de création de la session
+        self._lock = threading.Lock()
+
+    def _connect(self, host, port):
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(hostname=host, port=port, username=WORKER_SSH_USER,
+                       password=WORKER_SSH_PASS, timeout=SSH_CONNECT_TIMEOUT,
+                       allow_agent=False, look_for_keys=False)
+        client.get_transport().set_keepalive(30)
+        return client
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, (client, last_used) in list(self._sessions.items()):
+                if now - last_used > self.idle_timeout:
+                    expired.append(client)
+                    del self._sessions[key]
+        for client in expired:
+            client.close()
+
+    def _get(self, host, port):
+        key = (host, port)
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._sessions.get(key)
+            if entry:
+                transport = entry[0].get_transport()
+                if transport is not None and transport.is_active():
+                    entry[1] = time.monotonic()
+                    return entry[0]
+                entry[0].close()
+            client = self._connect(host, port)
+            with self._lock:
+                self._sessions[key] = [client, time.monotonic()]
+            return client
+
+    def drop(self, host, port):
+        with self._lock:
+            entry = self._sessions.pop((host, port), None)
+        if entry:
+            entry[0].close()
+
+    def run(self, host, port, command, stdin_data=None):
+        """Exécute `command` sur le worker ; retourne (rc, stdout, stderr)."""
+        self._evict_idle()
+        for attempt in (1, 2):
+            client = self._get(host, port)
+            try:
+                stdin, stdout, stderr = client.exec_command(command, timeout=SSH_COMMAND_TIMEOUT)
+                if stdin_data is not None:
+                    stdin.write(stdin_data)
+                stdin.channel.shutdown_write()
+                out = stdout.read().decode(errors='replace')
+                err = stderr.read().decode(errors='replace')
+                return stdout.channel.recv_exit_status(), out, err
+            except (paramiko.SSHException, EOFError, OSError):
+                # Session cassée (worker redémarré, timeout...) : une seule nouvelle tentative
+                self.drop(host, port)
+                if attempt == 2:
+                    raise
+
+
+_ssh_sessions = None
+_ssh_sessions_lock = threading.Lock()
+
+def get_ssh_sessions():
+    """Sessions SSH du process courant ; recréées après un fork."""
+    global _ssh_sessions
+    with _ssh_sessions_lock:
+        if _ssh_sessions is None or _ssh_sessions.pid != os.getpid():
+            _ssh_sessions = SSHSessionPool(SSH_SESSION_IDLE_TIMEOUT)
+        return _ssh_sessions
+
+_script_cache = {}
+
+def load_provision_script(playbook_name):
+    """Script shell équivalent au playbook (ansible/scripts/<nom>.sh), ou None."""
+    name = os.path.splitext(playbook_name)[0] + '.sh'
+    if name not in _script_cache:
+        path = os.path.join(PROVISION_SCRIPTS_DIR, name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            _script_cache[name] = f.read()
+    return _script_cache[name]
+
+def build_script_command(script, *args):
+    """Commande `sh -c <script> sh <args>` (avec sudo si l'utilisateur SSH n'est pas root)."""
+    command = ' '.join(['sh', '-c', shlex.quote(script), 'sh'] + [shlex.quote(a) for a in args])
+    if WORKER_SSH_USER != 'root':
+        command = 'sudo -n ' + command
+    return command
+
+def run_ssh_provision(playbook_name, host_ip, host_port, client_user, client_pass):
+    """
+    Exécute l'équivalent shell d'un playbook via une session SSH réutilisée.
+    Retourne False si le script échoue ; lève une exception si le worker est injoignable.
+    """
+    script = load_provision_script(playbook_name)
+    if script is None:
+        raise ValueError(f"Aucun script SSH pour {playbook_name}")
+    users = client_user if isinstance(client_user, (list, tuple)) else [client_user]
+    command = build_script_command(script, *users)
+    stdin_data = f"{client_pass or ''}\n"
+
+    started = time.monotonic()
+    rc, out, err = get_ssh_sessions().run(host_ip, host_port, command, stdin_data)
+    elapsed_ms = (time.monotonic() - started) * 1000
+    if rc != 0:
+        logging.error(f"echec SSH ({playbook_name}) pour {host_ip}:{host_port}. RC={rc}")
+        logging.error(f"STDOUT: {out}")
+        logging.error(f"STDERR: {err}")
+        return False
+    logging.info(f"{playbook_name} via SSH pour {client_user} sur {host_ip}:{host_port} en {elapsed_ms:.0f} ms.")
+    return True
+
+# Provisioner Docker exec : workers conteneurs sur le même hôte, sans SSH
+_docker_client = None
+
+def get_docker_client():
+    """Client Docker Engine (socket monté), créé à la demande : dépendance optionnelle."""
+    global _docker_client
+    if _docker_client is None:
+        import docker
+        _docker_client = docker.from_env()
+    return _docker_client
+
+def run_docker_provision(playbook_name, container_name, client_user, client_pass):
+    """
+    Exécute l'équivalent shell d'un playbook dans le conteneur du worker via l'API exec
+    de Docker, sans SSH. Le mot de passe passe par l'environnement de l'exec (TARGET_PASS).
+    Retourne False si le script échoue ; lève une exception si le conteneur est introuvable.
+    """
+    script = load_provision_script(playbook_name)
+    if script is None:
+        raise ValueError(f"Aucun script pour {playbook_name}")
+    users = client_user if isinstance(client_user, (list, tuple)) else [client_user]
+    container = get_docker_client().containers.get(container_name)
+
+    started = time.monotonic()
+    rc, output = container.exec_run(["sh", "-c", script, "sh", *users], user="root",
+                                    environment={"TARGET_PASS": client_pass or ""})
+    elapsed_ms = (time.monotonic() - started) * 1000
+    if rc != 0:
+        logging.error(f"echec Docker exec ({playbook_name}) dans {container_name}. RC={rc}")
+        logging.error(f"OUTPUT: {output}")
+        return False
+    logging.info(f"{playbook_name} via Docker exec pour {client_user} dans {container_name} en {elapsed_ms:.0f} ms.")
+    return True
+
+def run_provision(playbook_name, host_ip, host_port, client_user, client_pass, container_name=None):
+    """
+    Point d'entrée du provisioning : backend PROVISIONER_BACKEND, Ansible en repli.
+    Le backend docker n'est utilisé que pour les nœuds dont le conteneur est connu.
+    """
+    if PROVISIONER_BACKEND == 'docker' and container_name:
+        try:
+            return run_docker_provision(playbook_name, container_name, client_user, client_pass)
+        except Exception as e:
+            logging.warning(f"Provisioner Docker indisponible pour {container_name} ({e}), repli sur Ansible")
+    elif PROVISIONER_BACKEND == 'ssh':
+        try:
+            return run_ssh_provision(playbook_name, host_ip, host_port, client_user, client_pass)
+        except Exception as e:
+            logging.warning(f"Provisioner SSH indisponible pour {host_ip}:{host_port} ({e}), repli sur Ansible")
+    return run_ansible_task(playbook_name, host_ip, host_port, client_user, client_pass)
+
+def split_waves(targets):
+    """
+    Répartit les cibles en vagues où chaque worker (host, port) n'apparaît qu'une fois,
+    pour ne pas lancer deux useradd/userdel simultanés sur le même /etc/passwd.
+    """
+    waves = []
+    for t in targets:
+        host = (t['host_ip'], t['host_port'])
+        for wave in waves:
+            if host not in wave:
+                wave[host] = t
+                break
+        else:
+            waves.append({host: t})
+    return [list(w.values()) for w in waves]
+
+def run_ansible_batch(playbook_name, targets):
+    """
+    Exécute un playbook sur plusieurs workers en un seul ansible-playbook par vague :
+    un hôte d'inventaire par cible, avec target_user/target_pass en variables d'hôte.
+    targets : [{key, host_ip, host_port, client_user, client_pass}], client_user pouvant
+    être une liste de comptes (delete_user.yml). Retourne {key: succès}.
+    """
+    results = {}
+    for wave in split_waves(targets):
+        hosts = {}
+        aliases = {}
+        for i, t in enumerate(wave):
+            alias = f"target_{i}"
+            aliases[alias] = t['key']
+            hosts[alias] = {
+                'ansible_host': t['host_ip'],
+                'ansible_port': t['host_port'],
+                'ansible_user': WORKER_SSH_USER,
+                'ansible_password': WORKER_SSH_PASS,
+                'ansible_ssh_common_args': '-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null',
+                **user_vars(t['client_user']),
+                'target_pass': t['client_pass'],
+            }
+        inventory = {'all': {'hosts': hosts}}
+
+        logging.info(f"Execution d'Ansible ({playbook_name}) en lot sur {len(wave)} hôte(s)...")
+        r, failures = run_ansible_profiled(playbook_name, inventory, forks=min(ANSIBLE_FORKS, len(wave)))
+        stats = r.stats or {}
+
+        failed_hosts = set(stats.get('failures', {})) | set(stats.get('dark', {}))
+        processed = set(stats.get('processed', {}))
+        for alias, key in aliases.items():
+            results[key] = alias in processed and alias not in failed_hosts
+        if failed_hosts or r.rc != 0:
+            logging.error(f"echec d'Ansible en lot ({playbook_name}). RC={r.rc}, hôtes en échec: "
+                          f"{[aliases[a] for a in failed_hosts if a in aliases]}")
+            for failure in failures:
+                logging.error(f"Tâche en échec : {failure}")
+    return results
+
+def run_provision_batch(playbook_name, targets):
+    """Version en lot de run_provision ; retourne {key: succès}."""
+    if not targets:
+        return {}
+    if PROVISIONER_BACKEND in ('ssh', 'docker'):
+        # Sessions SSH réutilisées / exec Docker : on parallélise simplement les opérations unitaires
+        def run_one(t):
+            return run_provision(playbook_name, t['host_ip'], t['host_port'], t['client_user'], t['client_pass'],
+                                 container_name=t.get('container_name'))
+        results = {}
+        for wave in split_waves(targets):
+            with ThreadPoolExecutor(max_workers=min(ANSIBLE_FORKS, len(wave))) as pool:
+                for t, ok in zip(wave, pool.map(run_one, wave)):
+                    results[t['key']] = ok
+        return results
+    return run_ansible_batch(playbook_name, targets)
+
 # --- Health check ---
-def check_socket(ip, port):
+# Sonde à niveaux, du moins cher au plus cher : TCP, bannière SSH, authentification.
+# La latence et le résultat de chaque niveau sont cumulés dans probe_stats.
+PROBE_TIERS = ('tcp', 'banner', 'auth')
+probe_stats = {tier: {"count": 0, "failures": 0, "total_ms": 0.0} for tier in PROBE_TIERS}
+_probe_stats_lock = threading.Lock()
+
+def record_probe(tier, ok, started):
+    elapsed_ms = (time.monotonic() - started) * 1000
+    with _probe_stats_lock:
+        stats = probe_stats[tier]
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        if not ok:
+            stats["failures"] += 1
+    return ok
+
+def format_probe_stats():
+    with _probe_stats_lock:
+        parts = []
+        for tier in PROBE_TIERS:
+            stats = probe_stats[tier]
+            avg = stats["total_ms"] / stats["count"] if stats["count"] else 0.0
+            parts.append(f"{tier}: {stats['count']} ({stats['failures']} échecs, {avg:.0f} ms moy.)")
+        return ", ".join(parts)
+
+def probe_tcp_banner(ip, port):
+    """Niveaux 1 et 2 : connexion TCP puis lecture de la bannière 'SSH-...' (aucune crypto)."""
+    started = time.monotonic()
     try:
-        if ip == 'host.docker.internal':
-            # Resolve manually to be sure? Not needed if socket does it.
-            pass
         sock = socket.create_connection((ip, port), timeout=SSH_TIMEOUT)
+    except Exception:
+        return record_probe('tcp', False, started)
+    try:
+        record_probe('tcp', True, started)
+        started = time.monotonic()
+        try:
+            sock.settimeout(SSH_TIMEOUT)
+            banner = sock.recv(256)
+        except Exception:
+            banner = b""
+        return record_probe('banner', banner.startswith(b"SSH-"), started)
+    finally:
         sock.close()
-        return True
-    except Exception as e:
-        # logging.warning(f"Socket connection failed for {ip}:{port} : {e}")
-        return False
-
-def check_node_health(ip, port):
-    # Pre-check TCP socket before Paramiko
-    if not check_socket(ip, port):
-        return 'dead'
 
+def probe_auth(ip, port):
+    """Niveau 3 : authentification SSH complète (handshake + crypto, le plus coûteux)."""
+    started = time.monotonic()
     client = None
     try:
         client = paramiko.SSHClient()
@@ -137,13 +617,57 @@ def check_node_health(ip, port):
         client.connect(hostname=ip, port=port, username=WORKER_SSH_USER,
                        password=WORKER_SSH_PASS, timeout=SSH_TIMEOUT,
                        allow_agent=False, look_for_keys=False)
-        return 'alive'
+        return record_probe('auth', True, started)
     except Exception:
-        return 'dead'
+        return record_probe('auth', False, started)
     finally:
         if client:
             client.close()
 
+def check_node_health(ip, port, previous_status=None):
+    """
+    Un nœud sans bannière SSH est mort. Un nœud déjà 'alive' qui répond reste 'alive'
+    sans authentification, sauf sur un échantillon HEALTH_AUTH_SAMPLE_RATE des sondes ;
+    un changement d'état vers 'alive' est toujours confirmé par une authentification.
+    """
+    if not probe_tcp_banner(ip, port):
+        return 'dead'
+    if previous_status == 'alive' and random.random() >= HEALTH_AUTH_SAMPLE_RATE:
+        return 'alive'
+    return 'alive' if probe_auth(ip, port) else 'dead'
+
+# Sondes en parallèle : un lot de HEALTH_CHECK_BATCH nœuds par passage,
+# au plus HEALTH_CHECK_CONCURRENCY sondes simultanées par réplica
+health_check_stats = {"probes": 0, "seconds": 0.0}
+_health_check_stats_lock = threading.Lock()
+
+def record_health_check_rate(probes, seconds):
+    """Cumule le débit du health check ; retourne la moyenne en sondes/s depuis le démarrage."""
+    with _health_check_stats_lock:
+        health_check_stats["probes"] += probes
+        health_check_stats["seconds"] += seconds
+        if not health_check_stats["seconds"]:
+            return 0.0
+        return health_check_stats["probes"] / health_check_stats["seconds"]
+
+def probe_nodes(nodes):
+    """Sonde les nœuds en parallèle ; retourne {node_id: 'alive' | 'dead'}."""
+    def probe(node):
+        ip_to_use = resolve_worker_ip(node['ip'])
+        try:
+            status = check_node_health(ip_to_use, node['ssh_port'], node.get('status'))
+        except Exception as e:
+            logging.error(f"Erreur sonde du nœud {node['id']}: {e}")
+            status = 'dead'
+        logging.info(f"Node {node['id']} ({node['ip']} -> {ip_to_use}) -> {status}")
+        return status
+
+    if not nodes:
+        return {}
+    workers = max(1, min(HEALTH_CHECK_CONCURRENCY, len(nodes)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='health') as pool:
+        return {node['id']: status for node, status in zip(nodes, pool.map(probe, nodes))}
+
 # Mise à jour pour ne vérifier que les nœuds du scheduler actuel
 # Refactor: Work Queue pattern (SKIP LOCKED) to allow multiple schedulers
 def job_health_check():
@@ -152,20 +676,45 @@ def job_health_check():
     if not conn:
         return
     try:
+        cursor = conn.cursor(dictionary=True)
+
+        # Heartbeat frais = worker vivant, sans SSH. Seuls les nœuds 'unknown' sont touchés
+        # (peu de lignes via idx_nodes_status) : un nœud 'dead' qui renvoie des heartbeats
+        # (agent vivant, sshd peut-être pas) doit repasser la sonde d'authentification.
+        # Journalisés dans la même transaction que le changement de statut.
+        conn.start_transaction()
+        cursor.execute("""
+            INSERT INTO change_log (entity, entity_id)
+            SELECT 'node', id FROM nodes
+            WHERE status='unknown' AND last_heartbeat >= NOW() - INTERVAL %s SECOND
+        """, (HEARTBEAT_TIMEOUT,))
+        cursor.execute("""
+            UPDATE nodes SET status='alive', last_checked=NOW(), dead_since=NULL
+            WHERE status='unknown' AND last_heartbeat >= NOW() - INTERVAL %s SECOND
+        """, (HEARTBEAT_TIMEOUT,))
+        revived = cursor.rowcount
+        conn.commit()
+        if revived:
+            logging.info(f"[Tâche 1] {revived} nœud(s) marqué(s) alive par heartbeat.")
+
         # We need a transaction for SELECT ... FOR UPDATE
         conn.start_transaction()
-        cursor = conn.cursor(dictionary=True)
 
-        # Work Queue: Select nodes that need checking (older than 30s)
+        # Work Queue: Select nodes that need checking (older than 5s)
         # Using SKIP LOCKED to allow multiple schedulers to pick different nodes
+        # Seuls les nœuds sans heartbeat récent sont sondés en SSH (confirmation de panne,
+        # ou agents sans heartbeat), plus les nœuds 'dead' : leur retour n'est validé que par
+        # une authentification (check_node_health), jamais par un heartbeat seul
         cursor.execute("""
-            SELECT id, ip, ssh_port 
+            SELECT id, ip, ssh_port, status
             FROM nodes 
             WHERE 
                 (last_checked IS NULL OR last_checked < NOW() - INTERVAL 5 SECOND)
-            LIMIT 10
+                AND (last_heartbeat IS NULL OR last_heartbeat < NOW() - INTERVAL %s SECOND
+                     OR status='dead')
+            LIMIT %s
             FOR UPDATE SKIP LOCKED
-        """)
+        """, (HEARTBEAT_TIMEOUT, HEALTH_CHECK_BATCH))
         nodes = cursor.fetchall()
         
         if not nodes:
@@ -193,25 +742,43 @@ def job_health_check():
             cursor.execute(update_sql, tuple(node_ids))
             conn.commit()
             
-            # Now perform checks (unlocked)
+            # Now perform checks (unlocked), en parallèle
+            started = time.monotonic()
+            statuses = probe_nodes(nodes)
+            elapsed = time.monotonic() - started
+
             # Use a NEW connection for updates to ensure they are committed independently
+            # Une seule requête par statut pour tout le lot
             update_conn = get_db_connection(autocommit=True)
             if update_conn:
                 update_cursor = update_conn.cursor()
+                by_status = {}
                 for node in nodes:
-                    ip_to_use = resolve_worker_ip(node['ip'])
-                    status = check_node_health(ip_to_use, node['ssh_port'])
-                    logging.info(f"Node {node['id']} ({node['ip']} -> {ip_to_use}) -> {status}")
-                    
+                    by_status.setdefault(statuses[node['id']], []).append(node['id'])
+                for status, ids in by_status.items():
+                    # dead_since : instant de détection de la panne (temps de rétablissement)
+                    dead_since = "COALESCE(dead_since, NOW())" if status == 'dead' else "NULL"
                     try:
+                        update_conn.start_transaction()
                         update_cursor.execute(
-                            "UPDATE nodes SET status=%s WHERE id=%s",
-                            (status, node['id'])
+                            f"UPDATE nodes SET status=%s, dead_since={dead_since} "
+                            f"WHERE id IN ({','.join(['%s'] * len(ids))})",
+                            (status, *ids)
                         )
+                        # Seuls les changements de statut alimentent le flux du dashboard
+                        record_change(update_cursor, 'node',
+                                      [n['id'] for n in nodes if n['id'] in ids and n['status'] != status])
+                        update_conn.commit()
                     except Exception as e:
-                        logging.error(f"Error updating status for node {node['id']}: {e}")
+                        logging.error(f"Error updating status for nodes {ids}: {e}")
+                        update_conn.rollback()
                 update_conn.close()
-                logging.info(f"[Tâche 1] Health Check finished for {len(nodes)} nodes.")
+
+            rate = record_health_check_rate(len(nodes), elapsed)
+            logging.info(f"[Tâche 1] Health Check finished for {len(nodes)} nodes in {elapsed:.2f}s "
+                         f"({len(nodes) / elapsed if elapsed else 0:.1f} probes/s, "
+                         f"moyenne {rate:.1f} probes/s).")
+            logging.info(f"[Tâche 1] Sondes par niveau : {format_probe_stats()}")
         else:
             conn.rollback()
 
@@ -233,28 +800,30 @@ def job_migrate_dead_nodes():
         conn.start_transaction()
         cursor = conn.cursor(dictionary=True)
 
-        # Work Queue: Select dead & allocated nodes
+        # Work Queue: Select dead nodes that still host tenants
         # SKIP LOCKED allows concurrent processing
         cursor.execute(
-            "SELECT id FROM nodes WHERE status='dead' AND allocated=TRUE FOR UPDATE SKIP LOCKED"
+            "SELECT id FROM nodes WHERE status='dead' AND slots_used > 0 FOR UPDATE SKIP LOCKED"
         )
         dead_nodes = cursor.fetchall()
         if not dead_nodes:
             conn.rollback()
-            return
 
+        migrations = []
         for node in dead_nodes:
             try:
-                reassign_rental_on_node_failure(node['id'], cursor)
+                node_migrations = reassign_rental_on_node_failure(node['id'], cursor)
                 conn.commit()
+                migrations.extend(node_migrations)
             except Exception as e:
                 logging.error(f"Failed to migrate node {node['id']}: {e}")
                 conn.rollback()
-        
-        # Metadata or logic to mark as processed? 
-        # reassign_rental_on_node_failure likely updates the rental/node state,
-        # effectively removing it from this query's result set for next time.
-        # conn.commit() # This commit is now handled inside the loop for each node.
+
+        # Remplaçants dont le provisioning a échoué lors d'un passage précédent
+        migrations.extend(claim_pending_migrations(conn))
+
+        # Verrous relâchés : provisioning des remplaçants en parallèle
+        provision_migrations(conn, migrations)
 
     except Exception as e:
         logging.error(f"[Tâche 2] Erreur migration : {e}")
@@ -268,175 +837,305 @@ def job_migrate_dead_nodes():
 
 def reassign_rental_on_node_failure(dead_node_id, cursor):
     """
-    Déplace les locations actives du nœud mort vers un autre nœud.
+    Déplace les locations actives du nœud mort vers d'autres nœuds, en base uniquement :
+    une requête pour les locations (avec le username), une pour tous les remplaçants.
+    Chaque location prend un slot libre, en remplissant d'abord les nœuds déjà occupés ;
+    deux locations d'un même client ne partagent jamais un nœud.
     Marque le nœud mort comme "dirty" (needs_cleanup=TRUE).
-    Met à jour la DB via le cursor fourni (faisant partie de la transaction appelante).
+    Met à jour la DB via le cursor fourni (faisant partie de la transaction appelante) et
+    retourne les comptes à créer, provisionnés après le commit par provision_migrations.
     """
     logging.info(f"[Tâche 2] Réattribution pour le nœud {dead_node_id}...")
-    
-    try:
-        # 1. Identifier les locations actives sur ce nœud (Lock row if needed, but we hold Node lock)
-        # Using the passed cursor (reusing transaction/connection)
 
-        cursor.execute("SELECT * FROM rentals WHERE node_id=%s AND active=TRUE FOR UPDATE", (dead_node_id,))
+    try:
+        # 1. Locations actives du nœud mort, avec les données du client
+        cursor.execute("""
+            SELECT r.*, u.username
+            FROM rentals r
+            JOIN users u ON r.user_id = u.id
+            WHERE r.node_id=%s AND r.active=TRUE
+            FOR UPDATE
+        """, (dead_node_id,))
         affected_rentals = cursor.fetchall()
-        
+
         if not affected_rentals:
-            # Pas de locations actives, on marque juste le nœud comme non alloué mais toujours mort
-            # (Le health check le passera en alive s'il revient)
             # Pas de locations actives, on marque juste le nœud comme non alloué mais dirty
             # (Le health check le passera en alive s'il revient, mais il devra être nettoyé)
-            cursor.execute("UPDATE nodes SET allocated=FALSE, needs_cleanup=TRUE WHERE id=%s", (dead_node_id,))
-            # conn.commit() # Caller will commit
-            return
+            cursor.execute("UPDATE nodes SET slots_used=0, allocated=FALSE, needs_cleanup=TRUE WHERE id=%s",
+                           (dead_node_id,))
+            record_change(cursor, 'node', [dead_node_id])
+            return []
 
         logging.info(f"Migration de {len(affected_rentals)} locations depuis le nœud {dead_node_id}...")
-        
-        # 2. Trouver des nœuds de remplacement
-        # On cherche autant de nœuds que nécessaire
+
+        # 2. Tous les nœuds de remplacement en une requête (mêmes critères que /rent). Les
+        # nœuds où l'un des clients concernés a déjà une location sont écartés, donc au plus
+        # un nœud par location suffit.
         needed = len(affected_rentals)
+        user_ids = sorted({rental['user_id'] for rental in affected_rentals})
         cursor.execute(f"""
-            SELECT * FROM nodes 
-            WHERE status='alive' AND allocated=FALSE AND id != %s
+            SELECT * FROM nodes
+            WHERE status='alive' AND allocated=FALSE AND needs_cleanup=FALSE AND id != %s
+              AND NOT EXISTS (
+                  SELECT 1 FROM rentals r
+                  WHERE r.node_id = nodes.id AND r.active = TRUE
+                    AND r.user_id IN ({','.join(['%s'] * len(user_ids))})
+              )
+            ORDER BY idle, cpu_cores, memory_mb, disk_gb, id
             LIMIT {needed}
             FOR UPDATE SKIP LOCKED
-        """, (dead_node_id,))
+        """, (dead_node_id, *user_ids))
         replacements = cursor.fetchall()
-        logging.info(f"Trouvé {len(replacements)} nœuds de remplacement (besoin: {needed})")
 
-        if len(replacements) < needed:
-            logging.error(f"Pas assez de nœuds libres pour migrer tout le monde (besoin: {needed}, dispo: {len(replacements)})")
-            # On migre ce qu'on peut ? Ou on fail tout ?
-            # Pour l'instant, on migre ce qu'on peut.
-        
-        # 3. Effectuer la migration
-        for i, rental in enumerate(affected_rentals):
-            if i >= len(replacements):
-                logging.error(f"Impossible de migrer la location {rental['id']} (user {rental['user_id']}): plus de nœud dispo.")
+        # Placement slot par slot : premier nœud avec un slot libre, sans ce client
+        free_slots = {node['id']: node.get('slots', 1) - node.get('slots_used', 0) for node in replacements}
+        placements, taken = [], set()
+        for rental in affected_rentals:
+            new_node = next((node for node in replacements
+                             if free_slots[node['id']] > 0 and (node['id'], rental['user_id']) not in taken),
+                            None)
+            if new_node is None:
+                logging.error(f"Impossible de migrer la location {rental['id']} (user {rental['user_id']}): plus de slot dispo.")
                 continue
+            free_slots[new_node['id']] -= 1
+            taken.add((new_node['id'], rental['user_id']))
+            placements.append((rental, new_node))
+        logging.info(f"{len(placements)}/{needed} location(s) replacée(s) sur {len(replacements)} nœud(s)")
 
-            new_node = replacements[i]
-            
-            # Option A: On met à jour la location existante (simple)
-            # MAIS on perd la trace que l'user était sur l'ancien nœud pour le cleanup !
-            # Option B: On ferme l'ancienne location (active=FALSE) et on en crée une nouvelle.
-            # C'est mieux pour l'historique et pour le cleanup du nœud mort.
-            
-            # Fermer l'ancienne location
-            # On note qu'elle a été interrompue/migrée ? Active=FALSE suffit.
-            cursor.execute("UPDATE rentals SET active=FALSE WHERE id=%s", (rental['id'],))
-            
-            # Créer la nouvelle location
-            # On garde les mêmes infos (user, dates, password)
-            sql_insert = """
+        # 3. Effectuer la migration en base : l'ancienne location est fermée (historique et
+        # cleanup du nœud mort) et une nouvelle est créée avec les mêmes infos
+        migrations = []
+        for rental, new_node in placements:
+            cursor.execute("UPDATE rentals SET active=FALSE, ended_at=NOW() WHERE id=%s", (rental['id'],))
+            cursor.execute("""
                 INSERT INTO rentals (node_id, user_id, leased_from, leased_until, active, ssh_password)
                 VALUES (%s, %s, %s, %s, TRUE, %s)
-            """
-            cursor.execute(sql_insert, (
-                new_node['id'], 
-                rental['user_id'], 
-                rental['leased_from'], 
-                rental['leased_until'], 
+            """, (
+                new_node['id'],
+                rental['user_id'],
+                rental['leased_from'],
+                rental['leased_until'],
                 rental['ssh_password']
             ))
             new_rental_id = cursor.lastrowid
-            
-            # Marquer le nouveau nœud comme alloué
-            cursor.execute("UPDATE nodes SET allocated=TRUE WHERE id=%s", (new_node['id'],))
-            
-            # Provisioning du nouveau nœud
-            # On doit le faire ici (ou via une queue). On le fait synchrone (bloquant mais simple).
-            # Mais c'est critique.
-            # Récupérer username
-            cursor.execute("SELECT username FROM users WHERE id=%s", (rental['user_id'],))
-            user_row = cursor.fetchone()
-            client_user = user_row['username']
-            
-            ip_to_use = resolve_worker_ip(new_node['ip'])
-            client_pass = decrypt_password(rental['ssh_password'])
-            
-            # Lancer Ansible en background ou synchrone ? 
-            # Le scheduler est monothread ici, ça va bloquer.
-            success = run_ansible_task('create_user.yml', ip_to_use, new_node['ssh_port'], client_user, client_pass)
-            if success:
-                logging.info(f"Migration réussie: Rental {rental['id']} -> Nouveau Rental {new_rental_id} sur Node {new_node['id']}")
-            else:
-                logging.error(f"Migration partielle: Provisioning échoué sur le nouveau nœud {new_node['id']}")
-                # On laisse quand même le rental actif ? On risque d'avoir un user sans accès.
-        
-        # 4. Marquer l'ancien nœud comme non alloué et dirty
-        cursor.execute("UPDATE nodes SET allocated=FALSE, needs_cleanup=TRUE WHERE id=%s", (dead_node_id,))
-        
-        # conn.commit() # Caller will commit
+            record_change(cursor, 'rental', [rental['id'], new_rental_id])
+
+            # Occuper un slot du nouveau nœud (allocated une fois plein)
+            cursor.execute("UPDATE nodes SET slots_used = slots_used + 1, allocated = (slots_used >= slots) WHERE id=%s",
+                           (new_node['id'],))
+            ledger_add_account(cursor, new_node['id'], rental['username'])
+
+            # Suivi du temps de rétablissement depuis la détection de la panne. retry_after
+            # couvre aussi un scheduler arrêté avant la fin du provisioning.
+            cursor.execute("""
+                INSERT INTO rental_migrations (old_rental_id, new_rental_id, dead_node_id, new_node_id, dead_since,
+                                               retry_after)
+                SELECT %s, %s, %s, %s, COALESCE(dead_since, NOW()), NOW() + INTERVAL %s SECOND FROM nodes WHERE id=%s
+            """, (rental['id'], new_rental_id, dead_node_id, new_node['id'], MIGRATION_RETRY_DELAY, dead_node_id))
+
+            migrations.append({
+                'key': new_rental_id,
+                'old_rental_id': rental['id'],
+                'new_node_id': new_node['id'],
+                'attempts': 1,
+                'host_ip': resolve_worker_ip(new_node['ip']),
+                'host_port': new_node['ssh_port'],
+                'client_user': rental['username'],
+                'client_pass': decrypt_password(rental['ssh_password']),
+                'container_name': new_node.get('container_name'),
+            })
+
+        # 4. Marquer l'ancien nœud comme dirty ; ses slots restent occupés par les locations
+        # non migrées, reprises au prochain passage
+        cursor.execute("""
+            UPDATE nodes
+            SET slots_used = %s, allocated = FALSE, needs_cleanup = TRUE
+            WHERE id = %s
+        """, (len(affected_rentals) - len(placements), dead_node_id))
+        return migrations
 
     except Exception as e:
         logging.error(f"Erreur reassign_rental_on_node_failure: {e}")
         # La transaction sera rollback par l'appelant
         raise e
-    # finally: # No connection to close here, it's managed by the caller
-    #     if conn and conn.is_connected():
-    #         conn.close()
 
+def claim_pending_migrations(conn):
+    """
+    Réclame les migrations restées 'provisioning' dont retry_after est passé (création du
+    compte en échec, ou scheduler arrêté en cours de route) : retry_after est repoussé dans
+    une transaction courte, comme un délai de visibilité, puis les comptes sont relus.
+    Une migration dont la location n'est plus active est close en 'failed'.
+    """
+    cursor = conn.cursor(dictionary=True)
+    conn.start_transaction()
+    cursor.execute("""
+        SELECT new_rental_id FROM rental_migrations
+        WHERE status='provisioning' AND retry_after <= NOW()
+        ORDER BY retry_after
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (MIGRATION_RETRY_BATCH,))
+    ids = [row['new_rental_id'] for row in cursor.fetchall()]
+    if not ids:
+        conn.rollback()
+        return []
+    placeholders = ','.join(['%s'] * len(ids))
+    cursor.execute(f"""
+        UPDATE rental_migrations SET attempts = attempts + 1, retry_after = NOW() + INTERVAL %s SECOND
+        WHERE new_rental_id IN ({placeholders})
+    """, (MIGRATION_RETRY_DELAY, *ids))
+    conn.commit()
+
+    cursor.execute(f"""
+        SELECT m.new_rental_id, m.old_rental_id, m.new_node_id, m.attempts,
+               r.active, r.ssh_password, u.username, n.ip, n.ssh_port, n.container_name
+        FROM rental_migrations m
+        LEFT JOIN rentals r ON r.id = m.new_rental_id
+        LEFT JOIN users u ON u.id = r.user_id
+        JOIN nodes n ON n.id = m.new_node_id
+        WHERE m.new_rental_id IN ({placeholders})
+    """, tuple(ids))
+    rows = cursor.fetchall()
+
+    ended = [row['new_rental_id'] for row in rows if not row['active']]
+    if ended:
+        # Location libérée, expirée ou migrée à nouveau avant d'avoir été rétablie
+        cursor.execute(f"UPDATE rental_migrations SET status='failed' "
+                       f"WHERE new_rental_id IN ({','.join(['%s'] * len(ended))})", tuple(ended))
+        conn.commit()
+    logging.info(f"[Tâche 2] Migrations en attente reprises : {len(rows) - len(ended)}")
+    return [{
+        'key': row['new_rental_id'],
+        'old_rental_id': row['old_rental_id'],
+        'new_node_id': row['new_node_id'],
+        'attempts': row['attempts'],
+        'host_ip': resolve_worker_ip(row['ip']),
+        'host_port': row['ssh_port'],
+        'client_user': row['username'],
+        'client_pass': decrypt_password(row['ssh_password']),
+        'container_name': row.get('container_name'),
+    } for row in rows if row['active']]
+
+def provision_migrations(conn, migrations):
+    """
+    Crée en parallèle les comptes des locations migrées (transaction de migration déjà
+    committée, aucun verrou conservé) et enregistre le temps de rétablissement. Un échec
+    laisse la migration 'provisioning', retentée après MIGRATION_RETRY_DELAY secondes ;
+    au-delà de MIGRATION_MAX_ATTEMPTS essais elle passe en 'failed' (sans restored_at).
+    """
+    if not migrations:
+        return
+    results = run_provision_batch('create_user.yml', migrations)
+    restored = [m['key'] for m in migrations if results.get(m['key'])]
+    failed = [m['key'] for m in migrations if not results.get(m['key'])]
+
+    cursor = conn.cursor(dictionary=True)
+    try:
+        if restored:
+            cursor.execute(
+                f"UPDATE rental_migrations SET status='restored', restored_at=NOW() "
+                f"WHERE new_rental_id IN ({','.join(['%s'] * len(restored))})",
+                tuple(restored))
+        if failed:
+            cursor.execute(
+                f"UPDATE rental_migrations "
+                f"SET status=IF(attempts >= %s, 'failed', 'provisioning'), retry_after=NOW() + INTERVAL %s SECOND "
+                f"WHERE new_rental_id IN ({','.join(['%s'] * len(failed))}) AND status='provisioning'",
+                (MIGRATION_MAX_ATTEMPTS, MIGRATION_RETRY_DELAY, *failed))
+        conn.commit()
+    except Exception as e:
+        logging.error(f"[Tâche 2] Erreur enregistrement des migrations: {e}")
+        conn.rollback()
+
+    for m in migrations:
+        if results.get(m['key']):
+            logging.info(f"Migration réussie: Rental {m['old_rental_id']} -> Nouveau Rental {m['key']} sur Node {m['new_node_id']}")
+        elif m.get('attempts', 1) >= MIGRATION_MAX_ATTEMPTS:
+            # La location reste active sans compte sur le nouveau nœud : intervention nécessaire
+            logging.error(f"Migration abandonnée: Rental {m['key']} sans compte sur le nœud {m['new_node_id']} "
+                          f"après {m.get('attempts', 1)} essai(s)")
+        else:
+            # La location reste active : l'utilisateur n'a pas encore accès au nouveau nœud
+            logging.error(f"Migration partielle: Provisioning échoué sur le nouveau nœud {m['new_node_id']}, "
+                          f"nouvel essai dans {MIGRATION_RETRY_DELAY}s")
+
+def claim_expired_leases(conn, claim):
+    """
+    Réclame jusqu'à EXPIRY_BATCH baux expirés avec un jeton propre à ce passage.
+    L'UPDATE est autocommit : aucun verrou n'est conservé pendant le déprovisioning.
+    """
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""
+        UPDATE rentals
+        SET expiry_claim=%s, expiry_claimed_until=NOW() + INTERVAL %s SECOND
+        WHERE active=TRUE AND leased_until <= NOW()
+          AND (expiry_claim IS NULL OR expiry_claimed_until < NOW())
+        ORDER BY leased_until
+        LIMIT %s
+    """, (claim, EXPIRY_CLAIM_TIMEOUT, EXPIRY_BATCH))
+    cursor.execute("""
+        SELECT n.id AS node_id, n.ip, n.ssh_port, n.container_name,
+               r.id AS rental_id, r.user_id, u.username, r.ssh_password
+        FROM rentals r
+        JOIN nodes n ON r.node_id = n.id
+        JOIN users u ON r.user_id = u.id
+        WHERE r.expiry_claim=%s
+    """, (claim,))
+    return cursor.fetchall()
 
-# --- Expiration des baux ---
 def job_expire_leases():
     logging.info("[Tâche 3] Vérification des baux expirés...")
-    conn = get_db_connection()
+    conn = get_db_connection(autocommit=True)
     if not conn:
         return
     try:
-        conn.start_transaction()
-        cursor = conn.cursor(dictionary=True)
-        # Work Queue: Select expired leases
-        sql = """
-        SELECT n.id AS node_id, n.ip, n.ssh_port, r.id AS rental_id, r.user_id, u.username, r.ssh_password
-        FROM nodes n
-        JOIN rentals r ON r.node_id = n.id
-        JOIN users u ON r.user_id = u.id
-        WHERE n.allocated=TRUE AND r.active=TRUE AND r.leased_until <= NOW()
-        FOR UPDATE SKIP LOCKED
-        """
-        cursor.execute(sql)
-        expired = cursor.fetchall()
-
+        # Work Queue : chaque bail est réclamé individuellement (jeton + délai de visibilité),
+        # plusieurs réplicas se partagent donc les expirations sans se bloquer.
+        claim = uuid.uuid4().hex
+        expired = claim_expired_leases(conn, claim)
         if not expired:
-            conn.rollback()
             return
 
-        logging.info(f"[Tâche 3] Baux expirés trouvés : {len(expired)}")
-        for row in expired:
-            client_user = row['username']
-            ip_to_use = resolve_worker_ip(row['ip'])
-            logging.info(f"[Tâche 3] Expiration de {client_user} sur noeud {row['node_id']}...")
-
+        logging.info(f"[Tâche 3] Baux expirés réclamés : {len(expired)}")
+        # Un seul lot pour toute la vague d'expiration, exécuté en parallèle
+        targets = [{
+            'key': row['rental_id'],
+            'host_ip': resolve_worker_ip(row['ip']),
+            'host_port': row['ssh_port'],
+            'client_user': row['username'],
             # Déchiffrer le password pour le cleanup
-            client_pass = decrypt_password(row.get('ssh_password'))
-
-            success = run_ansible_task('delete_user.yml', ip_to_use, row['ssh_port'], 
-                                      client_user, client_pass or "")
-            if success:
-                try:
-                    cursor.execute("UPDATE nodes SET allocated=FALSE WHERE id=%s", (row['node_id'],))
-                    cursor.execute("UPDATE rentals SET active=FALSE WHERE id=%s", (row['rental_id'],))
+            'client_pass': decrypt_password(row.get('ssh_password')) or "",
+            'container_name': row.get('container_name'),
+        } for row in expired]
+        results = run_provision_batch('delete_user.yml', targets)
+
+        cursor = conn.cursor(dictionary=True)
+        for row in expired:
+            if not results.get(row['rental_id']):
+                # La réclamation expire d'elle-même : le bail sera repris après EXPIRY_CLAIM_TIMEOUT
+                logging.error(f"[Tâche 3] Échec nettoyage Ansible de {row['username']} sur noeud {row['node_id']}")
+                continue
+            # Une transaction par bail : une erreur n'annule pas les baux déjà clos
+            try:
+                conn.start_transaction()
+                cursor.execute("UPDATE rentals SET active=FALSE, ended_at=NOW(), expiry_claim=NULL "
+                               "WHERE id=%s AND expiry_claim=%s AND active=TRUE",
+                               (row['rental_id'], claim))
+                if cursor.rowcount:
+                    cursor.execute("UPDATE nodes SET slots_used = GREATEST(slots_used - 1, 0), allocated=FALSE "
+                                   "WHERE id=%s", (row['node_id'],))
+                    cursor.execute("DELETE FROM node_accounts WHERE node_id=%s AND username=%s",
+                                   (row['node_id'], row['username']))
+                    record_change(cursor, 'rental', [row['rental_id']])
                     logging.info(f"[Tâche 3] Noeud {row['node_id']} libéré et rental {row['rental_id']} clos.")
-                except Exception as e:
-                    logging.error(f"[Tâche 3] Erreur mise à jour DB pour rental {row['rental_id']}: {e}")
-                    # In a batch, if one fails, we might want to continue others?
-                    # But we are in one transaction. If one fails, we rollback all?
-                    # Or we could just log and NOT update?
-                    # Let's rollback to be safe, or just raise.
-                    raise e
-            else:
-                logging.error(f"[Tâche 3] Échec nettoyage Ansible pour noeud {row['node_id']}")
-                # If ansible fails, we don't update DB. Lease remains expired but active.
-                # Next loop will pick it up again. Infinite loop risk if Ansible always fails?
-                # Maybe mark as 'error_state'? For now, keep as is.
-                pass
-        conn.commit()
+                else:
+                    logging.warning(f"[Tâche 3] Réclamation perdue pour rental {row['rental_id']}, ignoré.")
+                conn.commit()
+            except Exception as e:
+                logging.error(f"[Tâche 3] Erreur mise à jour DB pour rental {row['rental_id']}: {e}")
+                conn.rollback()
     except Exception as e:
         logging.error(f"[Tâche 3] Erreur expiration: {e}")
-        if conn:
-            conn.rollback()
     finally:
         if conn and conn.is_connected():
             conn.close()
@@ -453,48 +1152,59 @@ def job_cleanup_resurrected_nodes():
         cursor.execute("SELECT * FROM nodes WHERE status='alive' AND needs_cleanup=TRUE FOR UPDATE SKIP LOCKED")
         nodes = cursor.fetchall()
         
+        if not nodes:
+            conn.rollback()
+            return
+
+        # 1. Comptes encore présents sur chaque nœud d'après le registre (pas tout l'historique),
+        # hors comptes des locataires encore actifs sur le nœud (nettoyage slot par slot)
+        node_ids = [node['id'] for node in nodes]
+        cursor.execute(f"""
+            SELECT a.node_id, a.username
+            FROM node_accounts a
+            WHERE a.node_id IN ({','.join(['%s'] * len(node_ids))})
+              AND NOT EXISTS (
+                  SELECT 1 FROM rentals r JOIN users u ON r.user_id = u.id
+                  WHERE r.node_id = a.node_id AND u.username = a.username AND r.active = TRUE
+              )
+        """, tuple(node_ids))
+        accounts = {}
+        for row in cursor.fetchall():
+            accounts.setdefault(row['node_id'], []).append(row['username'])
+
+        # 2. Un seul appel distant par nœud, avec tous ses comptes
+        targets = []
         for node in nodes:
-            logging.info(f"[Tâche 4] Traitement du nœud dirty {node['id']} ({node['hostname']})...")
-            
-            # Chercher TOUS les utilisateurs distincts ayant eu une location sur ce nœud
-            # On veut nettoyer tout historique potentiel.
-            cursor.execute("""
-                SELECT DISTINCT u.username, r.ssh_password
-                FROM rentals r
-                JOIN users u ON r.user_id = u.id
-                WHERE r.node_id=%s
-            """, (node['id'],))
-            rentals = cursor.fetchall()
-            
-            node_cleanup_success = True
-            
-            if not rentals:
-                 logging.info(f"[Tâche 4] Aucun utilisateur trouvé dans l'historique pour le nœud {node['id']}. Marquage comme clean.")
-            
-            for rental in rentals:
-                client_user = rental['username']
-                ip_to_use = resolve_worker_ip(node['ip'])
-                
-                # Déchiffrer le password (s'il y en a plusieurs, on prend celui du tuple courant)
-                # Note: Si un user a eu plusieurs passwords, le playbook forcera la suppression de toute façon par username.
-                client_pass = decrypt_password(rental.get('ssh_password'))
-                
-                # Supprimer l'utilisateur du nœud ressuscité
-                success = run_ansible_task('delete_user.yml', ip_to_use, node['ssh_port'], 
-                                          client_user, client_pass or "")
-                if success:
-                    logging.info(f"[Tâche 4] Utilisateur {client_user} supprimé du nœud {node['id']}")
-                else:
-                    logging.error(f"[Tâche 4] Échec suppression utilisateur {client_user} sur le nœud {node['id']}")
-                    node_cleanup_success = False
-            
-            # Si tout s'est bien passé (ou s'il n'y avait rien à faire), on marque le nœud comme propre
-            if node_cleanup_success:
-                cursor.execute("UPDATE nodes SET needs_cleanup=FALSE WHERE id=%s", (node['id'],))
-                logging.info(f"[Tâche 4] Nœud {node['id']} nettoyé et marqué comme CLEAN (disponible).")
-            else:
-                logging.warning(f"[Tâche 4] Nœud {node['id']} toujours DIRTY suite à des erreurs.")
+            users = accounts.get(node['id'], [])
+            logging.info(f"[Tâche 4] Traitement du nœud dirty {node['id']} ({node['hostname']}) : {len(users)} compte(s).")
+            if users:
+                targets.append({
+                    'key': node['id'],
+                    'host_ip': resolve_worker_ip(node['ip']),
+                    'host_port': node['ssh_port'],
+                    'client_user': users,
+                    'client_pass': "",
+                    'container_name': node.get('container_name'),
+                })
+        results = run_provision_batch('delete_user.yml', targets)
 
+        # 3. Reporter les résultats par nœud
+        cleaned = []
+        for node in nodes:
+            users = accounts.get(node['id'], [])
+            if users and not results.get(node['id']):
+                logging.warning(f"[Tâche 4] Échec suppression de {users} : nœud {node['id']} toujours DIRTY.")
+                continue
+            if users:
+                cursor.execute(
+                    f"DELETE FROM node_accounts WHERE node_id=%s AND username IN ({','.join(['%s'] * len(users))})",
+                    (node['id'], *users))
+            cursor.execute("UPDATE nodes SET needs_cleanup=FALSE WHERE id=%s", (node['id'],))
+            cleaned.append(node['id'])
+            logging.info(f"[Tâche 4] Nœud {node['id']} nettoyé et marqué comme CLEAN (disponible).")
+
+        # needs_cleanup est filtrable (/nodes?needs_cleanup=) : flux, SSE et ETag suivent
+        record_change(cursor, 'node', cleaned)
         conn.commit()
         logging.info("[Tâche 4] Nettoyage terminé.")
     except Exception as e:
@@ -506,16 +1216,435 @@ def job_cleanup_resurrected_nodes():
             conn.close()
 
 
-# --- Main loop ---
+def archive_rental_chunk(conn):
+    """
+    Déplace un lot de locations closes vers rentals_archive dans une transaction courte.
+    SKIP LOCKED : deux réplicas ne se disputent pas les mêmes lignes. Retourne le nombre
+    de locations archivées.
+    """
+    cursor = conn.cursor(dictionary=True)
+    try:
+        conn.start_transaction()
+        cursor.execute("""
+            SELECT id FROM rentals
+            WHERE active=FALSE AND ended_at < NOW() - INTERVAL %s SECOND
+            ORDER BY ended_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (RENTAL_ARCHIVE_AFTER, RENTAL_ARCHIVE_CHUNK))
+        ids = [row['id'] for row in cursor.fetchall()]
+        if not ids:
+            conn.rollback()
+            return 0
+        placeholders = ','.join(['%s'] * len(ids))
+        cursor.execute(f"""
+            INSERT IGNORE INTO rentals_archive
+                (id, user_id, ssh_password, node_id, leased_from, leased_until, ended_at)
+            SELECT id, user_id, ssh_password, node_id, leased_from, leased_until, ended_at
+            FROM rentals WHERE id IN ({placeholders})
+        """, tuple(ids))
+        cursor.execute(f"DELETE FROM rentals WHERE id IN ({placeholders}) AND active=FALSE", tuple(ids))
+        conn.commit()
+        return len(ids)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def job_archive_rentals():
+    logging.info("[Tâche 5] Archivage des locations closes...")
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        archived = 0
+        for _ in range(RENTAL_ARCHIVE_MAX_CHUNKS):
+            moved = archive_rental_chunk(conn)
+            archived += moved
+            if moved < RENTAL_ARCHIVE_CHUNK:
+                break
+        if archived:
+            logging.info(f"[Tâche 5] {archived} location(s) archivée(s).")
+    except Exception as e:
+        logging.error(f"[Tâche 5] Erreur archivage: {e}")
+    finally:
+        if conn and conn.is_connected():
+            conn.close()
+
+def purge_change_log_chunk(conn):
+    """
+    Supprime le plus ancien lot de change_log plus vieux que CHANGE_LOG_RETENTION, en
+    préfixe strict de versions (les lecteurs comparent leur `since` à MIN(version)).
+    La ligne la plus récente est toujours conservée : la version courante survit à un
+    journal au repos. Retourne le nombre de lignes supprimées.
+    """
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT version, created_at < NOW() - INTERVAL %s SECOND AS expired
+            FROM change_log
+            ORDER BY version
+            LIMIT %s
+        """, (CHANGE_LOG_RETENTION, CHANGE_LOG_PURGE_CHUNK + 1))
+        rows = cursor.fetchall()
+        upto = None
+        for row in rows[:-1]:
+            if not row['expired']:
+                break
+            upto = row['version']
+        if upto is None:
+            return 0
+        cursor.execute("DELETE FROM change_log WHERE version <= %s", (upto,))
+        conn.commit()
+        return cursor.rowcount
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def job_purge_change_log():
+    logging.info("[Tâche 6] Purge du journal des changements...")
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        purged = 0
+        for _ in range(CHANGE_LOG_PURGE_MAX_CHUNKS):
+            deleted = purge_change_log_chunk(conn)
+            purged += deleted
+            if deleted < CHANGE_LOG_PURGE_CHUNK:
+                break
+        if purged:
+            logging.info(f"[Tâche 6] {purged} ligne(s) de change_log purgée(s).")
+    except Exception as e:
+        logging.error(f"[Tâche 6] Erreur purge change_log: {e}")
+    finally:
+        if conn and conn.is_connected():
+            conn.close()
+
+def fail_stale_provisioning_jobs(conn):
+    """
+    Passe en échec un lot de jobs de provisioning figés et annule leurs locations, comme
+    l'API après un provisioning en échec : rentals clos, slots rendus, nœuds marqués dirty
+    (le registre des comptes est conservé, la Tâche 4 supprime les comptes déjà créés).
+    SKIP LOCKED : deux réplicas ne balaient pas les mêmes jobs. Retourne le nombre de jobs.
+    """
+    cursor = conn.cursor(dictionary=True)
+    try:
+        conn.start_transaction()
+        # Un nœud du job mis à jour récemment (provisioning en cours) garde le job vivant
+        cursor.execute("""
+            SELECT j.id FROM provisioning_jobs j
+            WHERE j.status IN ('pending', 'running')
+              AND j.updated_at < NOW() - INTERVAL %s SECOND
+              AND NOT EXISTS (
+                  SELECT 1 FROM provisioning_job_items i
+                  WHERE i.job_id = j.id AND i.updated_at >= NOW() - INTERVAL %s SECOND
+              )
+            ORDER BY j.updated_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (PROVISIONING_JOB_TIMEOUT, PROVISIONING_JOB_TIMEOUT, PROVISIONING_SWEEP_BATCH))
+        job_ids = [row['id'] for row in cursor.fetchall()]
+        if not job_ids:
+            conn.rollback()
+            return 0
+        jobs = ','.join(['%s'] * len(job_ids))
+
+        cursor.execute(f"""
+            SELECT r.id AS rental_id, r.node_id FROM provisioning_job_items i
+            JOIN rentals r ON r.id = i.rental_id
+            WHERE i.job_id IN ({jobs}) AND r.active = TRUE
+            FOR UPDATE
+        """, tuple(job_ids))
+        rentals = cursor.fetchall()
+        rental_ids = [row['rental_id'] for row in rentals]
+        # Plusieurs jobs balayés peuvent occuper des slots d'un même nœud
+        slots = {}
+        for row in rentals:
+            slots[row['node_id']] = slots.get(row['node_id'], 0) + 1
+        if rental_ids:
+            cursor.execute(
+                f"UPDATE rentals SET active=FALSE, ended_at=NOW() WHERE id IN ({','.join(['%s'] * len(rental_ids))})",
+                tuple(rental_ids))
+            cursor.executemany(
+                "UPDATE nodes SET slots_used = GREATEST(slots_used - %s, 0), allocated=FALSE, needs_cleanup=TRUE "
+                "WHERE id=%s",
+                [(count, node_id) for node_id, count in slots.items()])
+
+        error = "Job interrompu (process API arrêté) : locations annulées"
+        cursor.execute(f"""
+            UPDATE provisioning_job_items SET status='cancelled'
+            WHERE job_id IN ({jobs}) AND status = 'ready'
+        """, tuple(job_ids))
+        cursor.execute(f"""
+            UPDATE provisioning_job_items SET status='failed', error=%s
+            WHERE job_id IN ({jobs}) AND status IN ('pending', 'provisioning')
+        """, (error, *job_ids))
+        cursor.execute(f"UPDATE provisioning_jobs SET status='failed', error=%s WHERE id IN ({jobs})",
+                       (error, *job_ids))
+        record_change(cursor, 'rental', rental_ids)
+        record_change(cursor, 'node', list(slots))
+        conn.commit()
+        return len(job_ids)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def job_sweep_provisioning_jobs():
+    logging.info("[Tâche 7] Recherche des jobs de provisioning figés...")
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        failed = fail_stale_provisioning_jobs(conn)
+        if failed:
+            logging.warning(f"[Tâche 7] {failed} job(s) de provisioning figé(s) passé(s) en échec, "
+                            f"locations annulées.")
+    except Exception as e:
+        logging.error(f"[Tâche 7] Erreur balayage des jobs de provisioning: {e}")
+    finally:
+        if conn and conn.is_connected():
+            conn.close()
+
+
+# --- Lease timer ---
+def utc_now():
+    """Heure UTC naïve, comme les TIMESTAMP lus en base (écrits en UTC par l'API)."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class LeaseTimer:
+    """
+    Échéancier en mémoire des fins de bail des locations actives (tas trié par
+    leased_until). Après un chargement initial, seules les locations journalisées dans
+    change_log depuis la dernière version lue sont relues. Le thread se réveille à
+    l'échéance du prochain bail et déclenche `on_due` (la file d'expiration).
+    """
+
+    def __init__(self, on_due):
+        self.on_due = on_due
+        self.version = 0
+        self._heap = []     # (échéance, rental_id, leased_until)
+        self._leases = {}   # rental_id -> leased_until ; une entrée du tas n'est valide que si elle y correspond
+        self._stop = threading.Event()
+
+    def _push(self, when, rental_id, leased_until):
+        heapq.heappush(self._heap, (when, rental_id, leased_until))
+
+    def _apply(self, rental_id, leased_until, active):
+        if not active or leased_until is None:
+            self._leases.pop(rental_id, None)
+        elif self._leases.get(rental_id) != leased_until:
+            self._leases[rental_id] = leased_until
+            self._push(leased_until, rental_id, leased_until)
+
+    def load(self, cursor):
+        """
+        Chargement initial : version stable du journal puis baux actifs. Partir de MAX(version)
+        sauterait une location committée en retard sous une version inférieure ; les lignes
+        plus récentes que la version stable sont relues par refresh (sans effet si déjà à jour).
+        """
+        self.version = settled_change_version(cursor)
+        cursor.execute("SELECT id, leased_until FROM rentals WHERE active=TRUE")
+        self._heap, self._leases = [], {}
+        for row in cursor.fetchall():
+            self._apply(row['id'], row['leased_until'], True)
+
+    def refresh(self, cursor):
+        """Applique les changements de locations journalisés depuis la dernière version lue."""
+        cursor.execute("""
+            SELECT version, entity_id, created_at < NOW() - INTERVAL %s SECOND AS settled
+            FROM change_log
+            WHERE version > %s AND entity='rental'
+            ORDER BY version
+            LIMIT %s
+        """, (CHANGE_LOG_SETTLE, self.version, LEASE_TIMER_BATCH))
+        changes = cursor.fetchall()
+        if not changes:
+            return 0
+        # La version n'avance que sur les lignes stables : les plus récentes sont relues
+        # au prochain passage, au cas où une version inférieure serait committée entre-temps.
+        for change in changes:
+            if not change['settled']:
+                break
+            self.version = change['version']
+
+        ids = list({c['entity_id'] for c in changes})
+        cursor.execute(
+            f"SELECT id, leased_until, active FROM rentals WHERE id IN ({','.join(['%s'] * len(ids))})",
+            tuple(ids))
+        found = set()
+        for row in cursor.fetchall():
+            found.add(row['id'])
+            self._apply(row['id'], row['leased_until'], row['active'])
+        for rental_id in set(ids) - found:
+            self._leases.pop(rental_id, None)
+        return len(changes)
+
+    def _discard_stale(self):
+        while self._heap and self._leases.get(self._heap[0][1]) != self._heap[0][2]:
+            heapq.heappop(self._heap)
+
+    def pop_due(self, now):
+        """
+        Retire les baux échus. Ils sont replanifiés LEASE_TIMER_RETRY secondes plus tard :
+        un bail clos disparaît via change_log, un bail dont le nettoyage échoue est retenté.
+        """
+        due = []
+        self._discard_stale()
+        while self._heap and self._heap[0][0] <= now:
+            _, rental_id, leased_until = heapq.heappop(self._heap)
+            due.append((rental_id, leased_until))
+            self._discard_stale()
+        for rental_id, leased_until in due:
+            self._push(now + timedelta(seconds=LEASE_TIMER_RETRY), rental_id, leased_until)
+        return [rental_id for rental_id, _ in due]
+
+    def seconds_until_next(self, now):
+        self._discard_stale()
+        if not self._heap:
+            return None
+        return (self._heap[0][0] - now).total_seconds()
+
+    def run(self):
+        conn = cursor = None
+        while not self._stop.is_set():
+            delay = None
+            try:
+                if conn is None or not conn.is_connected():
+                    # Autocommit : chaque lecture voit les dernières transactions committées
+                    conn = get_db_connection(autocommit=True)
+                    if conn:
+                        cursor = conn.cursor(dictionary=True)
+                        self.load(cursor)
+                        logging.info(f"[Échéancier] {len(self._leases)} baux actifs chargés (version {self.version}).")
+                if conn:
+                    self.refresh(cursor)
+                    now = utc_now()
+                    due = self.pop_due(now)
+                    if due:
+                        logging.info(f"[Échéancier] Baux échus : {due}")
+                        self.on_due()
+                    delay = self.seconds_until_next(now)
+            except Exception as e:
+                logging.error(f"[Échéancier] Erreur: {e}")
+                if conn:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                conn = cursor = None
+            # Réveil à l'échéance du prochain bail, et au moins toutes les LEASE_TIMER_POLL
+            # secondes pour relire le journal
+            self._stop.wait(LEASE_TIMER_POLL if delay is None else min(max(delay, 0), LEASE_TIMER_POLL))
+
+    def stop(self):
+        self._stop.set()
+
+# --- Job lanes ---
+class JobLane:
+    """
+    File d'exécution d'un type de tâche, avec ses propres threads : une expiration
+    lente ne retarde plus le health check ni la migration. Au plus `concurrency`
+    exécutions se chevauchent ; un tick qui arrive au-delà est ignoré (et compté)
+    au lieu d'être mis en attente.
+    """
+
+    def __init__(self, name, func, interval, concurrency=1):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.concurrency = max(1, concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                           thread_name_prefix=f"lane-{name}")
+        self._lock = threading.Lock()
+        self._running = 0
+        self._last_start = None
+        self.stats = {"runs": 0, "errors": 0, "skipped": 0,
+                      "last_run_ms": 0.0, "max_run_ms": 0.0, "total_run_ms": 0.0,
+                      "last_lag_ms": 0.0, "max_lag_ms": 0.0}
+
+    def submit(self):
+        """Tick du ticker : lance une exécution, sauf si la file est déjà pleine."""
+        with self._lock:
+            if self._running >= self.concurrency:
+                self.stats["skipped"] += 1
+                return False
+            self._running += 1
+        self.executor.submit(self._run)
+        return True
+
+    def _run(self):
+        started = time.monotonic()
+        failed = False
+        try:
+            self.func()
+        except Exception as e:
+            failed = True
+            logging.error(f"[{self.name}] Erreur non gérée: {e}")
+        finally:
+            run_ms = (time.monotonic() - started) * 1000
+            with self._lock:
+                self._running -= 1
+                # Retard : écart entre le démarrage réel et la cadence prévue
+                lag_ms = 0.0
+                if self._last_start is not None:
+                    lag_ms = max(0.0, (started - self._last_start - self.interval) * 1000)
+                self._last_start = started
+                stats = self.stats
+                stats["runs"] += 1
+                if failed:
+                    stats["errors"] += 1
+                stats["last_run_ms"] = run_ms
+                stats["max_run_ms"] = max(stats["max_run_ms"], run_ms)
+                stats["total_run_ms"] += run_ms
+                stats["last_lag_ms"] = lag_ms
+                stats["max_lag_ms"] = max(stats["max_lag_ms"], lag_ms)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["running"] = self._running
+        stats["avg_run_ms"] = stats["total_run_ms"] / stats["runs"] if stats["runs"] else 0.0
+        return stats
+
+def build_job_lanes():
+    return [
+        JobLane("health_check", job_health_check, 2, HEALTH_LANE_CONCURRENCY),
+        JobLane("migrate_dead_nodes", job_migrate_dead_nodes, 2, MIGRATION_LANE_CONCURRENCY),
+        # Scan complet lent (filet de sécurité) : les expirations sont déclenchées par LeaseTimer
+        JobLane("expire_leases", job_expire_leases, EXPIRY_RECONCILE_INTERVAL, EXPIRY_LANE_CONCURRENCY),
+        JobLane("cleanup_resurrected", job_cleanup_resurrected_nodes, 2, CLEANUP_LANE_CONCURRENCY),
+        JobLane("archive_rentals", job_archive_rentals, RENTAL_ARCHIVE_INTERVAL, ARCHIVE_LANE_CONCURRENCY),
+        JobLane("purge_change_log", job_purge_change_log, CHANGE_LOG_PURGE_INTERVAL, PURGE_LANE_CONCURRENCY),
+        JobLane("sweep_provisioning_jobs", job_sweep_provisioning_jobs, PROVISIONING_SWEEP_INTERVAL,
+                SWEEP_LANE_CONCURRENCY),
+    ]
+
+def log_lane_stats(lanes):
+    for lane in lanes:
+        stats = lane.snapshot()
+        logging.info(f"[Stats {lane.name}] {stats['runs']} exécutions ({stats['errors']} erreurs), "
+                     f"durée moy. {stats['avg_run_ms']:.0f} ms / max {stats['max_run_ms']:.0f} ms, "
+                     f"retard max {stats['max_lag_ms']:.0f} ms, ticks ignorés {stats['skipped']}, "
+                     f"en cours {stats['running']}")
 
 # --- Main loop ---
 def main():
     logging.info("--- Démarrage du Scheduler Orion-Dynamic (Work Queue Mode) ---")
-    schedule.every(2).seconds.do(job_health_check)
-    schedule.every(2).seconds.do(job_migrate_dead_nodes)
-    schedule.every(10).seconds.do(job_expire_leases)
-    schedule.every(2).seconds.do(job_cleanup_resurrected_nodes)
-    job_health_check()  # première exécution
+    # `schedule` ne sert plus que de ticker : chaque tâche s'exécute dans sa propre file
+    lanes = build_job_lanes()
+    for lane in lanes:
+        schedule.every(lane.interval).seconds.do(lane.submit)
+    schedule.every(JOB_STATS_INTERVAL).seconds.do(log_lane_stats, lanes)
+    lanes[0].submit()  # première exécution du health check
+    expiry_lane = next(lane for lane in lanes if lane.name == "expire_leases")
+    lease_timer = LeaseTimer(on_due=expiry_lane.submit)
+    threading.Thread(target=lease_timer.run, name="lease-timer", daemon=True).start()
     while True:
         try:
             schedule.run_pending()
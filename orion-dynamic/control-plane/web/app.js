@@ -78,16 +78,52 @@ function startDashboard(username) {
     document.getElementById("user-name").innerText = username;
 
     loadNodes();
+    startEvents();
 }
 
-// Stocker les données actuelles pour comparaison
-let currentNodes = null;
+// Flux temps réel : /api/events pousse les deltas de nœuds dès leur écriture. À l'ouverture
+// (et à chaque reconnexion) un appel à /api/nodes?since= rattrape ce qui a été manqué.
+// EventSource n'envoie pas d'en-tête : l'URL porte un jeton de flux de courte durée
+// (POST /api/events/token), jamais le JWT de session.
+let eventSource = null;
+
+async function startEvents() {
+    if (eventSource || !window.EventSource || !getToken()) return;
+    eventSource = "opening";
+    const res = await api("/api/events/token", "POST");
+    if (res.error) {
+        eventSource = null;
+        setTimeout(startEvents, 30000);
+        return;
+    }
+    const source = new EventSource(`/api/events?token=${encodeURIComponent(res.token)}`);
+    eventSource = source;
+    eventSource.addEventListener("open", () => loadNodes());
+    // Reconnexion refusée (jeton de flux expiré) : nouveau jeton, nouveau flux
+    eventSource.addEventListener("error", () => {
+        if (source.readyState !== EventSource.CLOSED) return;
+        eventSource = null;
+        setTimeout(startEvents, 3000);
+    });
+    eventSource.addEventListener("nodes", event => applyNodesDelta(JSON.parse(event.data)));
+    // Flux en retard côté serveur : recharger un instantané
+    eventSource.addEventListener("resync", () => {
+        nodesVersion = 0;
+        loadNodes();
+    });
+}
+
+// Réponses GET gardées avec leur ETag (path -> {etag, body}) : renvoyées avec If-None-Match,
+// un 304 réutilise le corps en cache (marqué notModified) sans transfert
+const responseCache = new Map();
 
 async function api(path, method = "GET", body = null) {
     const headers = { "Content-Type": "application/json" };
     const token = getToken();
 
     if (token) headers["Authorization"] = "Bearer " + token;
+    const cached = method === "GET" ? responseCache.get(path) : null;
+    if (cached) headers["If-None-Match"] = cached.etag;
 
     console.log("Appel API:", {
         url: API + path,
@@ -104,6 +140,10 @@ async function api(path, method = "GET", body = null) {
             body: body ? JSON.stringify(body) : null
         });
 
+        if (res.status === 304 && cached) {
+            return { ...cached.body, notModified: true };
+        }
+
         if (!res.ok) {
             if (res.status === 401) {
                 console.warn("Session expirée ou non autorisée (401). Déconnexion...");
@@ -114,7 +154,12 @@ async function api(path, method = "GET", body = null) {
             throw new Error(`Erreur réseau: ${res.status} ${res.statusText}`);
         }
 
-        return await res.json();
+        const data = await res.json();
+        const etag = res.headers.get("ETag");
+        if (method === "GET" && etag) {
+            responseCache.set(path, { etag, body: data });
+        }
+        return data;
     } catch (error) {
         console.error("Erreur lors de l'appel API:", error);
         return { error: "Une erreur réseau est survenue. Veuillez réessayer plus tard." };
@@ -123,79 +168,116 @@ async function api(path, method = "GET", body = null) {
     }
 }
 
+// Nœuds connus du dashboard (node_id -> nœud) et version du flux de changements reçue.
+// Après un premier instantané complet, /api/nodes?since= ne renvoie que les nœuds modifiés.
+let nodesById = new Map();
+let nodesVersion = 0;
+
 async function loadNodes() {
     const token = getToken();
     if (!token) return;
 
-    const res = await api("/api/nodes");
+    const res = await api(`/api/nodes?since=${nodesVersion}`);
     const container = document.getElementById("nodes");
 
     if (res.error) {
         container.innerHTML = "<p style='color:red'>" + res.error + "</p>";
         return;
     }
-
-    // Vérifier si res est un tableau
-    if (!Array.isArray(res) || res.length === 0) {
-        container.innerHTML = "<p>Aucun nœud disponible.</p>";
-        return;
+    // Rien de changé depuis le dernier appel (304)
+    if (res.notModified) return;
+
+    // Instantané paginé : lire les pages suivantes (since=0&after=) avant de l'appliquer,
+    // avec la version de la première page (les changements concurrents suivront en delta)
+    // (un 304 sur une page suivante réutilise son corps en cache)
+    let nodes = res.nodes;
+    let next = res.full ? res.next_after : null;
+    while (next != null) {
+        const page = await api(`/api/nodes?since=0&after=${next}`);
+        if (page.error) {
+            container.innerHTML = "<p style='color:red'>" + page.error + "</p>";
+            return;
+        }
+        nodes = nodes.concat(page.nodes);
+        next = page.next_after;
     }
 
-    // Comparer les nouvelles données avec les données actuelles
-    if (JSON.stringify(res) !== JSON.stringify(currentNodes)) {
-        currentNodes = res; // Mettre à jour les données actuelles
+    applyNodesDelta({ ...res, nodes });
+}
+
+// Applique un instantané (res.full) ou un delta, reçu de /api/nodes?since= ou du flux /api/events
+function applyNodesDelta(res) {
+    const container = document.getElementById("nodes");
+
+    if (res.full) {
+        nodesById = new Map();
         container.innerHTML = ""; // Réinitialiser le conteneur
+    }
+    res.nodes.forEach(node => nodesById.set(node.node_id, node));
+    (res.removed || []).forEach(id => {
+        nodesById.delete(id);
+        const nodeDiv = container.querySelector(`.node[data-id='${id}']`);
+        if (nodeDiv) nodeDiv.remove();
+    });
+    nodesVersion = Math.max(nodesVersion, res.version);
 
-        const now = new Date();
-        console.log("Heure actuelle (locale) :", now.toString());
+    const empty = container.querySelector(".nodes-empty");
+    if (empty) empty.remove();
+    if (nodesById.size === 0) {
+        container.innerHTML = "<p class='nodes-empty'>Aucun nœud disponible.</p>";
+        return;
+    }
 
-        res.forEach(node => {
-            let nodeDiv = document.querySelector(`.node[data-id='${node.node_id}']`);
+    // Seuls les nœuds reçus sont redessinés
+    res.nodes.forEach(node => renderNode(container, node));
+}
 
-            if (!nodeDiv) {
-                nodeDiv = document.createElement("div");
-                nodeDiv.className = "node";
-                nodeDiv.setAttribute("data-id", node.node_id);
-                container.appendChild(nodeDiv);
-            }
+function renderNode(container, node) {
+    let nodeDiv = container.querySelector(`.node[data-id='${node.node_id}']`);
 
-            let localLeaseEnd = "";
-            let leaseInfo = "";
-
-            if (node.lease) {
-                const leaseEnd = new Date(node.lease.leased_until + 'Z');
-                localLeaseEnd = leaseEnd.toLocaleString('fr-FR', {
-                    timeZone: Intl.DateTimeFormat().resolvedOptions().timeZone,
-                    year: 'numeric',
-                    month: '2-digit',
-                    day: '2-digit',
-                    hour: '2-digit',
-                    minute: '2-digit',
-                    second: '2-digit'
-                });
-
-                leaseInfo = `
-                    <p><b>Lease ${node.lease.rental_id}</b><br>
-                    ${node.lease.renter_username ? `<b>Loué par:</b> ${node.lease.renter_username}<br>` : ''}
-                    Jusqu'à (heure locale) : ${localLeaseEnd}</p>
-                    <p><b>Mot de passe SSH :</b> <button onclick="fetchPassword(${node.lease.rental_id}, this)">Afficher</button></p>
-                    <button onclick="release(${node.lease.rental_id})">Release</button>
-                    <button onclick="showExtendForm(${node.lease.rental_id})">Extend (Custom)</button>
-                `;
-            } else {
-                leaseInfo = `<i>Libre</i>`;
-            }
+    if (!nodeDiv) {
+        nodeDiv = document.createElement("div");
+        nodeDiv.className = "node";
+        nodeDiv.setAttribute("data-id", node.node_id);
+        container.appendChild(nodeDiv);
+    }
 
-            nodeDiv.innerHTML = `
-                <b>Node ${node.node_id}</b><br>
-                Hostname: ${node.hostname}<br>
-                Port SSH: ${node.ssh_port}<br>
-                Status: ${node.status}<br>
-                Allocated: ${node.allocated}<br>
-                ${leaseInfo}
-            `;
+    let localLeaseEnd = "";
+    let leaseInfo = "";
+
+    if (node.lease) {
+        const leaseEnd = new Date(node.lease.leased_until + 'Z');
+        localLeaseEnd = leaseEnd.toLocaleString('fr-FR', {
+            timeZone: Intl.DateTimeFormat().resolvedOptions().timeZone,
+            year: 'numeric',
+            month: '2-digit',
+            day: '2-digit',
+            hour: '2-digit',
+            minute: '2-digit',
+            second: '2-digit'
         });
+
+        leaseInfo = `
+            <p><b>Lease ${node.lease.rental_id}</b><br>
+            ${node.lease.renter_username ? `<b>Loué par:</b> ${node.lease.renter_username}<br>` : ''}
+            Jusqu'à (heure locale) : ${localLeaseEnd}</p>
+            <p><b>Mot de passe SSH :</b> <button onclick="fetchPassword(${node.lease.rental_id}, this)">Afficher</button></p>
+            <button onclick="release(${node.lease.rental_id})">Release</button>
+            <button onclick="showExtendForm(${node.lease.rental_id})">Extend (Custom)</button>
+        `;
+    } else {
+        leaseInfo = `<i>Libre</i>`;
     }
+
+    nodeDiv.innerHTML = `
+        <b>Node ${node.node_id}</b><br>
+        Hostname: ${node.hostname}<br>
+        Port SSH: ${node.ssh_port}<br>
+        Status: ${node.status}<br>
+        Allocated: ${node.allocated}<br>
+        ${node.slots > 1 ? `Slots: ${node.slots_used}/${node.slots}<br>` : ''}
+        ${leaseInfo}
+    `;
 }
 
 async function fetchPassword(rentalId, button) {
@@ -283,6 +365,15 @@ async function rent() {
         count: count
     };
 
+    // Minima de ressources par nœud (le serveur choisit le plus petit nœud qui convient)
+    const minimums = {min_cpu: "rent-min-cpu", min_memory_mb: "rent-min-memory", min_disk_gb: "rent-min-disk"};
+    for (const [key, id] of Object.entries(minimums)) {
+        const value = parseInt(document.getElementById(id).value);
+        if (value > 0) {
+            body[key] = value;
+        }
+    }
+
     // Ajouter le password personnalisé si fourni
     if (customPassword && customPassword.trim() !== "") {
         body.ssh_password = customPassword.trim();
@@ -412,8 +503,12 @@ function resetInactivityTimeout() {
 // Initialiser le timer d'inactivité au chargement de la page
 resetInactivityTimeout();
 
-// Ajout d'un rafraîchissement automatique des nœuds
-setInterval(loadNodes, 30000); // Rafraîchit toutes les 30 secondes
+// Rafraîchissement de secours toutes les 30 secondes, seulement sans flux /api/events ouvert
+// (navigateur sans EventSource, jeton expiré : l'appel renvoie alors 401 et déconnecte)
+setInterval(() => {
+    if (!window.EventSource || !(eventSource instanceof EventSource)
+        || eventSource.readyState === EventSource.CLOSED) loadNodes();
+}, 30000);
 
 // Appeler la fonction de rafraîchissement périodiquement
 // setInterval(refreshData, 30000); // Désactivé car doublon avec loadNodes
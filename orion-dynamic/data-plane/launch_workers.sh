@@ -37,6 +37,7 @@ do
     -p $HOST_PORT:22 \
     --add-host=host.docker.internal:host-gateway \
     -e MY_HOST_PORT=$HOST_PORT \
+    -e MY_CONTAINER_NAME=$WORKER_NAME \
     -e API_ENDPOINT=$API_URL \
     $IMAGE_NAME
 done
@@ -4,6 +4,7 @@ import requests
 import time
 import sys
 import logging
+import shutil
 import socket
 
 # Configuration du logging
@@ -13,6 +14,15 @@ logging.basicConfig(level=logging.INFO, format='[AGENT] %(asctime)s: %(message)s
 HOST_PORT = os.getenv('MY_HOST_PORT')
 API_ENDPOINT = os.getenv('API_ENDPOINT', 'https://host.docker.internal')
 HOSTNAME = os.getenv('MY_HOSTNAME', os.uname()[1])
+HEARTBEAT_INTERVAL = int(os.getenv('HEARTBEAT_INTERVAL', '5'))  # secondes
+# Nom du conteneur Docker (workers locaux) : permet le provisioning par Docker exec
+CONTAINER_NAME = os.getenv('MY_CONTAINER_NAME')
+# Capacité annoncée (par défaut mesurée ; à forcer pour un conteneur limité par --cpus/--memory)
+CPU_CORES = os.getenv('MY_CPU_CORES')
+MEMORY_MB = os.getenv('MY_MEMORY_MB')
+DISK_GB = os.getenv('MY_DISK_GB')
+# Nombre de locataires simultanés ; sinon déduit de la capacité par le Control Plane
+SLOTS = os.getenv('MY_SLOTS')
 
 def get_host_ip():
     """Récupère l'IP locale de la machine."""
@@ -27,19 +37,50 @@ def get_host_ip():
         s.close()
     return ip
 
+def get_memory_mb():
+    """Mémoire totale (MemTotal de /proc/meminfo), en Mo."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) // 1024
+    except Exception:
+        pass
+    return 0
+
+def get_capacity():
+    """Ressources du worker, envoyées à l'enregistrement et dans les heartbeats."""
+    try:
+        disk_gb = shutil.disk_usage('/').total // (1024 ** 3)
+    except Exception:
+        disk_gb = 0
+    return {
+        "cpu_cores": int(CPU_CORES or os.cpu_count() or 0),
+        "memory_mb": int(MEMORY_MB or get_memory_mb()),
+        "disk_gb": int(DISK_GB or disk_gb),
+    }
+
+def get_worker_identity():
+    """Identifiant du worker côté Control Plane (clé unique hostname/ip/port)."""
+    identity = {
+        "hostname": HOSTNAME,
+        "ip": get_host_ip(),
+        "ssh_port": int(HOST_PORT)
+    }
+    if CONTAINER_NAME:
+        identity["container_name"] = CONTAINER_NAME
+    identity.update(get_capacity())
+    if SLOTS:
+        identity["slots"] = int(SLOTS)
+    return identity
+
 def register_worker():
     if not HOST_PORT:
         logging.error("Erreur: MY_HOST_PORT n'est pas défini. Abandon.")
         sys.exit(1)
 
-    ip_address = get_host_ip()
     url = f"{API_ENDPOINT}/api/workers/register"
-    payload = {
-        "hostname": HOSTNAME,
-        "ip": ip_address,
-        "ssh_port": int(HOST_PORT)
-        
-    }
+    payload = get_worker_identity()
 
     logging.info(f"Tentative d'enregistrement auprès de {url} avec {payload}...")
 
@@ -69,7 +110,36 @@ def register_worker():
     logging.error("Échec de l'enregistrement après plusieurs tentatives.")
     return False
 
+def send_heartbeats():
+    """
+    Boucle infinie : signale périodiquement au Control Plane que le worker est vivant.
+    Le scheduler se fie à ces heartbeats et ne sonde en SSH que les workers silencieux.
+    """
+    url = f"{API_ENDPOINT}/api/workers/heartbeat"
+    payload = get_worker_identity()
+    session = requests.Session()
+    failures = 0
+
+    logging.info(f"Envoi des heartbeats vers {url} toutes les {HEARTBEAT_INTERVAL}s")
+    while True:
+        try:
+            response = session.post(url, json=payload, timeout=5, verify=False)
+            if response.status_code == 404:
+                # Base réinitialisée ou noeud supprimé : on se réenregistre
+                logging.warning("Noeud inconnu du Control Plane, nouvel enregistrement...")
+                register_worker()
+            elif response.status_code != 200:
+                logging.warning(f"Heartbeat refusé (Code: {response.status_code})")
+            failures = 0
+        except Exception as e:
+            failures += 1
+            # Éviter de noyer les logs si le Control Plane est indisponible longtemps
+            if failures == 1 or failures % 60 == 0:
+                logging.warning(f"Heartbeat impossible ({failures} échec(s) consécutif(s)): {e}")
+        time.sleep(HEARTBEAT_INTERVAL)
+
 if __name__ == "__main__":
     # Attendre un peu que le réseau docker soit prêt
     time.sleep(5) 
     register_worker()
+    send_heartbeats()
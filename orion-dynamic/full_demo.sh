@@ -37,6 +37,24 @@ function check_ret() {
     fi
 }
 
+# GET conditionnel : ETag et corps de chaque (URL, jeton) gardés dans $HTTP_CACHE ; sur 304
+# (données inchangées) le corps en cache est réutilisé sans transfert
+HTTP_CACHE=$(mktemp -d)
+trap 'rm -rf "$HTTP_CACHE"' EXIT
+
+function cached_get() {
+    local url="$1" token="$2" key etag="" status
+    key=$(printf '%s %s' "$url" "$token" | cksum | cut -d' ' -f1)
+    [ -f "$HTTP_CACHE/$key.etag" ] && etag=$(cat "$HTTP_CACHE/$key.etag")
+    status=$(curl -s -k -o "$HTTP_CACHE/$key.new" -D "$HTTP_CACHE/$key.headers" -w '%{http_code}' \
+        -H "Authorization: Bearer $token" ${etag:+-H "If-None-Match: $etag"} "$url")
+    if [ "$status" != "304" ]; then
+        mv "$HTTP_CACHE/$key.new" "$HTTP_CACHE/$key.body"
+        grep -i '^etag:' "$HTTP_CACHE/$key.headers" | cut -d' ' -f2- | tr -d '\r' > "$HTTP_CACHE/$key.etag"
+    fi
+    cat "$HTTP_CACHE/$key.body"
+}
+
 function get_json_val() {
     # Extracts a value from a JSON object
     echo "$1" | python3 -c "import sys, json; print(json.load(sys.stdin).get('$2', ''))" 2>/dev/null
@@ -177,7 +195,7 @@ print_header "4. RENTAL, FAILOVER & SELF-HEALING"
 echo "Waiting for 'alive' workers..."
 ALIVE_COUNT=0
 for i in {1..20}; do
-    NODES=$(curl -s -k -X GET "$API/nodes" -H "Authorization: Bearer $ADMIN_TOKEN")
+    NODES=$(cached_get "$API/nodes" "$ADMIN_TOKEN")
     ALIVE_COUNT=$(echo "$NODES" | python3 -c "import sys, json; print(len([n for n in json.load(sys.stdin) if n.get('status') == 'alive']))" 2>/dev/null)
     if [ "$ALIVE_COUNT" -gt "0" ]; then break; fi
     sleep 2
@@ -237,7 +255,7 @@ else
     
     # 4c. VERIFY REASSIGNMENT
     echo "Checking User's Nodes for Reassignment..."
-    MY_NODES=$(curl -s -k -X GET "$API/nodes" -H "Authorization: Bearer $USER_TOKEN")
+    MY_NODES=$(cached_get "$API/nodes" "$USER_TOKEN")
     
     # Parsing JSON to find if we have a rental which is ACTIVE
     NEW_RENTAL_NODE=$(echo "$MY_NODES" | python3 -c "import sys, json; 
@@ -288,7 +306,7 @@ print_header "5. RENTAL LIFECYCLE (Rent -> Extend -> Release)"
 
 # 5a. CLEANUP (Ensure specific user starts fresh for this step)
 echo "Ensuring clean state for user..."
-MY_NODES=$(curl -s -k -X GET "$API/nodes" -H "Authorization: Bearer $USER_TOKEN")
+MY_NODES=$(cached_get "$API/nodes" "$USER_TOKEN")
 # Extract all rental IDs for this user
 RENTAL_IDS=$(echo "$MY_NODES" | python3 -c "import sys, json; print(' '.join([str(r['rental_id']) for n in json.load(sys.stdin) for r in [n.get('lease')] if r and r.get('active')]))" 2>/dev/null)
 
@@ -316,7 +334,7 @@ else
     
     # 5c. SHOW INFO
     echo "Fetching Rental Info..."
-    NODES=$(curl -s -k -X GET "$API/nodes" -H "Authorization: Bearer $USER_TOKEN")
+    NODES=$(cached_get "$API/nodes" "$USER_TOKEN")
     # Show key info
     echo "$NODES" | python3 -c "import sys, json; 
 data = json.load(sys.stdin)
@@ -360,7 +378,7 @@ for n in data:
     # 5f. VERIFY
     echo "Verifying no active rentals remain..."
     sleep 2 # Give a moment for DB update if async (though it should be sync)
-    FINAL_NODES=$(curl -s -k -X GET "$API/nodes" -H "Authorization: Bearer $USER_TOKEN")
+    FINAL_NODES=$(cached_get "$API/nodes" "$USER_TOKEN")
     COUNT=$(echo "$FINAL_NODES" | python3 -c "import sys, json; 
 data = json.load(sys.stdin)
 # data is a list of nodes. We count how many have active leases
@@ -7,6 +7,11 @@ export PATH=$PATH:/usr/local/bin:/Applications/Docker.app/Contents/Resources/bin
 # Définition de l'ID du scheduler s'il n'est pas déjà défini
 export SCHEDULER_ID=${SCHEDULER_ID:-1}
 
+# Backend docker : socket Docker monté dans l'API et le Scheduler via l'override
+if [ "${PROVISIONER_BACKEND:-}" = "docker" ]; then
+    export COMPOSE_FILE=${COMPOSE_FILE:-docker-compose.yml:docker-compose.docker.yml}
+fi
+
 echo "=================================================="
 echo "   Démarrage de Orion-Dynamic (Demo Mode)"
 echo "=================================================="
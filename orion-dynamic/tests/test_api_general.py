@@ -5,6 +5,8 @@ import json
 import base64
 from cryptography.fernet import Fernet
 
+import api
+
 def test_health_check(client):
     res = client.get('/health')
     assert res.status_code == 200
@@ -184,6 +186,13 @@ def test_get_ssh_password(client, auth_headers, mock_db):
         res = client.get('/lease/100/password', headers=auth_headers)
         assert res.status_code == 200
         assert res.json['ssh_password'] == "clear_pass"
+        conn.close.assert_called()
+
+        # Mot de passe déjà connu du client : 304 sans déchiffrement
+        mock_dec.reset_mock()
+        res = client.get('/lease/100/password', headers={**auth_headers, "If-None-Match": res.headers["ETag"]})
+        assert res.status_code == 304
+        mock_dec.assert_not_called()
 
 def test_get_ssh_password_forbidden(client, auth_headers, mock_db):
     conn = mock_db.return_value
@@ -245,3 +254,324 @@ def test_require_auth_invalid_token(client):
     res = client.get('/nodes', headers=headers)
     assert res.status_code == 401
     assert "invalide" in res.json['error']
+
+def test_worker_heartbeat(client, mock_db):
+    conn = mock_db.return_value
+    cursor = conn.cursor.return_value
+    cursor.rowcount = 1
+
+    data = {"hostname": "w1", "ip": "1.2.3.4", "ssh_port": 22}
+    res = client.post('/workers/heartbeat', json=data)
+
+    assert res.status_code == 200
+    sql, params = cursor.execute.call_args[0]
+    assert "UPDATE nodes SET last_heartbeat=NOW()" in sql
+    assert params == ("w1", "1.2.3.4", 22)
+    conn.commit.assert_called()
+
+def test_worker_register_and_heartbeat_container_name(client, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.rowcount = 1
+    data = {"hostname": "w1", "ip": "1.2.3.4", "ssh_port": 22, "container_name": "worker-01"}
+
+    assert client.post('/workers/register', json=data).status_code == 201
+    assert cursor.execute.call_args[0][1] == ("w1", "1.2.3.4", 22, "worker-01", 0, 0, 0, 1)
+
+    assert client.post('/workers/heartbeat', json=data).status_code == 200
+    sql, params = cursor.execute.call_args[0]
+    assert "container_name=%s" in sql
+    assert params == ("worker-01", "w1", "1.2.3.4", 22)
+
+def test_worker_heartbeat_unknown_node(client, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.rowcount = 0
+
+    res = client.post('/workers/heartbeat', json={"hostname": "w1", "ip": "1.2.3.4", "ssh_port": 22})
+    assert res.status_code == 404
+
+def test_worker_heartbeat_invalid(client):
+    assert client.post('/workers/heartbeat', json={"hostname": "w1"}).status_code == 400
+
+def test_worker_register_and_heartbeat_capacity(client, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.rowcount = 1
+    data = {"hostname": "w1", "ip": "1.2.3.4", "ssh_port": 22, "cpu_cores": 4, "memory_mb": 8192, "disk_gb": 50}
+
+    assert client.post('/workers/register', json=data).status_code == 201
+    sql, params = cursor.execute.call_args[0]
+    assert "cpu_cores, memory_mb, disk_gb" in sql
+    assert params == ("w1", "1.2.3.4", 22, None, 4, 8192, 50, 1)
+
+    assert client.post('/workers/heartbeat', json=data).status_code == 200
+    sql, params = cursor.execute.call_args[0]
+    assert "cpu_cores=%s, memory_mb=%s, disk_gb=%s" in sql
+    assert params == (4, 8192, 50, "w1", "1.2.3.4", 22)
+
+def test_worker_capacity_invalid(client, mock_db):
+    data = {"hostname": "w1", "ip": "1.2.3.4", "ssh_port": 22, "cpu_cores": -1}
+    assert client.post('/workers/register', json=data).status_code == 400
+    data["cpu_cores"] = "many"
+    assert client.post('/workers/heartbeat', json=data).status_code == 400
+
+def test_compute_slots():
+    from api import compute_slots
+    assert compute_slots({"slots": 3}, {}) == 3
+    assert compute_slots({}, {"cpu_cores": 8, "memory_mb": 4096}) is None
+    with patch('api.SLOT_CPU_CORES', 2), patch('api.SLOT_MEMORY_MB', 2048):
+        assert compute_slots({}, {"cpu_cores": 8, "memory_mb": 4096}) == 2
+        assert compute_slots({}, {"cpu_cores": 1, "memory_mb": 1024}) == 1
+    with pytest.raises(ValueError):
+        compute_slots({"slots": 0}, {})
+
+def test_worker_heartbeat_updates_slots(client, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.rowcount = 1
+    data = {"hostname": "w1", "ip": "1.2.3.4", "ssh_port": 22, "slots": 4}
+
+    assert client.post('/workers/heartbeat', json=data).status_code == 200
+    sql, params = cursor.execute.call_args[0]
+    assert "slots=%s, allocated=(slots_used >= slots)" in sql
+    assert params == (4, "w1", "1.2.3.4", 22)
+    assert client.post('/workers/register', json=dict(data, slots=0)).status_code == 400
+
+def test_worker_heartbeat_logs_described_changes_only(client, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.rowcount = 1
+    data = {"hostname": "w1", "ip": "1.2.3.4", "ssh_port": 22, "cpu_cores": 4, "slots": 2}
+
+    assert client.post('/workers/heartbeat', json=data).status_code == 200
+    log_sql, log_params = cursor.execute.call_args_list[0][0]
+    assert "INSERT INTO change_log" in log_sql
+    assert "NOT (cpu_cores <=> %s AND slots <=> %s)" in log_sql
+    assert log_params == ("w1", "1.2.3.4", 22, 4, 2)
+
+    # Heartbeat sans description : pas de journalisation
+    cursor.execute.reset_mock()
+    assert client.post('/workers/heartbeat', json={"hostname": "w1", "ip": "1.2.3.4", "ssh_port": 22}).status_code == 200
+    assert cursor.execute.call_count == 1
+
+def test_worker_register_records_node_change(client, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.lastrowid = 42
+    assert client.post('/workers/register', json={"hostname": "w1", "ip": "1.2.3.4", "ssh_port": 22}).status_code == 201
+    cursor.executemany.assert_called_once_with(ANY, [('node', 42)])
+
+def node_row(node_id, rental_id=None):
+    return {"node_id": node_id, "hostname": f"node{node_id}", "ssh_port": 22, "status": "alive", "allocated": 0,
+            "rental_id": rental_id, "rental_user_id": 1, "leased_from": None, "leased_until": None, "active": 1}
+
+def test_list_nodes_since_zero_returns_full_snapshot(client, auth_headers, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    # ETag (version stable, lignes récentes) puis version de l'instantané
+    cursor.fetchone.side_effect = [{"version": 70}, {"latest": 72, "pending": 2}, {"version": 70}]
+    cursor.fetchall.return_value = [node_row(10, 100)]
+
+    res = client.get('/nodes?since=0', headers=auth_headers)
+    assert res.status_code == 200
+    assert res.json["full"] is True
+    assert res.json["version"] == 70
+    assert [n["node_id"] for n in res.json["nodes"]] == [10]
+    # Version lue avant l'instantané
+    assert "ORDER BY version DESC" in cursor.execute.call_args_list[0][0][0]
+
+def test_list_nodes_since_returns_changed_nodes_only(client, auth_headers, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    # ETag (version stable, lignes récentes) puis plus ancienne version conservée
+    cursor.fetchone.side_effect = [{"version": 12}, {"latest": 13, "pending": 1}, {"oldest": 3}]
+    cursor.fetchall.side_effect = [
+        # change_log depuis la version 10 ; la dernière ligne n'est pas encore stable
+        [{"version": 11, "entity": "node", "entity_id": 5, "settled": 1},
+         {"version": 12, "entity": "rental", "entity_id": 100, "settled": 1},
+         {"version": 13, "entity": "rental", "entity_id": 101, "settled": 1},
+         {"version": 14, "entity": "rental", "entity_id": 102, "settled": 0}],
+        # nœuds et locataires des locations modifiées : 101 rendue par l'utilisateur,
+        # 102 appartient à un autre locataire
+        [{"node_id": 10, "user_id": 1}, {"node_id": 12, "user_id": 1}, {"node_id": 7, "user_id": 2}],
+        # nœuds visibles parmi 5, 7, 10, 12
+        [node_row(10, 100)],
+    ]
+
+    res = client.get('/nodes?since=10', headers=auth_headers)
+    assert res.status_code == 200
+    # Les nœuds 5 et 7 n'ont jamais été visibles pour l'utilisateur : absents de `removed`
+    assert res.json == {"version": 13, "full": False, "removed": [12], "nodes": ANY}
+    assert [n["node_id"] for n in res.json["nodes"]] == [10]
+
+    sql, params = cursor.execute.call_args[0]
+    assert "n.id IN (%s,%s,%s,%s)" in sql
+    assert params == (1, 5, 7, 10, 12)
+
+def test_list_nodes_since_removed_keeps_rented_nodes_leaving_filter(client, auth_headers, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchone.side_effect = [{"version": 12}, {"latest": 12, "pending": 0}, {"oldest": 3}]
+    cursor.fetchall.side_effect = [
+        [{"version": 11, "entity": "node", "entity_id": 5, "settled": 1},
+         {"version": 12, "entity": "node", "entity_id": 7, "settled": 1}],
+        # aucun nœud ne passe status=alive
+        [],
+        # l'utilisateur loue encore le nœud 5, passé dead
+        [{"node_id": 5}],
+    ]
+
+    res = client.get('/nodes?since=10&status=alive', headers=auth_headers)
+    assert res.json["removed"] == [5]
+    sql, params = cursor.execute.call_args[0]
+    assert "active = TRUE" in sql
+    assert params == (1, 5, 7)
+
+def test_list_nodes_since_falls_back_to_snapshot_when_too_far_behind(client, auth_headers, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchone.side_effect = [{"version": 99}, {"latest": 99, "pending": 0}, {"oldest": 1}, {"version": 99}]
+    cursor.fetchall.side_effect = [
+        [{"version": v, "entity": "node", "entity_id": v, "settled": 1} for v in range(3)],
+        [node_row(1)],
+    ]
+    with patch('api.NODES_DELTA_LIMIT', 2):
+        res = client.get('/nodes?since=1', headers=auth_headers)
+    assert res.json["full"] is True
+    assert res.json["version"] == 99
+
+def test_list_nodes_since_older_than_retained_log_gets_snapshot(client, auth_headers, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    # Versions 1 à 49 purgées par le scheduler : un client à la version 10 a pu en perdre
+    cursor.fetchone.side_effect = [{"version": 99}, {"latest": 99, "pending": 0}, {"oldest": 50}, {"version": 99}]
+    cursor.fetchall.side_effect = [[node_row(1)]]
+    res = client.get('/nodes?since=10', headers=auth_headers)
+    assert res.json["full"] is True
+    assert res.json["version"] == 99
+    assert not any("WHERE version > %s" in c[0][0] and "ORDER BY version" in c[0][0]
+                   for c in cursor.execute.call_args_list)
+
+def test_list_nodes_since_invalid(client, auth_headers):
+    assert client.get('/nodes?since=abc', headers=auth_headers).status_code == 400
+    assert client.get('/nodes?since=-1', headers=auth_headers).status_code == 400
+
+def test_list_nodes_etag_short_circuits_before_node_query(client, auth_headers, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchone.side_effect = [{"version": 70}, {"latest": 72, "pending": 2}]
+    cursor.fetchall.return_value = [node_row(10, 100)]
+
+    res = client.get('/nodes', headers=auth_headers)
+    assert res.status_code == 200
+    etag = res.headers["ETag"]
+    assert etag.startswith('"nodes-user-1-70-72-2-')
+    assert res.headers["Cache-Control"] == "private, no-cache"
+
+    cursor.fetchone.side_effect = [{"version": 70}, {"latest": 72, "pending": 2}]
+    cursor.fetchall.reset_mock()
+    res = client.get('/nodes', headers={**auth_headers, "If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.data == b""
+    assert res.headers["ETag"] == etag
+    cursor.fetchall.assert_not_called()
+
+    # Version en retard committée entre-temps : le nombre de lignes récentes change
+    cursor.fetchone.side_effect = [{"version": 70}, {"latest": 72, "pending": 3}]
+    res = client.get('/nodes', headers={**auth_headers, "If-None-Match": etag})
+    assert res.status_code == 200
+
+def test_list_nodes_etag_depends_on_query(client, auth_headers, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchall.return_value = [node_row(10, 100)]
+    etags = set()
+    for url in ('/nodes', '/nodes?status=alive', '/nodes?fields=status', '/nodes?limit=1',
+                '/nodes?limit=1&after=10', '/nodes?allocated=true'):
+        cursor.fetchone.side_effect = [{"version": 70}, {"latest": 72, "pending": 2}]
+        etags.add(client.get(url, headers=auth_headers).headers["ETag"])
+    assert len(etags) == 6
+
+    # Même requête normalisée (booléen écrit autrement) : même ETag
+    cursor.fetchone.side_effect = [{"version": 70}, {"latest": 72, "pending": 2}]
+    etag = client.get('/nodes?allocated=true', headers=auth_headers).headers["ETag"]
+    cursor.fetchone.side_effect = [{"version": 70}, {"latest": 72, "pending": 2}]
+    assert client.get('/nodes?allocated=1', headers={**auth_headers, "If-None-Match": etag}).status_code == 304
+
+def test_list_nodes_keyset_page_with_filters(client, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchall.return_value = [node_row(11, 100), node_row(11, 101), node_row(14)]
+    with patch('api.decode_jwt', return_value={"user_id": 1, "username": "a", "role": "admin"}):
+        res = client.get('/nodes?limit=2&after=10&status=alive,dead&allocated=false&renter=bob',
+                         headers={"Authorization": "Bearer tok"})
+
+    assert res.status_code == 200
+    # Page pleine (2 nœuds, un nœud à 2 locations n'est pas coupé) : curseur suivant
+    assert res.json["next_after"] == 14
+    assert [n["node_id"] for n in res.json["nodes"]] == [11, 14]
+    assert len(res.json["nodes"][0]["leases"]) == 2
+
+    sql, params = cursor.execute.call_args[0]
+    assert "SELECT n.id FROM nodes n" in sql
+    assert "n.id > %s AND n.status IN (%s,%s) AND n.allocated = %s" in sql
+    assert "ru.username = %s" in sql
+    assert params == (10, "alive", "dead", False, "bob", 2)
+
+def test_list_nodes_last_page_and_projection_without_lease_join(client, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchall.return_value = [node_row(20)]
+    with patch('api.decode_jwt', return_value={"user_id": 1, "username": "a", "role": "admin"}):
+        res = client.get('/nodes?after=19&fields=status,hostname', headers={"Authorization": "Bearer tok"})
+
+    assert res.json == {"nodes": [{"node_id": 20, "status": "alive", "hostname": "node20"}], "next_after": None}
+    sql, params = cursor.execute.call_args[0]
+    assert "LEFT JOIN rentals" not in sql
+    assert params == (19, 500)
+
+def test_list_nodes_filters_without_pagination_keep_capped_plain_list(client, auth_headers, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchall.return_value = [node_row(10, 100)]
+    res = client.get('/nodes?needs_cleanup=true', headers=auth_headers)
+    assert isinstance(res.json, list)
+    assert "Link" not in res.headers
+    sql, params = cursor.execute.call_args[0]
+    # Sans `limit`, la liste reste plafonnée à NODES_PAGE_MAX nœuds
+    assert "n.id > %s AND n.needs_cleanup = %s AND EXISTS" in sql
+    assert params == (0, True, 1, api.NODES_PAGE_MAX, 1)
+
+def test_list_nodes_plain_list_signals_next_page_when_capped(client, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchall.return_value = [node_row(10), node_row(11)]
+    with patch('api.NODES_PAGE_MAX', 2), \
+         patch('api.decode_jwt', return_value={"user_id": 1, "username": "a", "role": "admin"}):
+        res = client.get('/nodes?status=alive', headers={"Authorization": "Bearer tok"})
+
+    assert [n["node_id"] for n in res.json] == [10, 11]
+    assert res.headers["X-Next-After"] == "11"
+    assert res.headers["Link"] == '<?status=alive&after=11&limit=2>; rel="next"'
+
+def test_list_nodes_snapshot_is_paged_with_after(client, auth_headers, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchone.side_effect = [{"version": 70}, {"latest": 70, "pending": 0}, {"version": 70}]
+    cursor.fetchall.return_value = [node_row(11), node_row(12)]
+
+    res = client.get('/nodes?since=0&after=10&limit=2', headers=auth_headers)
+    assert res.status_code == 200
+    assert res.json["full"] is True
+    assert res.json["version"] == 70
+    assert res.json["next_after"] == 12
+    sql, params = cursor.execute.call_args[0]
+    assert "n.id > %s" in sql
+    assert params == (10, 1, 2, 1)
+
+    # Sans `limit`, une page d'instantané fait NODES_PAGE_DEFAULT nœuds
+    cursor.fetchone.side_effect = [{"version": 70}, {"latest": 70, "pending": 0}, {"version": 70}]
+    res = client.get('/nodes?since=0', headers=auth_headers)
+    assert res.json["next_after"] is None
+    assert cursor.execute.call_args[0][1] == (0, 1, api.NODES_PAGE_DEFAULT, 1)
+
+def test_list_nodes_delta_ignores_page_size(client, auth_headers, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchone.side_effect = [{"version": 12}, {"latest": 12, "pending": 0}, {"oldest": 3}]
+    cursor.fetchall.side_effect = [
+        [{"version": 11, "entity": "node", "entity_id": 5, "settled": 1}],
+        [node_row(5)],
+    ]
+    res = client.get('/nodes?since=10&limit=1', headers=auth_headers)
+    assert res.json["full"] is False
+    sql, params = cursor.execute.call_args[0]
+    assert "SELECT n.id FROM nodes n" not in sql
+    assert params == (1, 5)
+
+def test_list_nodes_query_validation(client, auth_headers):
+    for query in ("status=broken", "allocated=maybe", "limit=0", "limit=100000", "after=-1",
+                  "limit=x", "fields=password", "since=1&after=10"):
+        assert client.get(f'/nodes?{query}', headers=auth_headers).status_code == 400, query
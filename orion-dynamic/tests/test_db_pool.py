@@ -0,0 +1,113 @@
+import pytest
+from unittest.mock import MagicMock, patch
+
+import api
+from api import DBConnectionPool
+
+
+def make_pool(max_size=2, timeout=0.05, recycle=300):
+    return DBConnectionPool(max_size=max_size, timeout=timeout, recycle=recycle)
+
+
+def test_pool_reuses_connection():
+    pool = make_pool()
+    with patch('mysql.connector.connect') as mock_connect:
+        conn = pool.acquire()
+        conn.close()
+        conn = pool.acquire()
+        conn.close()
+
+        assert mock_connect.call_count == 1
+        stats = pool.snapshot()
+        assert stats["checkouts"] == 2
+        assert stats["created"] == 1
+        assert stats["idle"] == 1
+        assert stats["in_use"] == 0
+
+def test_pool_connections_report_found_rows():
+    # Le heartbeat distingue un nœud inconnu d'un UPDATE sans changement via rowcount
+    from mysql.connector.constants import ClientFlag
+    pool = make_pool()
+    with patch('mysql.connector.connect') as mock_connect:
+        pool.acquire().close()
+        assert ClientFlag.FOUND_ROWS in mock_connect.call_args.kwargs["client_flags"]
+
+def test_pool_double_close_is_noop():
+    pool = make_pool()
+    with patch('mysql.connector.connect'):
+        conn = pool.acquire()
+        conn.close()
+        conn.close()
+        assert pool.snapshot()["idle"] == 1
+
+def test_pool_rolls_back_open_transaction_on_release():
+    pool = make_pool()
+    with patch('mysql.connector.connect') as mock_connect:
+        raw = mock_connect.return_value
+        raw.in_transaction = True
+        pool.acquire().close()
+        raw.rollback.assert_called_once()
+
+def test_pool_replaces_dead_connection():
+    pool = make_pool()
+    dead, fresh = MagicMock(), MagicMock()
+    dead.in_transaction = False
+    dead.ping.side_effect = Exception("gone away")
+    with patch('mysql.connector.connect', side_effect=[dead, fresh]):
+        pool.acquire().close()
+        conn = pool.acquire()
+
+        assert conn._raw is fresh
+        assert pool.snapshot()["dead"] == 1
+        assert pool.snapshot()["size"] == 1
+
+def test_pool_recycles_idle_connection():
+    pool = make_pool(recycle=0)
+    with patch('mysql.connector.connect') as mock_connect:
+        pool.acquire().close()
+        pool.acquire()
+        assert mock_connect.call_count == 2
+        assert pool.snapshot()["recycled"] >= 1
+
+def test_pool_exhausted():
+    from mysql.connector.errors import PoolError
+    pool = make_pool(max_size=1)
+    with patch('mysql.connector.connect'):
+        pool.acquire()
+        with pytest.raises(PoolError):
+            pool.acquire()
+
+        stats = pool.snapshot()
+        assert stats["waits"] == 1
+        assert stats["exhausted"] == 1
+
+def test_pool_connect_failure_frees_slot():
+    from mysql.connector import Error
+    pool = make_pool(max_size=1)
+    with patch('mysql.connector.connect', side_effect=Error("DB Down")):
+        with pytest.raises(Error):
+            pool.acquire()
+    assert pool.snapshot()["size"] == 0
+
+def test_get_db_connection_pool_exhausted_returns_none():
+    from mysql.connector.errors import PoolError
+    with patch('api.get_db_pool') as mock_pool:
+        mock_pool.return_value.acquire.side_effect = PoolError("full")
+        assert api.get_db_connection() is None
+
+def test_get_db_pool_recreated_after_fork():
+    pool = api.get_db_pool()
+    assert api.get_db_pool() is pool
+    with patch('os.getpid', return_value=pool.pid + 1):
+        assert api.get_db_pool() is not pool
+
+def test_db_pool_metrics_admin_only(client):
+    with patch('api.decode_jwt', return_value={"user_id": 1, "username": "u", "role": "user"}):
+        res = client.get('/metrics/db-pool', headers={"Authorization": "Bearer tok"})
+        assert res.status_code == 403
+
+    with patch('api.decode_jwt', return_value={"user_id": 1, "username": "a", "role": "admin"}):
+        res = client.get('/metrics/db-pool', headers={"Authorization": "Bearer tok"})
+        assert res.status_code == 200
+        assert "checkouts" in res.json
+        assert "exhausted" in res.json
@@ -0,0 +1,162 @@
+import json
+import pytest
+from unittest.mock import patch
+
+import api
+
+
+def node_row(node_id, rental_id=None, user_id=None):
+    return {"node_id": node_id, "hostname": f"node{node_id}", "ssh_port": 22, "status": "alive", "allocated": 0,
+            "rental_id": rental_id, "rental_user_id": user_id, "leased_from": None, "leased_until": None,
+            "active": 1, "renter_username": f"user{user_id}" if user_id else None}
+
+def make_broadcaster():
+    broadcaster = api.ChangeBroadcaster()
+    # Pas de thread en test : poll() est appelé directement
+    broadcaster._ensure_thread = lambda: None
+    return broadcaster
+
+
+def test_broadcaster_fans_out_one_read_per_poll(mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchone.return_value = {"version": 4}
+    cursor.fetchall.side_effect = [
+        [{"version": 5, "entity": "node", "entity_id": 10, "settled": 1},
+         {"version": 6, "entity": "rental", "entity_id": 100, "settled": 0}],
+        [{"node_id": 11, "user_id": 1}],
+        [node_row(10, 99, 2), node_row(11, 100, 1)],
+    ]
+    broadcaster = make_broadcaster()
+    admin = broadcaster.subscribe({"role": "admin", "user_id": 3})
+    user = broadcaster.subscribe({"role": "user", "user_id": 1})
+
+    broadcaster.poll()
+
+    # Une seule lecture des nœuds pour tous les abonnés
+    assert cursor.fetchall.call_count == 3
+    kind, event = admin.get_nowait()
+    assert kind == "nodes"
+    assert event["version"] == 5
+    assert [n["node_id"] for n in event["nodes"]] == [10, 11]
+    assert event["nodes"][0]["lease"]["renter_username"] == "user2"
+
+    kind, event = user.get_nowait()
+    assert [n["node_id"] for n in event["nodes"]] == [11]
+    assert event["nodes"][0]["lease"]["renter_username"] is None
+    # Le nœud 10 d'un autre locataire n'apparaît pas dans `removed`
+    assert event["removed"] == []
+
+def test_broadcaster_removed_only_lists_callers_nodes(mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchone.return_value = {"version": 4}
+    cursor.fetchall.side_effect = [
+        [{"version": 5, "entity": "rental", "entity_id": 100, "settled": 1},
+         {"version": 6, "entity": "rental", "entity_id": 200, "settled": 1}],
+        # 100 rendue par l'utilisateur 1, 200 rendue par l'utilisateur 2
+        [{"node_id": 11, "user_id": 1}, {"node_id": 12, "user_id": 2}],
+        [node_row(11), node_row(12)],
+    ]
+    broadcaster = make_broadcaster()
+    admin = broadcaster.subscribe({"role": "admin", "user_id": 3})
+    user = broadcaster.subscribe({"role": "user", "user_id": 1})
+
+    broadcaster.poll()
+
+    assert admin.get_nowait()[1]["removed"] == []
+    assert user.get_nowait()[1]["removed"] == [11]
+
+def test_broadcaster_does_not_resend_unsettled_changes(mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    broadcaster = make_broadcaster()
+    broadcaster.version, broadcaster._sent = 5, {6}
+    q = broadcaster.subscribe({"role": "admin", "user_id": 1})
+    cursor.fetchall.side_effect = [[{"version": 6, "entity": "rental", "entity_id": 100, "settled": 1}]]
+
+    broadcaster.poll()
+
+    assert q.empty()
+    assert broadcaster.version == 6
+    assert broadcaster._sent == set()
+
+def test_broadcaster_resync_when_too_far_behind(mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+    broadcaster = make_broadcaster()
+    broadcaster.version = 1
+    q = broadcaster.subscribe({"role": "admin", "user_id": 1})
+    cursor.fetchall.side_effect = [[{"version": v, "entity": "node", "entity_id": v, "settled": 1} for v in range(3)]]
+
+    with patch('api.NODES_DELTA_LIMIT', 2):
+        broadcaster.poll()
+
+    assert q.get_nowait() == ("resync", {})
+    assert broadcaster.version is None
+
+def test_broadcaster_slow_subscriber_gets_resync():
+    broadcaster = make_broadcaster()
+    with patch('api.EVENTS_QUEUE_SIZE', 1):
+        q = broadcaster.subscribe({"role": "admin", "user_id": 1})
+    broadcaster._broadcast("nodes", lambda user: {"version": 1})
+    broadcaster._broadcast("nodes", lambda user: {"version": 2})
+    assert q.get_nowait() == ("resync", {})
+    assert q.empty()
+
+def test_events_requires_token(client):
+    assert client.get('/events').status_code == 401
+    assert client.get('/events?token=not.a.token').status_code == 401
+
+def test_events_query_token_must_be_stream_token(client):
+    session = api.generate_jwt(user_id=1, username="alice", role="user")
+    stream = api.generate_stream_token({"user_id": 1, "role": "user"})
+    # JWT de session refusé en paramètre (journaux d'accès), jeton de flux refusé ailleurs
+    assert client.get(f'/events?token={session}').status_code == 401
+    assert client.get('/nodes', headers={"Authorization": f"Bearer {stream}"}).status_code == 401
+    assert client.get('/events', headers={"Authorization": f"Bearer {stream}"}).status_code == 401
+    assert api.decode_jwt(stream)["purpose"] == "events"
+
+def test_events_token_endpoint_issues_short_lived_token(client):
+    session = api.generate_jwt(user_id=1, username="alice", role="user")
+    res = client.post('/events/token', headers={"Authorization": f"Bearer {session}"})
+    assert res.status_code == 200
+    assert res.json["expires_in"] == api.EVENTS_TOKEN_TTL
+    payload = api.decode_jwt(res.json["token"])
+    assert payload["user_id"] == 1
+    assert payload["purpose"] == "events"
+    assert client.post('/events/token').status_code == 401
+
+def test_events_stream_delivers_broadcast_and_unsubscribes(client):
+    broadcaster = make_broadcaster()
+    with patch('api.get_change_broadcaster', return_value=broadcaster), \
+         patch('api.decode_jwt', return_value={"user_id": 1, "role": "user", "purpose": "events"}):
+        res = client.get('/events?token=tok', buffered=False)
+        assert res.status_code == 200
+        assert res.mimetype == "text/event-stream"
+
+        chunks = (chunk.decode() for chunk in res.response)
+        assert next(chunks).startswith("retry:")
+        broadcaster._broadcast("nodes", lambda user: {"version": 7, "nodes": [], "removed": [3]})
+        chunk = next(chunks)
+        assert chunk.startswith("event: nodes\n")
+        assert json.loads(chunk.split("data: ", 1)[1]) == {"version": 7, "nodes": [], "removed": [3]}
+
+        res.close()
+        assert broadcaster.subscriber_count() == 0
+
+def test_broadcaster_caps_subscribers():
+    broadcaster = make_broadcaster()
+    with patch('api.EVENTS_MAX_SUBSCRIBERS', 2):
+        first = broadcaster.subscribe({"role": "admin", "user_id": 1})
+        assert broadcaster.subscribe({"role": "user", "user_id": 2}) is not None
+        assert broadcaster.subscribe({"role": "user", "user_id": 3}) is None
+        # Un départ libère une place
+        broadcaster.unsubscribe(first)
+        assert broadcaster.subscribe({"role": "user", "user_id": 3}) is not None
+
+def test_events_rejects_subscribers_over_limit(client):
+    broadcaster = make_broadcaster()
+    with patch('api.get_change_broadcaster', return_value=broadcaster), \
+         patch('api.EVENTS_MAX_SUBSCRIBERS', 0), \
+         patch('api.decode_jwt', return_value={"user_id": 1, "role": "user", "purpose": "events"}):
+        res = client.get('/events?token=tok')
+    assert res.status_code == 503
+    assert res.headers["Retry-After"]
+    assert broadcaster.subscriber_count() == 0
@@ -0,0 +1,302 @@
+import pytest
+from unittest.mock import MagicMock, patch, ANY
+import sys
+import os
+import threading
+import subprocess
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../control-plane/scheduler')))
+
+import api
+import scheduler
+
+SCRIPTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../ansible/scripts'))
+
+
+def mock_ssh_client(rc=0, out=b"", err=b""):
+    client = MagicMock()
+    client.get_transport.return_value.is_active.return_value = True
+    stdin, stdout, stderr = MagicMock(), MagicMock(), MagicMock()
+    stdout.read.return_value = out
+    stderr.read.return_value = err
+    stdout.channel.recv_exit_status.return_value = rc
+    client.exec_command.return_value = (stdin, stdout, stderr)
+    return client
+
+
+def test_ssh_session_reused_between_operations():
+    pool = api.SSHSessionPool(idle_timeout=300)
+    client = mock_ssh_client()
+    with patch('paramiko.SSHClient', return_value=client) as mock_cls:
+        pool.run("1.1.1.1", 22, "true")
+        pool.run("1.1.1.1", 22, "true")
+
+        assert mock_cls.call_count == 1
+        assert client.connect.call_count == 1
+        assert client.exec_command.call_count == 2
+
+def test_ssh_session_reconnects_when_broken():
+    import paramiko
+    pool = api.SSHSessionPool(idle_timeout=300)
+    broken, fresh = mock_ssh_client(), mock_ssh_client(rc=0)
+    broken.exec_command.side_effect = paramiko.SSHException("session closed")
+    with patch('paramiko.SSHClient', side_effect=[broken, fresh]):
+        rc, _, _ = pool.run("1.1.1.1", 22, "true")
+
+    assert rc == 0
+    broken.close.assert_called()
+
+def test_ssh_session_idle_eviction():
+    pool = api.SSHSessionPool(idle_timeout=0)
+    first, second = mock_ssh_client(), mock_ssh_client()
+    with patch('paramiko.SSHClient', side_effect=[first, second]):
+        pool.run("1.1.1.1", 22, "true")
+        pool.run("1.1.1.1", 22, "true")
+    first.close.assert_called()
+
+def test_build_script_command_quotes_arguments():
+    cmd = api.build_script_command("echo $1", "bob; rm -rf /")
+    assert cmd == "sh -c 'echo $1' sh 'bob; rm -rf /'"
+
+    with patch('api.WORKER_SSH_USER', 'deploy'):
+        assert api.build_script_command("true", "bob").startswith("sudo -n sh -c")
+
+def test_scripts_exist_for_every_playbook():
+    with patch('api.PROVISION_SCRIPTS_DIR', SCRIPTS_DIR), patch.dict('api._script_cache', clear=True):
+        for playbook in ('create_user.yml', 'delete_user.yml', 'force_disconnect_user.yml'):
+            assert api.load_provision_script(playbook)
+        assert api.load_provision_script('unknown.yml') is None
+
+def test_run_ssh_provision_sends_password_on_stdin():
+    sessions = MagicMock()
+    sessions.run.return_value = (0, "", "")
+    with patch('api.get_ssh_sessions', return_value=sessions), \
+         patch('api.load_provision_script', return_value="create"):
+        assert api.run_ssh_provision('create_user.yml', '1.1.1.1', 22, 'alice', 's3cret') is True
+
+    host, port, command, stdin_data = sessions.run.call_args[0]
+    assert "s3cret" not in command
+    assert stdin_data == "s3cret\n"
+
+def test_run_ssh_provision_script_failure():
+    sessions = MagicMock()
+    sessions.run.return_value = (1, "", "boom")
+    with patch('api.get_ssh_sessions', return_value=sessions), \
+         patch('api.load_provision_script', return_value="delete"):
+        assert api.run_ssh_provision('delete_user.yml', '1.1.1.1', 22, 'alice', '') is False
+
+def test_run_provision_defaults_to_ansible():
+    with patch('api.run_ansible_provision', return_value=True) as mock_ansible, \
+         patch('api.run_ssh_provision') as mock_ssh:
+        assert api.run_provision('create_user.yml', '1.1.1.1', 22, 'u', 'p') is True
+        mock_ssh.assert_not_called()
+        mock_ansible.assert_called_once()
+
+def test_run_provision_ssh_backend_with_ansible_fallback():
+    with patch('api.PROVISIONER_BACKEND', 'ssh'), \
+         patch('api.run_ansible_provision', return_value=True) as mock_ansible, \
+         patch('api.run_ssh_provision', return_value=True) as mock_ssh:
+        assert api.run_provision('create_user.yml', '1.1.1.1', 22, 'u', 'p') is True
+        mock_ansible.assert_not_called()
+
+        # Worker injoignable en SSH direct : repli sur Ansible
+        mock_ssh.side_effect = OSError("connection refused")
+        assert api.run_provision('create_user.yml', '1.1.1.1', 22, 'u', 'p') is True
+        mock_ansible.assert_called_once()
+
+        # Échec du script : pas de repli
+        mock_ssh.side_effect = None
+        mock_ssh.return_value = False
+        assert api.run_provision('create_user.yml', '1.1.1.1', 22, 'u', 'p') is False
+        assert mock_ansible.call_count == 1
+
+def test_scheduler_run_provision_ssh_backend():
+    with patch('scheduler.PROVISIONER_BACKEND', 'ssh'), \
+         patch('scheduler.run_ansible_task') as mock_ansible, \
+         patch('scheduler.run_ssh_provision', return_value=True) as mock_ssh:
+        assert scheduler.run_provision('delete_user.yml', '1.1.1.1', 22, 'u', '') is True
+        mock_ssh.assert_called_once_with('delete_user.yml', '1.1.1.1', 22, 'u', '')
+        mock_ansible.assert_not_called()
+
+def test_run_docker_provision_exec_with_password_in_env():
+    container = MagicMock()
+    container.exec_run.return_value = (0, b"")
+    docker_client = MagicMock()
+    docker_client.containers.get.return_value = container
+    with patch('api.get_docker_client', return_value=docker_client), \
+         patch('api.load_provision_script', return_value="create"):
+        assert api.run_docker_provision('create_user.yml', 'worker-01', 'alice', 's3cret') is True
+
+    docker_client.containers.get.assert_called_once_with('worker-01')
+    cmd = container.exec_run.call_args[0][0]
+    assert cmd == ["sh", "-c", "create", "sh", "alice"]
+    assert container.exec_run.call_args[1]['environment'] == {"TARGET_PASS": "s3cret"}
+
+    container.exec_run.return_value = (1, b"boom")
+    with patch('api.get_docker_client', return_value=docker_client), \
+         patch('api.load_provision_script', return_value="create"):
+        assert api.run_docker_provision('create_user.yml', 'worker-01', 'alice', 's3cret') is False
+
+def test_run_provision_docker_backend_with_ansible_fallback():
+    with patch('api.PROVISIONER_BACKEND', 'docker'), \
+         patch('api.run_ansible_provision', return_value=True) as mock_ansible, \
+         patch('api.run_docker_provision', return_value=True) as mock_docker:
+        assert api.run_provision('create_user.yml', '1.1.1.1', 22, 'u', 'p', container_name='worker-01') is True
+        mock_docker.assert_called_once_with('create_user.yml', 'worker-01', 'u', 'p')
+        mock_ansible.assert_not_called()
+
+        # Nœud distant (conteneur inconnu) : Ansible
+        assert api.run_provision('create_user.yml', '1.1.1.1', 22, 'u', 'p') is True
+        assert mock_ansible.call_count == 1
+
+        # Conteneur introuvable : repli sur Ansible
+        mock_docker.side_effect = Exception("No such container")
+        assert api.run_provision('create_user.yml', '1.1.1.1', 22, 'u', 'p', container_name='worker-01') is True
+        assert mock_ansible.call_count == 2
+
+def test_scheduler_batch_docker_backend_uses_container():
+    targets = [{'key': 1, 'host_ip': '1.1.1.1', 'host_port': 22, 'client_user': ['a', 'b'],
+                'client_pass': '', 'container_name': 'worker-01'}]
+    with patch('scheduler.PROVISIONER_BACKEND', 'docker'), \
+         patch('scheduler.run_ansible_batch') as mock_batch, \
+         patch('scheduler.run_docker_provision', return_value=True) as mock_docker:
+        assert scheduler.run_provision_batch('delete_user.yml', targets) == {1: True}
+        mock_docker.assert_called_once_with('delete_user.yml', 'worker-01', ['a', 'b'], '')
+        mock_batch.assert_not_called()
+
+def test_create_user_script_reads_password_from_env():
+    with open(os.path.join(SCRIPTS_DIR, 'create_user.sh')) as f:
+        script = f.read()
+    assert 'TARGET_PASS' in script
+
+def test_ansible_event_collector_captures_failures_without_artifacts():
+    collector = api.AnsibleEventCollector()
+    assert collector({"event": "runner_on_ok", "event_data": {}}) is False
+    assert collector({"event": "runner_on_failed",
+                      "event_data": {"host": "target_node", "task": "Create user", "res": {"msg": "boom"}}}) is False
+    collector({"event": "runner_on_failed",
+               "event_data": {"host": "target_node", "task": "Install shadow", "ignore_errors": True}})
+    collector({"event": "runner_on_unreachable",
+               "event_data": {"host": "target_node", "task": "ping", "res": {"msg": "timeout"}}})
+    assert collector.failures == ["target_node / Create user: boom", "target_node / ping: timeout"]
+
+def replay_ansible_events(tmp_path, events):
+    """Vrai Runner d'ansible-runner : rejoue des événements via event_callback, sans ansible-playbook."""
+    from types import SimpleNamespace
+    # conftest remplace ansible_runner par un MagicMock : on charge le vrai module à part
+    mocked = sys.modules.pop('ansible_runner')
+    try:
+        Runner = pytest.importorskip('ansible_runner.runner').Runner
+    finally:
+        for name in [m for m in sys.modules if m.startswith('ansible_runner')]:
+            del sys.modules[name]
+        sys.modules['ansible_runner'] = mocked
+
+    def run(**kwargs):
+        config = SimpleNamespace(artifact_dir=str(tmp_path), ident="test", check_job_event_data=False)
+        os.makedirs(os.path.join(config.artifact_dir, 'job_events'), exist_ok=True)
+        runner = Runner(config, event_handler=kwargs["event_handler"])
+        for counter, (name, data) in enumerate(events, 1):
+            runner.event_callback({"uuid": f"uuid-{counter}", "counter": counter, "event": name, "event_data": data})
+        runner.status, runner.rc = "successful", 2 if data.get("failures") or data.get("dark") else 0
+        return runner
+    return run
+
+def test_ansible_stats_survive_event_handler(tmp_path):
+    events = [
+        ("runner_on_ok", {"host": "target_node", "task": "Create user"}),
+        ("playbook_on_stats", {"processed": {"target_node": 1}, "ok": {"target_node": 3},
+                               "failures": {}, "dark": {}}),
+    ]
+    with patch('api.ANSIBLE_PROFILE_DIR', str(tmp_path)), \
+         patch('ansible_runner.run', side_effect=replay_ansible_events(tmp_path / "artifacts", events)):
+        r, failures = api.run_ansible_profiled('create_user.yml', {})
+
+    assert failures == []
+    assert r.stats["processed"] == {"target_node": 1}
+    # Seul le bilan est écrit sur disque
+    assert len(os.listdir(tmp_path / "artifacts" / "job_events")) == 1
+
+def test_run_ansible_batch_reads_real_runner_stats(tmp_path):
+    targets = [{"key": i, "host_ip": f"{i + 1}.{i + 1}.{i + 1}.{i + 1}", "host_port": 22,
+                "client_user": f"user{i}", "client_pass": "p"} for i in range(3)]
+    events = [
+        ("runner_on_ok", {"host": "target_0", "task": "Delete user"}),
+        ("runner_on_failed", {"host": "target_1", "task": "Delete user", "res": {"msg": "boom"}}),
+        ("runner_on_unreachable", {"host": "target_2", "task": "Gathering Facts", "res": {"msg": "timeout"}}),
+        ("playbook_on_stats", {"processed": {"target_0": 1, "target_1": 1, "target_2": 1},
+                               "failures": {"target_1": 1}, "dark": {"target_2": 1}}),
+    ]
+    with patch('scheduler.ANSIBLE_PROFILE_DIR', str(tmp_path)), \
+         patch('ansible_runner.run', side_effect=replay_ansible_events(tmp_path / "artifacts", events)):
+        assert scheduler.run_ansible_batch('delete_user.yml', targets) == {0: True, 1: False, 2: False}
+
+def test_run_ansible_profiled_reuses_private_data_dir(tmp_path):
+    with patch('api.ANSIBLE_PROFILE_DIR', str(tmp_path)), \
+         patch.object(api, '_ansible_local', threading.local()), \
+         patch('ansible_runner.run') as mock_run:
+        mock_run.return_value.rc = 0
+        api.run_ansible_profiled('create_user.yml', {}, extravars={"target_user": "u"})
+        api.run_ansible_profiled('create_user.yml', {}, extravars={"target_user": "u"})
+
+    first, second = (c.kwargs for c in mock_run.call_args_list)
+    assert first["private_data_dir"] == second["private_data_dir"]
+    assert first["private_data_dir"].startswith(str(tmp_path))
+    assert first["suppress_output_file"] is True
+    assert first["event_handler"]({"event": "runner_on_ok"}) is False
+    assert first["event_handler"]({"event": "playbook_on_stats", "event_data": {}}) is True
+
+    with open(first["envvars"]["ANSIBLE_CONFIG"]) as f:
+        cfg = f.read()
+    assert "pipelining = True" in cfg
+    assert "ControlPersist" in cfg
+    assert "%%C" in cfg
+
+def test_scheduler_run_ansible_task_logs_event_failures():
+    with patch('scheduler.run_ansible_profiled', return_value=(MagicMock(rc=2), ["target_node / x: boom"])) as mock_run:
+        assert scheduler.run_ansible_task('delete_user.yml', '1.1.1.1', 22, 'u', '') is False
+        assert mock_run.call_args[1]["extravars"] == {"target_user": "u", "target_pass": ""}
+
+def test_fast_deprovision_mode_selects_single_round_trip_playbook(tmp_path):
+    with patch('api.ANSIBLE_PROFILE_DIR', str(tmp_path)), \
+         patch('ansible_runner.run') as mock_run:
+        api.run_ansible_profiled('delete_user.yml', {})
+        assert mock_run.call_args.kwargs["playbook"] == "/ansible/delete_user_fast.yml"
+
+        api.run_ansible_profiled('create_user.yml', {})
+        assert mock_run.call_args.kwargs["playbook"] == "/ansible/create_user.yml"
+
+        with patch('api.DEPROVISION_MODE', 'classic'):
+            api.run_ansible_profiled('delete_user.yml', {})
+            assert mock_run.call_args.kwargs["playbook"] == "/ansible/delete_user.yml"
+
+def test_fast_delete_playbook_runs_script_without_sleep():
+    with open(os.path.join(SCRIPTS_DIR, '..', 'delete_user_fast.yml')) as f:
+        playbook = f.read()
+    assert "scripts/delete_user.sh" in playbook
+    assert "pause" not in playbook
+    assert "apk add" not in playbook
+
+def test_force_disconnect_script_kills_only_exact_user_sessions(tmp_path):
+    # ps/pkill/userdel... factices dans le PATH : seul le filtrage des sessions sshd est réel
+    killed = tmp_path / "killed"
+    stubs = {
+        'ps': "printf '%s\\n' "
+              "'  11 sshd: bob [priv]' '  12 sshd: bob@pts/0' '  13 sshd-session: bob@notty' "
+              "'  21 sshd: bobby [priv]' '  22 sshd: bobby@pts/1' '  31 sshd: xbob@pts/2' "
+              "'  41 sshd: /usr/sbin/sshd -D' '  51 -sh bob'",
+        'kill': f"echo \"$@\" >> {killed}",
+        'pkill': "exit 1", 'pgrep': "exit 1", 'userdel': "exit 0",
+        'deluser': "exit 0", 'rm': "exit 0", 'id': "exit 1",
+    }
+    for name, body in stubs.items():
+        stub = tmp_path / name
+        stub.write_text(f"#!/bin/sh\n{body}\n")
+        stub.chmod(0o755)
+
+    env = {'PATH': f"{tmp_path}:{os.environ.get('PATH', '')}"}
+    script = os.path.join(SCRIPTS_DIR, 'force_disconnect_user.sh')
+    result = subprocess.run(['sh', script, 'bob'], env=env, capture_output=True, text=True)
+
+    assert result.returncode == 0
+    assert killed.read_text().split() == ['-KILL', '11', '12', '13']
@@ -0,0 +1,124 @@
+import pytest
+import sys
+import os
+import inspect
+from unittest.mock import MagicMock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../benchmarks')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../control-plane/scheduler')))
+
+import api
+import scheduler
+import query_plans
+from query_plans import CATALOG, Fleet, Query, check_plan, normalize_sql, record_statement, summarize_plan
+
+SAMPLE_PLAN = {
+    "query_block": {
+        "select_id": 1,
+        "r_total_time_ms": 1.5,
+        "filesort": {
+            "sort_key": "nodes.cpu_cores",
+            "table": {"table_name": "nodes", "access_type": "ALL", "r_loops": 1, "r_rows": 5000},
+        },
+        "subqueries": [{
+            "query_block": {
+                "table": {"table_name": "r", "access_type": "ref", "key": "idx_rentals_node_id",
+                          "r_loops": 5000, "r_rows": 0.5},
+            },
+        }],
+    }
+}
+
+
+def test_summarize_plan_counts_examined_rows_across_subqueries():
+    result = summarize_plan(SAMPLE_PLAN)
+    assert result.examined == 7500
+    assert result.filesort is True
+    assert result.time_ms == 1.5
+    assert [(alias, access) for alias, access, _, _ in result.tables] == [("nodes", "ALL"), ("r", "ref")]
+
+def test_check_plan_flags_full_scan_filesort_and_budgets():
+    query = Query("q", "api.list_nodes", "SELECT 1", max_rows=100, max_locked=10)
+    result = summarize_plan(SAMPLE_PLAN)
+    result.locked = 50
+    violations = check_plan(query, result, Fleet())
+    assert any("scan complet de nodes" in v for v in violations)
+    assert "filesort" in violations
+    assert any("lignes examinées" in v for v in violations)
+    assert any("lignes verrouillées" in v for v in violations)
+
+    allowed = Query("q", "api.list_nodes", "SELECT 1", max_rows=lambda f: f.nodes,
+                    full_scan_ok=("nodes",), allow_filesort=True)
+    assert check_plan(allowed, summarize_plan(SAMPLE_PLAN), Fleet(nodes=10000)) == []
+
+def test_catalog_names_unique_and_markers_in_sources():
+    names = [q.name for q in CATALOG]
+    assert len(names) == len(set(names))
+    modules = {"api": api, "scheduler": scheduler}
+    for query in CATALOG:
+        module, *path = query.source.split(".")
+        target = modules[module]
+        for attr in path:
+            target = getattr(target, attr)
+        # La requête repérée est bien écrite dans la fonction indiquée
+        assert normalize_sql(query.marker) in normalize_sql(inspect.getsource(target)), query.name
+
+PARAMS = {'user_id': 1, 'rental_id': 42, 'dead_node': 7, 'identity': ("worker-1", "10.0.0.1", 22),
+          'claim': 'plan' * 8, 'version': 100}
+
+def catalog_query(name):
+    return next(q for q in CATALOG if q.name == name)
+
+def test_record_statement_stops_at_marker():
+    raw = MagicMock()
+    sql, params = record_statement(raw, catalog_query("expiry_claimed_select"), PARAMS)
+
+    assert "WHERE r.expiry_claim=%s" in sql
+    assert params == ('plan' * 8,)
+    # La réclamation a été exécutée avant, la requête cherchée non ; rien n'est conservé
+    executed = [c[0][0] for c in raw.cursor.return_value.execute.call_args_list]
+    assert len(executed) == 1 and "SET expiry_claim=%s" in executed[0]
+    raw.commit.assert_not_called()
+    raw.rollback.assert_called_once()
+
+def test_record_statement_through_api_route():
+    raw = MagicMock()
+    sql, params = record_statement(raw, catalog_query("extend_select"), PARAMS)
+
+    assert "FROM rentals WHERE id=%s FOR UPDATE" in sql
+    assert params == (42,)
+    raw.commit.assert_not_called()
+
+def test_record_statement_missing_query():
+    query = Query("absente", "scheduler.claim_expired_leases", "FROM nowhere",
+                  lambda c, p: scheduler.claim_expired_leases(c, p['claim']))
+    assert record_statement(MagicMock(), query, PARAMS) is None
+
+def test_init_statements_skip_use_and_comments():
+    statements = list(query_plans.init_statements())
+    assert not any(s.upper().startswith("USE ") for s in statements)
+    assert any("CREATE TABLE IF NOT EXISTS nodes" in s for s in statements)
+    assert any("idx_nodes_fit" in s for s in statements)
+
+
+# -----------------------
+# Plans réels : MariaDB jetable (PLAN_DB_HOST), flotte chargée une fois par session
+# -----------------------
+@pytest.fixture(scope="module")
+def plan_db():
+    if not query_plans.PLAN_DB_HOST:
+        pytest.skip("PLAN_DB_HOST non défini : pas de base pour les plans d'exécution")
+    fleet = Fleet()
+    if os.getenv('PLAN_DB_RELOAD') == '1' or not query_plans.fleet_loaded():
+        query_plans.load_fleet(fleet)
+    conn = query_plans.connect(query_plans.PLAN_DB_NAME)
+    yield conn, query_plans.fleet_params(conn), fleet
+    conn.close()
+
+@pytest.mark.parametrize("query", CATALOG, ids=lambda q: q.name)
+def test_hot_query_plan_within_budget(plan_db, query):
+    conn, params, fleet = plan_db
+    statement = record_statement(conn, query, params)
+    assert statement, f"{query.name} n'est plus émise par {query.source}"
+    result = query_plans.analyze(conn, query, statement)
+    assert check_plan(query, result, fleet) == [], result.tables
@@ -65,7 +65,7 @@ def test_rent_success(client, mock_db):
         assert "INSERT INTO rentals" in cursor.execute.call_args_list[1][0][0]
         
         # Check Node Status Update
-        assert "UPDATE nodes SET allocated=TRUE" in cursor.execute.call_args_list[2][0][0]
+        assert "UPDATE nodes SET slots_used = slots_used + 1" in cursor.execute.call_args_list[2][0][0]
 
 def test_release_success(client, mock_db):
     token = get_auth_token(client)
@@ -101,7 +101,28 @@ def test_release_success(client, mock_db):
         # Verify updates
         # Rental inactive
         assert "UPDATE rentals SET active = FALSE" in cursor.execute.call_args_list[-2][0][0]
-        assert "UPDATE nodes SET allocated = FALSE" in cursor.execute.call_args_list[-1][0][0]
+        assert "slots_used = GREATEST(slots_used - 1, 0), allocated = FALSE" in cursor.execute.call_args_list[-1][0][0]
+        # Compte supprimé : retiré du registre, nœud propre
+        assert cursor.execute.call_args_list[-1][0][1] == (False, 101)
+        assert any("DELETE FROM node_accounts" in c[0][0] for c in cursor.execute.call_args_list)
+
+def test_release_delete_failure_marks_node_dirty(client, mock_db):
+    token = get_auth_token(client)
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchone.return_value = {
+        "id": 500, "user_id": 1, "active": True, "node_id": 101,
+        "username": "tester", "ip": "1.2.3.4", "ssh_port": 22, "ssh_password": None
+    }
+
+    with patch('api.run_ansible_provision', return_value=False):
+        response = client.post('/release/500', headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 200
+    calls = cursor.execute.call_args_list
+    assert not any("DELETE FROM node_accounts" in c[0][0] for c in calls)
+    # Le compte reste au registre : le scheduler le supprimera
+    assert "needs_cleanup" in calls[-1][0][0]
+    assert calls[-1][0][1] == (True, 101)
 
 def test_extend_lease(client, mock_db):
     token = get_auth_token(client)
@@ -129,3 +150,357 @@ def test_extend_lease(client, mock_db):
     # Args should contain new date > now
     args = cursor.execute.call_args[0]
     assert "UPDATE rentals SET leased_until" in args[0]
+
+    # Le scheduler est prévenu via change_log
+    sql, rows = cursor.executemany.call_args[0]
+    assert "INSERT INTO change_log" in sql
+    assert rows == [('rental', 500)]
+
+def test_extend_lease_being_expired(client, mock_db):
+    token = get_auth_token(client)
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchone.return_value = {
+        "id": 500, "user_id": 1, "active": True,
+        "leased_until": datetime.now(), "expiry_claim": "abc123", "expiry_claimed": 1
+    }
+
+    response = client.post('/extend/500',
+        headers={"Authorization": f"Bearer {token}"},
+        json={"additional_hours": 3}
+    )
+
+    assert response.status_code == 409
+    assert "expiry_claimed_until >= NOW()" in cursor.execute.call_args_list[0][0][0]
+    assert not any("UPDATE rentals SET leased_until" in c[0][0] for c in cursor.execute.call_args_list)
+
+def test_extend_lease_after_stale_expiry_claim(client, mock_db):
+    # Réclamation d'un réplica qui n'a pas terminé dans le délai de visibilité
+    token = get_auth_token(client)
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchone.return_value = {
+        "id": 500, "user_id": 1, "active": True,
+        "leased_until": datetime.now(), "expiry_claim": "abc123", "expiry_claimed": 0
+    }
+
+    response = client.post('/extend/500',
+        headers={"Authorization": f"Bearer {token}"},
+        json={"additional_hours": 3}
+    )
+
+    assert response.status_code == 200
+    sql = cursor.execute.call_args[0][0]
+    assert "UPDATE rentals SET leased_until" in sql
+    assert "expiry_claim = NULL" in sql
+
+def test_rent_async_returns_job(client, mock_db):
+    token = get_auth_token(client)
+    conn = mock_db.return_value
+    cursor = conn.cursor.return_value
+
+    cursor.fetchall.return_value = [{"id": 101, "ip": "1.2.3.4", "ssh_port": 2222}]
+    cursor.lastrowid = 500
+
+    with patch('api.provisioning_executor') as mock_executor, \
+         patch('api.run_ansible_provision') as mock_ansible:
+        response = client.post('/rent',
+            headers={"Authorization": f"Bearer {token}"},
+            json={"duration_hours": 2, "count": 1, "async": True}
+        )
+
+        assert response.status_code == 202
+        job_id = response.json["job_id"]
+        assert response.json["allocated"][0]["status"] == "pending"
+
+        # Réservation commitée avant le provisioning, qui part en arrière-plan
+        conn.commit.assert_called()
+        mock_ansible.assert_not_called()
+        submitted = mock_executor.submit.call_args[0]
+        assert submitted[1] == job_id
+        assert submitted[3][0]["rental_id"] == 500
+
+        calls = [c[0][0] for c in cursor.execute.call_args_list]
+        assert any("INSERT INTO provisioning_jobs" in c for c in calls)
+
+def test_run_provisioning_job_success():
+    from api import run_provisioning_job
+    targets = [{"rental_id": 1, "node_id": 10, "host_ip": "1.1.1.1", "ssh_port": 22, "client_pass": "p"}]
+
+    with patch('api.run_ansible_provision', return_value=True), \
+         patch('api.set_job_status') as mock_job, \
+         patch('api.set_job_item_status') as mock_item, \
+         patch('api.abort_provisioning_job') as mock_abort:
+        assert run_provisioning_job("job1", "tester", targets) is True
+
+        mock_item.assert_called_with("job1", 1, 'ready')
+        mock_job.assert_called_with("job1", 'succeeded')
+        mock_abort.assert_not_called()
+
+def test_run_provisioning_job_failure_aborts():
+    from api import run_provisioning_job
+    targets = [
+        {"rental_id": 1, "node_id": 10, "host_ip": "1.1.1.1", "ssh_port": 22, "client_pass": "p"},
+        {"rental_id": 2, "node_id": 11, "host_ip": "1.1.1.2", "ssh_port": 22, "client_pass": "p"},
+    ]
+
+    with patch('api.run_ansible_provision', return_value=False) as mock_ansible, \
+         patch('api.set_job_status') as mock_job, \
+         patch('api.set_job_item_status'), \
+         patch('api.abort_provisioning_job') as mock_abort:
+        assert run_provisioning_job("job1", "tester", targets) is False
+
+        # Aucun nœud réussi : rien à déprovisionner
+        assert all(c.kwargs["playbook_name"] == 'create_user.yml' for c in mock_ansible.call_args_list)
+        mock_abort.assert_called_once_with("job1", targets, ANY)
+        # L'état 'failed' est posé par l'annulation, dans sa transaction
+        assert mock_job.call_args[0][1] == 'running'
+
+def test_abort_provisioning_job(mock_db):
+    from api import abort_provisioning_job
+    conn = mock_db.return_value
+    cursor = conn.cursor.return_value
+
+    targets = [{"rental_id": 1, "node_id": 10}, {"rental_id": 2, "node_id": 11}]
+    assert abort_provisioning_job("job1", targets, "échec") is True
+
+    calls = [c[0][0] for c in cursor.execute.call_args_list]
+    assert "status IN ('pending', 'running')" in calls[0]
+    assert any("UPDATE rentals SET active=FALSE" in c for c in calls)
+    assert any("needs_cleanup=TRUE" in c for c in calls)
+    conn.commit.assert_called()
+
+def test_abort_provisioning_job_already_swept(mock_db):
+    from api import abort_provisioning_job
+    conn = mock_db.return_value
+    cursor = conn.cursor.return_value
+    # Job déjà passé en échec par le scheduler : ses locations sont déjà annulées
+    cursor.rowcount = 0
+
+    assert abort_provisioning_job("job1", [{"rental_id": 1, "node_id": 10}], "échec") is True
+    assert cursor.execute.call_count == 1
+    conn.rollback.assert_called_once()
+    conn.commit.assert_not_called()
+
+def test_get_rent_job(client, auth_headers, mock_db):
+    conn = mock_db.return_value
+    cursor = conn.cursor.return_value
+    now = datetime.now()
+
+    cursor.fetchone.return_value = {
+        "id": "job1", "user_id": 1, "status": "running", "error": None,
+        "created_at": now, "updated_at": now
+    }
+    cursor.fetchall.return_value = [
+        {"rental_id": 500, "node_id": 101, "status": "ready", "error": None, "updated_at": now},
+        {"rental_id": 501, "node_id": 102, "status": "provisioning", "error": None, "updated_at": now},
+    ]
+
+    res = client.get('/rent/jobs/job1', headers=auth_headers)
+    assert res.status_code == 200
+    assert res.json["status"] == "running"
+    assert [n["status"] for n in res.json["nodes"]] == ["ready", "provisioning"]
+
+def test_get_rent_job_forbidden_and_missing(client, auth_headers, mock_db):
+    cursor = mock_db.return_value.cursor.return_value
+
+    cursor.fetchone.return_value = {"id": "job1", "user_id": 2, "status": "running"}
+    assert client.get('/rent/jobs/job1', headers=auth_headers).status_code == 403
+
+    cursor.fetchone.return_value = None
+    assert client.get('/rent/jobs/nope', headers=auth_headers).status_code == 404
+
+def make_targets(n):
+    return [{"rental_id": 500 + i, "node_id": 100 + i, "host_ip": f"10.0.0.{i}",
+             "ssh_port": 22, "client_pass": "p"} for i in range(n)]
+
+def test_provision_nodes_runs_concurrently():
+    import threading
+    from api import provision_nodes
+
+    # Les deux provisionings doivent être en cours en même temps pour passer la barrière
+    barrier = threading.Barrier(2, timeout=5)
+    def fake_provision(**kwargs):
+        barrier.wait()
+        return True
+
+    with patch('api.run_ansible_provision', side_effect=fake_provision), \
+         patch('api.PROVISION_CONCURRENCY', 2):
+        assert provision_nodes("tester", make_targets(2)) == []
+
+def test_provision_nodes_respects_concurrency_limit():
+    import threading
+    from api import provision_nodes
+
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+    def fake_provision(**kwargs):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        import time
+        time.sleep(0.02)
+        with lock:
+            state["running"] -= 1
+        return True
+
+    with patch('api.run_ansible_provision', side_effect=fake_provision), \
+         patch('api.PROVISION_CONCURRENCY', 3):
+        assert provision_nodes("tester", make_targets(9)) == []
+    assert state["peak"] <= 3
+
+def test_provision_nodes_rolls_back_succeeded():
+    from api import provision_nodes
+    targets = make_targets(3)
+
+    def fake_provision(playbook_name, host_ip, **kwargs):
+        if playbook_name == 'create_user.yml' and host_ip == "10.0.0.1":
+            return False
+        return True
+
+    with patch('api.run_ansible_provision', side_effect=fake_provision) as mock_ansible, \
+         patch('api.PROVISION_CONCURRENCY', 3):
+        failed = provision_nodes("tester", targets)
+
+    assert [t["node_id"] for t in failed] == [101]
+    deleted = {c.kwargs["host_ip"] for c in mock_ansible.call_args_list
+               if c.kwargs["playbook_name"] == 'delete_user.yml'}
+    created = {c.kwargs["host_ip"] for c in mock_ansible.call_args_list
+               if c.kwargs["playbook_name"] == 'create_user.yml'}
+    # Seuls les nœuds provisionnés avec succès sont nettoyés
+    assert deleted == created - {"10.0.0.1"}
+
+def test_rent_multi_node_failure_rolls_back(client, mock_db):
+    token = get_auth_token(client)
+    conn = mock_db.return_value
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = [
+        {"id": 101, "ip": "1.2.3.4", "ssh_port": 2222},
+        {"id": 102, "ip": "1.2.3.5", "ssh_port": 2223},
+    ]
+    cursor.lastrowid = 500
+
+    with patch('api.provision_nodes', return_value=[{"node_id": 102}]):
+        response = client.post('/rent',
+            headers={"Authorization": f"Bearer {token}"},
+            json={"duration_hours": 2, "count": 2}
+        )
+
+    assert response.status_code == 500
+    conn.rollback.assert_called()
+    conn.commit.assert_not_called()
+
+def test_rent_rollback_failure_registers_leaked_account(client, mock_db):
+    token = get_auth_token(client)
+    conn = mock_db.return_value
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = [
+        {"id": 101, "ip": "1.2.3.4", "ssh_port": 2222},
+        {"id": 102, "ip": "1.2.3.5", "ssh_port": 2223},
+    ]
+    cursor.lastrowid = 500
+    events = []
+    conn.rollback.side_effect = lambda: events.append("rollback")
+    conn.commit.side_effect = lambda: events.append("commit")
+
+    def fake_provision(client_user, targets, on_status=None, leaked=None):
+        # 102 en échec, le compte créé sur 101 n'a pas pu être supprimé
+        leaked.append(targets[0])
+        return [targets[1]]
+
+    with patch('api.provision_nodes', side_effect=fake_provision):
+        response = client.post('/rent',
+            headers={"Authorization": f"Bearer {token}"},
+            json={"duration_hours": 2, "count": 2}
+        )
+
+    assert response.status_code == 500
+    # Inscription au registre dans une transaction séparée, après le rollback
+    assert events == ["rollback", "commit"]
+    dirty = [c for c in cursor.execute.call_args_list if "needs_cleanup=TRUE" in c[0][0]]
+    assert dirty[-1][0][1] == (101,)
+    ledger = [c for c in cursor.executemany.call_args_list if "node_accounts" in c[0][0]]
+    assert ledger[-1][0][1] == [(101, "tester")]
+
+def test_claim_free_nodes_skip_locked():
+    from api import claim_free_nodes
+    cursor = MagicMock()
+    cursor.fetchall.return_value = [{"id": 1}, {"id": 2}]
+
+    assert len(claim_free_nodes(cursor, 2)) == 2
+    sql = cursor.execute.call_args_list[0][0][0]
+    assert "FOR UPDATE SKIP LOCKED" in sql
+    assert cursor.execute.call_count == 1
+
+def test_claim_free_nodes_retries_partial_claim():
+    from api import claim_free_nodes
+    cursor = MagicMock()
+    cursor.fetchall.side_effect = [
+        [{"id": 1}],              # claim partiel : un nœud verrouillé par un autre rent
+        [{"id": 1}, {"id": 2}],   # des nœuds libres existent
+        [{"id": 1}, {"id": 2}],   # seconde tentative complète
+    ]
+
+    with patch('api.time.sleep') as mock_sleep:
+        nodes = claim_free_nodes(cursor, 2)
+
+    assert [n["id"] for n in nodes] == [1, 2]
+    mock_sleep.assert_called_once()
+
+def test_claim_free_nodes_no_retry_when_fleet_too_small():
+    from api import claim_free_nodes
+    cursor = MagicMock()
+    cursor.fetchall.side_effect = [[{"id": 1}], [{"id": 1}]]
+
+    with patch('api.time.sleep') as mock_sleep:
+        nodes = claim_free_nodes(cursor, 2)
+
+    assert len(nodes) == 1
+    mock_sleep.assert_not_called()
+
+def test_claim_free_nodes_best_fit():
+    from api import claim_free_nodes
+    cursor = MagicMock()
+    cursor.fetchall.return_value = [{"id": 1}]
+
+    claim_free_nodes(cursor, 1, min_cpu=2, min_memory_mb=4096)
+    sql, params = cursor.execute.call_args_list[0][0]
+    assert "cpu_cores >= %s * slots AND memory_mb >= %s * slots AND disk_gb >= %s * slots" in sql
+    assert "ORDER BY idle, cpu_cores, memory_mb, disk_gb" in sql
+    assert params == (2, 4096, 0)
+
+def test_rent_passes_resource_requirements(client, mock_db):
+    token = get_auth_token(client)
+    with patch('api.claim_free_nodes', return_value=[]) as mock_claim:
+        response = client.post('/rent', headers={"Authorization": f"Bearer {token}"},
+                               json={"duration_hours": 1, "count": 2, "min_cpu": 4, "min_disk_gb": 20})
+    assert response.status_code == 503
+    mock_claim.assert_called_once_with(ANY, 2, user_id=1, min_cpu=4, min_memory_mb=0, min_disk_gb=20)
+
+def test_rent_invalid_resource_requirements(client, mock_db):
+    token = get_auth_token(client)
+    response = client.post('/rent', headers={"Authorization": f"Bearer {token}"},
+                           json={"duration_hours": 1, "min_memory_mb": -512})
+    assert response.status_code == 400
+
+def test_claim_free_nodes_excludes_nodes_of_same_client():
+    from api import claim_free_nodes
+    cursor = MagicMock()
+    cursor.fetchall.return_value = [{"id": 1}]
+
+    claim_free_nodes(cursor, 1, user_id=7)
+    sql, params = cursor.execute.call_args_list[0][0]
+    assert "r.user_id = %s AND r.active = TRUE" in sql
+    assert params == (0, 0, 0, 7)
+
+def test_release_keeps_dirty_flag_of_shared_node(client, mock_db):
+    token = get_auth_token(client)
+    cursor = mock_db.return_value.cursor.return_value
+    cursor.fetchone.return_value = {
+        "id": 500, "user_id": 1, "node_id": 101, "active": True, "username": "tester",
+        "ip": "1.2.3.4", "ssh_port": 22, "ssh_password": None,
+    }
+    with patch('api.run_provision', return_value=True):
+        res = client.post('/release/500', headers={"Authorization": f"Bearer {token}"})
+    assert res.status_code == 200
+    sql, params = cursor.execute.call_args_list[-1][0]
+    assert "needs_cleanup = (needs_cleanup OR %s)" in sql
+    assert params == (False, 101)
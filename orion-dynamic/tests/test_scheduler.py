@@ -21,7 +21,7 @@ def test_reassign_rental_on_node_failure(mock_db_sched):
         [{
             "id": 500, "user_id": 1, "active": True, 
             "leased_from": "now", "leased_until": "later", 
-            "ssh_password": "enc"
+            "ssh_password": "enc", "username": "tester"
         }],
         # Second fetchall: replacements nodes
         [{
@@ -46,8 +46,8 @@ def test_reassign_rental_on_node_failure(mock_db_sched):
         
         assert any("UPDATE rentals SET active=FALSE" in c for c in calls)
         assert any("INSERT INTO rentals" in c for c in calls)
-        assert any("UPDATE nodes SET allocated=TRUE" in c for c in calls)
-        assert any("UPDATE nodes SET allocated=FALSE, needs_cleanup=TRUE" in c for c in calls)
+        assert any("UPDATE nodes SET slots_used = slots_used + 1" in c for c in calls)
+        assert any("SET slots_used = %s, allocated = FALSE, needs_cleanup = TRUE" in c for c in calls)
 
 def test_cleanup_resurrected_nodes(mock_db_sched):
     conn = mock_db_sched.return_value
@@ -55,21 +55,73 @@ def test_cleanup_resurrected_nodes(mock_db_sched):
     
     # 1. Select dirty nodes
     cursor.fetchall.side_effect = [
-        [{"id": 10, "ip": "1.1.1.1", "ssh_port": 22, "hostname": "worker1"}], # nodes
-        [{"username": "dirty_user", "ssh_password": "enc"}] # rentals history
+        [{"id": 10, "ip": "1.1.1.1", "ssh_port": 22, "hostname": "worker1"},
+         {"id": 11, "ip": "1.1.1.2", "ssh_port": 22, "hostname": "worker2"}], # nodes
+        [{"node_id": 10, "username": "dirty_user"},
+         {"node_id": 10, "username": "other_user"}] # registre node_accounts
     ]
     
-    with patch('scheduler.run_ansible_task') as mock_ansible, \
-         patch('scheduler.decrypt_password') as mock_decrypt:
+    with patch('scheduler.run_provision_batch') as mock_batch:
         
-        mock_ansible.return_value = True # Ansible Success
+        mock_batch.return_value = {10: True} # Ansible Success
         
         scheduler.job_cleanup_resurrected_nodes()
         
-        mock_ansible.assert_called_with('delete_user.yml', ANY, ANY, "dirty_user", ANY)
+        # Un seul appel par nœud, avec tous les comptes encore présents
+        playbook, targets = mock_batch.call_args[0]
+        assert playbook == 'delete_user.yml'
+        assert [t['client_user'] for t in targets] == [["dirty_user", "other_user"]]
         
-        calls = [c[0][0] for c in cursor.execute.call_args_list]
-        assert any("UPDATE nodes SET needs_cleanup=FALSE" in c for c in calls)
+        calls = [c[0] for c in cursor.execute.call_args_list]
+        assert "FROM node_accounts" in calls[1][0]
+        # Comptes des locataires encore actifs sur le nœud exclus (nettoyage par slot)
+        assert "r.active = TRUE" in calls[1][0]
+        assert ("DELETE FROM node_accounts WHERE node_id=%s AND username IN (%s,%s)",
+                (10, "dirty_user", "other_user")) in calls
+        # Le nœud 11 sans compte au registre est marqué propre sans appel distant
+        assert ("UPDATE nodes SET needs_cleanup=FALSE WHERE id=%s", (10,)) in calls
+        assert ("UPDATE nodes SET needs_cleanup=FALSE WHERE id=%s", (11,)) in calls
+        # Nœuds nettoyés journalisés : /nodes?needs_cleanup=, SSE et ETag suivent
+        sql, rows = cursor.executemany.call_args[0]
+        assert "INSERT INTO change_log" in sql
+        assert rows == [('node', 10), ('node', 11)]
+
+def test_cleanup_resurrected_nodes_failure_keeps_dirty(mock_db_sched):
+    conn = mock_db_sched.return_value
+    cursor = conn.cursor.return_value
+    cursor.fetchall.side_effect = [
+        [{"id": 10, "ip": "1.1.1.1", "ssh_port": 22, "hostname": "worker1"}],
+        [{"node_id": 10, "username": "dirty_user"}]
+    ]
+
+    with patch('scheduler.run_provision_batch', return_value={10: False}):
+        scheduler.job_cleanup_resurrected_nodes()
+
+    calls = [c[0][0] for c in cursor.execute.call_args_list]
+    assert not any("DELETE FROM node_accounts" in c for c in calls)
+    assert not any("UPDATE nodes SET needs_cleanup=FALSE" in c for c in calls)
+    cursor.executemany.assert_not_called()
+
+def test_run_ansible_batch_multiple_users():
+    runner = MagicMock(rc=0, stats={'processed': {'target_0': 1}, 'failures': {}, 'dark': {}})
+    with patch('scheduler.ansible_runner.run', return_value=runner) as mock_run:
+        results = scheduler.run_ansible_batch('delete_user.yml', [
+            {'key': 10, 'host_ip': '1.1.1.1', 'host_port': 22, 'client_user': ['a', 'b'], 'client_pass': ''}])
+
+    hostvars = mock_run.call_args[1]['inventory']['all']['hosts']['target_0']
+    assert hostvars['target_users'] == ['a', 'b']
+    assert 'target_user' not in hostvars
+    assert results == {10: True}
+
+def test_run_ssh_provision_multiple_users():
+    sessions = MagicMock()
+    sessions.run.return_value = (0, "", "")
+    with patch('scheduler.get_ssh_sessions', return_value=sessions), \
+         patch('scheduler.load_provision_script', return_value="delete"):
+        assert scheduler.run_ssh_provision('delete_user.yml', '1.1.1.1', 22, ['a', 'b'], '') is True
+
+    command = sessions.run.call_args[0][2]
+    assert command.endswith("sh a b")
 
 def test_health_check_dead_node(mock_db_sched):
     conn = mock_db_sched.return_value
@@ -101,18 +153,21 @@ def test_job_expire_leases(mock_db_sched):
         "ssh_password": "enc"
     }]
     
-    with patch('scheduler.run_ansible_task') as mock_ansible, \
+    with patch('scheduler.run_provision_batch') as mock_batch, \
          patch('scheduler.decrypt_password') as mock_decrypt:
         
-        mock_ansible.return_value = True
+        mock_batch.return_value = {500: True}
         mock_decrypt.return_value = "secret"
         
         scheduler.job_expire_leases()
         
-        mock_ansible.assert_called_with('delete_user.yml', ANY, ANY, "expired_user", ANY)
+        playbook, targets = mock_batch.call_args[0]
+        assert playbook == 'delete_user.yml'
+        assert targets[0]['key'] == 500
+        assert targets[0]['client_user'] == "expired_user"
         
         calls = [c[0][0] for c in cursor.execute.call_args_list]
-        assert any("UPDATE nodes SET allocated=FALSE" in c for c in calls)
+        assert any("UPDATE nodes SET slots_used = GREATEST(slots_used - 1, 0), allocated=FALSE" in c for c in calls)
         assert any("UPDATE rentals SET active=FALSE" in c for c in calls)
 
 def test_job_expire_leases_ansible_fail(mock_db_sched):
@@ -126,9 +181,9 @@ def test_job_expire_leases_ansible_fail(mock_db_sched):
         "ssh_password": "enc"
     }]
     
-    with patch('scheduler.run_ansible_task') as mock_ansible, \
+    with patch('scheduler.run_provision_batch') as mock_batch, \
          patch('scheduler.decrypt_password') as mock_descrypt:
-        mock_ansible.return_value = False # Ansible Fails
+        mock_batch.return_value = {500: False} # Ansible Fails
         mock_descrypt.return_value = "pass"
         
         scheduler.job_expire_leases()
@@ -145,6 +200,96 @@ def test_db_connection_fail():
     with patch('mysql.connector.connect', side_effect=Error("DB Down")):
         assert scheduler.get_db_connection() is None
 
+def test_reassign_returns_migrations_without_provisioning(mock_db_sched):
+    cursor = mock_db_sched.return_value.cursor.return_value
+    cursor.fetchall.side_effect = [
+        [{"id": 500, "user_id": 1, "leased_from": "now", "leased_until": "later",
+          "ssh_password": "enc", "username": "alice"},
+         {"id": 501, "user_id": 2, "leased_from": "now", "leased_until": "later",
+          "ssh_password": "enc", "username": "bob"}],
+        [{"id": 20, "ip": "1.2.3.4", "ssh_port": 2222},
+         {"id": 21, "ip": "1.2.3.5", "ssh_port": 2222}],
+    ]
+    cursor.lastrowid = 900
+
+    with patch('scheduler.run_provision') as mock_provision, \
+         patch('scheduler.run_provision_batch') as mock_batch, \
+         patch('scheduler.decrypt_password', return_value="secret"):
+        migrations = scheduler.reassign_rental_on_node_failure(10, cursor)
+        # Aucun provisioning pendant que les verrous sont tenus
+        mock_provision.assert_not_called()
+        mock_batch.assert_not_called()
+
+    assert [m['client_user'] for m in migrations] == ["alice", "bob"]
+    assert [m['new_node_id'] for m in migrations] == [20, 21]
+    calls = [c[0][0] for c in cursor.execute.call_args_list]
+    # Username joint à la requête des locations : pas de SELECT par location
+    assert "JOIN users" in calls[0]
+    assert not any("SELECT username FROM users" in c for c in calls)
+    assert sum("FROM nodes" in c and "SKIP LOCKED" in c for c in calls) == 1
+    assert "needs_cleanup=FALSE" in calls[1]
+    assert sum("INSERT INTO rental_migrations" in c for c in calls) == 2
+
+def test_job_migrate_provisions_after_commit(mock_db_sched):
+    conn = mock_db_sched.return_value
+    cursor = conn.cursor.return_value
+    cursor.fetchall.side_effect = [[{"id": 99}], []]
+    events = []
+    conn.commit.side_effect = lambda: events.append("commit")
+    migrations = [{'key': 900, 'old_rental_id': 500, 'new_node_id': 20, 'host_ip': '1.2.3.4',
+                   'host_port': 22, 'client_user': 'alice', 'client_pass': 'secret'}]
+
+    with patch('scheduler.reassign_rental_on_node_failure', return_value=migrations), \
+         patch('scheduler.run_provision_batch',
+               side_effect=lambda playbook, targets: events.append(playbook) or {900: True}) as mock_batch:
+        scheduler.job_migrate_dead_nodes()
+
+    assert events[:2] == ["commit", "create_user.yml"]
+    assert mock_batch.call_args[0][1] == migrations
+    sql, params = [c[0] for c in cursor.execute.call_args_list if "UPDATE rental_migrations" in c[0][0]][0]
+    assert "status='restored', restored_at=NOW()" in sql
+    assert params == (900,)
+
+def test_failed_migration_stays_pending_without_restored_at(mock_db_sched):
+    conn = mock_db_sched.return_value
+    cursor = conn.cursor.return_value
+    migrations = [{'key': 900, 'old_rental_id': 500, 'new_node_id': 20, 'attempts': 1},
+                  {'key': 901, 'old_rental_id': 501, 'new_node_id': 21, 'attempts': 1}]
+
+    with patch('scheduler.run_provision_batch', return_value={900: True, 901: False}):
+        scheduler.provision_migrations(conn, migrations)
+
+    restored, failed = [c[0] for c in cursor.execute.call_args_list]
+    assert restored[1] == (900,)
+    assert "restored_at" not in failed[0]
+    assert "IF(attempts >= %s, 'failed', 'provisioning')" in failed[0]
+    assert failed[1] == (scheduler.MIGRATION_MAX_ATTEMPTS, scheduler.MIGRATION_RETRY_DELAY, 901)
+
+def test_job_migrate_retries_pending_migrations(mock_db_sched):
+    conn = mock_db_sched.return_value
+    cursor = conn.cursor.return_value
+    cursor.fetchall.side_effect = [
+        [],                                            # aucun nœud mort
+        [{"new_rental_id": 900}, {"new_rental_id": 901}],  # migrations à retenter
+        [{"new_rental_id": 900, "old_rental_id": 500, "new_node_id": 20, "attempts": 2, "active": 1,
+          "ssh_password": "enc", "username": "alice", "ip": "1.2.3.4", "ssh_port": 22, "container_name": None},
+         {"new_rental_id": 901, "old_rental_id": 501, "new_node_id": 21, "attempts": 2, "active": None,
+          "ssh_password": None, "username": None, "ip": "1.2.3.5", "ssh_port": 22, "container_name": None}],
+    ]
+
+    with patch('scheduler.decrypt_password', return_value="secret"), \
+         patch('scheduler.run_provision_batch', return_value={900: True}) as mock_batch:
+        scheduler.job_migrate_dead_nodes()
+
+    targets = mock_batch.call_args[0][1]
+    assert [(t['key'], t['client_user'], t['client_pass']) for t in targets] == [(900, "alice", "secret")]
+    calls = [(c[0][0], c[0][1] if len(c[0]) > 1 else ()) for c in cursor.execute.call_args_list]
+    claim = next(sql for sql, _ in calls if "FROM rental_migrations" in sql and "SKIP LOCKED" in sql)
+    assert "retry_after <= NOW()" in claim
+    assert any("attempts = attempts + 1" in sql and params[1:] == (900, 901) for sql, params in calls)
+    # Location close avant d'être rétablie : la migration est abandonnée
+    assert any("status='failed'" in sql and params == (901,) for sql, params in calls)
+
 def test_job_migrate_dead_nodes(mock_db_sched):
     conn = mock_db_sched.return_value
     cursor = conn.cursor.return_value
@@ -177,3 +322,218 @@ def test_run_ansible_task_failure():
         
         res = scheduler.run_ansible_task('play.yml', '1.1.1.1', 22, 'user', 'pass')
         assert res is False
+
+def make_batch_targets(*hosts):
+    return [{"key": i, "host_ip": ip, "host_port": port, "client_user": f"user{i}", "client_pass": "p"}
+            for i, (ip, port) in enumerate(hosts)]
+
+def test_split_waves_one_target_per_worker():
+    targets = make_batch_targets(("1.1.1.1", 22), ("1.1.1.1", 22), ("2.2.2.2", 22), ("1.1.1.1", 23))
+    waves = scheduler.split_waves(targets)
+    assert [[t["key"] for t in w] for w in waves] == [[0, 2, 3], [1]]
+
+def test_run_ansible_batch_single_run_per_wave():
+    targets = make_batch_targets(("1.1.1.1", 22), ("2.2.2.2", 22), ("3.3.3.3", 22))
+    with patch('ansible_runner.run') as mock_run:
+        mock_run.return_value.rc = 2
+        mock_run.return_value.stats = {
+            "processed": {"target_0": 1, "target_1": 1, "target_2": 1},
+            "failures": {"target_1": 1},
+            "dark": {},
+        }
+        results = scheduler.run_ansible_batch('delete_user.yml', targets)
+
+        assert mock_run.call_count == 1
+        kwargs = mock_run.call_args.kwargs
+        hosts = kwargs["inventory"]["all"]["hosts"]
+        assert hosts["target_2"]["target_user"] == "user2"
+        assert "extravars" not in kwargs
+        assert kwargs["forks"] == 3
+        assert results == {0: True, 1: False, 2: True}
+
+def test_run_ansible_batch_unreachable_and_missing_stats():
+    targets = make_batch_targets(("1.1.1.1", 22), ("2.2.2.2", 22))
+    with patch('ansible_runner.run') as mock_run:
+        mock_run.return_value.rc = 4
+        mock_run.return_value.stats = {"processed": {"target_0": 1}, "dark": {"target_0": 1}}
+        assert scheduler.run_ansible_batch('delete_user.yml', targets) == {0: False, 1: False}
+
+        mock_run.return_value.stats = None
+        assert scheduler.run_ansible_batch('delete_user.yml', targets) == {0: False, 1: False}
+
+def test_run_provision_batch_ssh_backend():
+    targets = make_batch_targets(("1.1.1.1", 22), ("2.2.2.2", 22))
+    with patch('scheduler.PROVISIONER_BACKEND', 'ssh'), \
+         patch('scheduler.run_ansible_batch') as mock_batch, \
+         patch('scheduler.run_provision', side_effect=[True, False]) as mock_one:
+        results = scheduler.run_provision_batch('delete_user.yml', targets)
+        assert sorted(results.values()) == [False, True]
+        assert mock_one.call_count == 2
+        mock_batch.assert_not_called()
+
+def test_health_check_batched_status_update(mock_db_sched):
+    conn = mock_db_sched.return_value
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = [
+        {"id": 10, "ip": "1.1.1.1", "ssh_port": 22},
+        {"id": 11, "ip": "1.1.1.2", "ssh_port": 22},
+        {"id": 12, "ip": "1.1.1.3", "ssh_port": 22},
+    ]
+
+    statuses = {"1.1.1.1": "alive", "1.1.1.2": "dead", "1.1.1.3": "alive"}
+    with patch('scheduler.check_node_health', side_effect=lambda ip, port, previous: statuses[ip]):
+        scheduler.job_health_check()
+
+    updates = [c[0] for c in cursor.execute.call_args_list if c[0][0].startswith("UPDATE nodes SET status=%s")]
+    assert len(updates) == 2
+    by_status = {params[0]: sorted(params[1:]) for _, params in updates}
+    assert by_status == {"alive": [10, 12], "dead": [11]}
+
+def test_probe_nodes_concurrent():
+    import threading
+    nodes = [{"id": i, "ip": f"10.0.0.{i}", "ssh_port": 22} for i in range(4)]
+    barrier = threading.Barrier(4, timeout=5)
+
+    def fake_check(ip, port, previous):
+        barrier.wait()
+        return 'alive'
+
+    with patch('scheduler.check_node_health', side_effect=fake_check), \
+         patch('scheduler.HEALTH_CHECK_CONCURRENCY', 4):
+        assert scheduler.probe_nodes(nodes) == {0: 'alive', 1: 'alive', 2: 'alive', 3: 'alive'}
+
+def test_probe_nodes_exception_is_dead():
+    with patch('scheduler.check_node_health', side_effect=Exception("boom")):
+        assert scheduler.probe_nodes([{"id": 1, "ip": "1.1.1.1", "ssh_port": 22}]) == {1: 'dead'}
+
+def test_check_node_health_dead_without_banner():
+    with patch('scheduler.probe_tcp_banner', return_value=False), \
+         patch('scheduler.probe_auth') as mock_auth:
+        assert scheduler.check_node_health('1.1.1.1', 22, 'alive') == 'dead'
+        mock_auth.assert_not_called()
+
+def test_check_node_health_alive_skips_auth_outside_sample():
+    with patch('scheduler.probe_tcp_banner', return_value=True), \
+         patch('scheduler.probe_auth') as mock_auth, \
+         patch('scheduler.random.random', return_value=0.99):
+        assert scheduler.check_node_health('1.1.1.1', 22, 'alive') == 'alive'
+        mock_auth.assert_not_called()
+
+def test_check_node_health_auth_on_sample_and_state_change():
+    with patch('scheduler.probe_tcp_banner', return_value=True), \
+         patch('scheduler.probe_auth', return_value=False) as mock_auth, \
+         patch('scheduler.random.random', return_value=0.0):
+        # Échantillonné : l'authentification échoue -> dead
+        assert scheduler.check_node_health('1.1.1.1', 22, 'alive') == 'dead'
+
+    with patch('scheduler.probe_tcp_banner', return_value=True), \
+         patch('scheduler.probe_auth', return_value=True) as mock_auth, \
+         patch('scheduler.random.random', return_value=0.99):
+        # dead -> alive : toujours confirmé par une authentification
+        assert scheduler.check_node_health('1.1.1.1', 22, 'dead') == 'alive'
+        mock_auth.assert_called_once()
+
+def test_probe_tcp_banner_records_tiers():
+    sock = MagicMock()
+    sock.recv.return_value = b"SSH-2.0-OpenSSH_9.6\r\n"
+    before = dict(scheduler.probe_stats['banner'])
+    with patch('socket.create_connection', return_value=sock):
+        assert scheduler.probe_tcp_banner('1.1.1.1', 22) is True
+    assert scheduler.probe_stats['banner']['count'] == before['count'] + 1
+    sock.close.assert_called()
+
+    sock.recv.return_value = b"HTTP/1.1 400 Bad Request"
+    with patch('socket.create_connection', return_value=sock):
+        assert scheduler.probe_tcp_banner('1.1.1.1', 22) is False
+
+    with patch('socket.create_connection', side_effect=OSError("refused")):
+        assert scheduler.probe_tcp_banner('1.1.1.1', 22) is False
+
+def test_job_expire_leases_claims_per_lease(mock_db_sched):
+    conn = mock_db_sched.return_value
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = [
+        {"node_id": 10, "ip": "1.1.1.1", "ssh_port": 22, "rental_id": 500,
+         "user_id": 1, "username": "a", "ssh_password": None},
+        {"node_id": 11, "ip": "1.1.1.2", "ssh_port": 22, "rental_id": 501,
+         "user_id": 2, "username": "b", "ssh_password": None},
+    ]
+
+    with patch('scheduler.run_provision_batch', return_value={500: True, 501: True}):
+        scheduler.job_expire_leases()
+
+    # Connexion autocommit : la réclamation ne garde aucun verrou
+    mock_db_sched.assert_called_with(autocommit=True)
+    calls = cursor.execute.call_args_list
+    claim_sql, claim_params = calls[0][0]
+    assert "SET expiry_claim=%s" in claim_sql
+    assert "expiry_claimed_until < NOW()" in claim_sql
+    assert "LIMIT %s" in claim_sql
+    claim = claim_params[0]
+    assert "WHERE r.expiry_claim=%s" in calls[1][0][0]
+    assert calls[1][0][1] == (claim,)
+
+    # Un commit par bail, gardé par le jeton de réclamation
+    assert conn.start_transaction.call_count == 2
+    assert conn.commit.call_count == 2
+    closes = [c for c in calls if "UPDATE rentals SET active=FALSE" in c[0][0]]
+    assert [c[0][1] for c in closes] == [(500, claim), (501, claim)]
+
+def test_job_expire_leases_db_error_isolated(mock_db_sched):
+    conn = mock_db_sched.return_value
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = [
+        {"node_id": 10, "ip": "1.1.1.1", "ssh_port": 22, "rental_id": 500,
+         "user_id": 1, "username": "a", "ssh_password": None},
+        {"node_id": 11, "ip": "1.1.1.2", "ssh_port": 22, "rental_id": 501,
+         "user_id": 2, "username": "b", "ssh_password": None},
+    ]
+    # Le premier bail échoue au commit, le second doit être clos quand même
+    conn.commit.side_effect = [Exception("Deadlock"), None]
+
+    with patch('scheduler.run_provision_batch', return_value={500: True, 501: True}):
+        scheduler.job_expire_leases()
+
+    assert conn.rollback.call_count == 1
+    assert conn.commit.call_count == 2
+
+def test_reassign_packs_slots_one_node_per_client(mock_db_sched):
+    cursor = mock_db_sched.return_value.cursor.return_value
+    cursor.fetchall.side_effect = [
+        [{"id": 500, "user_id": 1, "leased_from": "now", "leased_until": "later",
+          "ssh_password": "enc", "username": "alice"},
+         {"id": 501, "user_id": 2, "leased_from": "now", "leased_until": "later",
+          "ssh_password": "enc", "username": "bob"},
+         {"id": 502, "user_id": 1, "leased_from": "now", "leased_until": "later",
+          "ssh_password": "enc", "username": "alice"}],
+        # Nœud 20 partiellement occupé (2 slots libres), nœud 21 vide
+        [{"id": 20, "ip": "1.2.3.4", "ssh_port": 2222, "slots": 4, "slots_used": 2},
+         {"id": 21, "ip": "1.2.3.5", "ssh_port": 2222, "slots": 1, "slots_used": 0}],
+    ]
+    cursor.lastrowid = 900
+
+    with patch('scheduler.decrypt_password', return_value="secret"):
+        migrations = scheduler.reassign_rental_on_node_failure(10, cursor)
+
+    # alice et bob remplissent le nœud 20 ; la seconde location d'alice va sur le nœud 21
+    assert [(m['old_rental_id'], m['new_node_id']) for m in migrations] == [(500, 20), (501, 20), (502, 21)]
+    select_sql, params = [c[0] for c in cursor.execute.call_args_list if "SKIP LOCKED" in c[0][0]][0]
+    assert "ORDER BY idle, cpu_cores" in select_sql
+    assert params == (10, 1, 2)
+    sql, params = cursor.execute.call_args_list[-1][0]
+    assert "needs_cleanup = TRUE" in sql
+    assert params == (0, 10)
+
+def test_reassign_keeps_unmigrated_slots_on_dead_node(mock_db_sched):
+    cursor = mock_db_sched.return_value.cursor.return_value
+    cursor.fetchall.side_effect = [
+        [{"id": 500, "user_id": 1, "leased_from": "now", "leased_until": "later",
+          "ssh_password": "enc", "username": "alice"}],
+        [],
+    ]
+    with patch('scheduler.decrypt_password', return_value="secret"):
+        assert scheduler.reassign_rental_on_node_failure(10, cursor) == []
+
+    sql, params = cursor.execute.call_args_list[-1][0]
+    assert "needs_cleanup = TRUE" in sql
+    assert params == (1, 10)
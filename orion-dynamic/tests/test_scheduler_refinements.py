@@ -59,3 +59,282 @@ def test_cleanup_resurrected_nodes_error(mock_db_sched):
     job_cleanup_resurrected_nodes()
     # Should catch and log
     conn.rollback.assert_called()
+
+def test_job_health_check_uses_heartbeats(mock_db_sched):
+    from scheduler import job_health_check
+    conn = mock_db_sched.return_value
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = []
+
+    job_health_check()
+
+    calls = [c[0][0] for c in cursor.execute.call_args_list]
+    # 1. Heartbeats frais -> alive sans SSH, journalisé pour le flux des nœuds
+    assert "INSERT INTO change_log" in calls[0]
+    assert "UPDATE nodes SET status='alive'" in calls[1]
+    assert "last_heartbeat >=" in calls[1]
+    # Un nœud mort n'est jamais ressuscité par un simple heartbeat
+    assert "status='unknown'" in calls[0] and "status='unknown'" in calls[1]
+    assert "'dead'" not in calls[0] and "'dead'" not in calls[1]
+    conn.commit.assert_called()
+    # 2. Seuls les nœuds silencieux sont sondés en SSH, plus les nœuds morts
+    assert "last_heartbeat IS NULL OR last_heartbeat <" in calls[2]
+    assert "OR status='dead'" in calls[2]
+
+def test_job_health_check_dead_node_with_heartbeat_needs_auth(mock_db_sched):
+    from scheduler import job_health_check
+    conn = mock_db_sched.return_value
+    cursor = conn.cursor.return_value
+    # Nœud mort dont l'agent envoie de nouveau des heartbeats, sshd refuse l'authentification
+    cursor.fetchall.return_value = [{"id": 7, "ip": "10.0.0.7", "ssh_port": 22, "status": "dead"}]
+
+    with patch('scheduler.probe_tcp_banner', return_value=True), \
+         patch('scheduler.probe_auth', return_value=False) as mock_auth:
+        job_health_check()
+
+    mock_auth.assert_called_once_with(ANY, 22)
+    updates = [c for c in cursor.execute.call_args_list if "UPDATE nodes SET status=%s" in c[0][0]]
+    assert updates[0][0][1] == ('dead', 7)
+
+def test_job_lane_skips_tick_while_running():
+    import threading
+    from scheduler import JobLane
+
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow_job():
+        started.set()
+        release.wait(2)
+
+    lane = JobLane("slow", slow_job, 1, concurrency=1)
+    assert lane.submit() is True
+    started.wait(2)
+    # Exécution encore en cours : le tick suivant est ignoré
+    assert lane.submit() is False
+    release.set()
+    lane.executor.shutdown(wait=True)
+
+    stats = lane.snapshot()
+    assert stats["runs"] == 1
+    assert stats["skipped"] == 1
+    assert stats["running"] == 0
+
+def test_job_lane_counts_errors():
+    from scheduler import JobLane
+
+    lane = JobLane("boom", MagicMock(side_effect=Exception("Job Fail")), 1)
+    lane.submit()
+    lane.executor.shutdown(wait=True)
+
+    stats = lane.snapshot()
+    assert stats["runs"] == 1
+    assert stats["errors"] == 1
+
+def test_job_lanes_run_independently():
+    import threading
+    from scheduler import JobLane
+
+    release = threading.Event()
+    fast_done = threading.Event()
+    slow = JobLane("expire", lambda: release.wait(2), 10)
+    fast = JobLane("health", fast_done.set, 2)
+
+    slow.submit()
+    fast.submit()
+    # Le health check passe même si l'expiration est bloquée
+    assert fast_done.wait(2)
+    release.set()
+    slow.executor.shutdown(wait=True)
+    fast.executor.shutdown(wait=True)
+
+def test_lease_timer_load_and_due():
+    from datetime import datetime, timedelta
+    import scheduler
+    from scheduler import LeaseTimer
+
+    now = datetime(2030, 1, 1, 12, 0, 0)
+    cursor = MagicMock()
+    cursor.fetchone.return_value = {"version": 42}
+    cursor.fetchall.return_value = [
+        {"id": 1, "leased_until": now - timedelta(seconds=1)},
+        {"id": 2, "leased_until": now + timedelta(seconds=30)},
+    ]
+
+    timer = LeaseTimer(on_due=MagicMock())
+    timer.load(cursor)
+    assert timer.version == 42
+    # Version stable, pas MAX(version) : une location committée en retard est relue
+    sql, params = cursor.execute.call_args_list[0][0]
+    assert "created_at < NOW() - INTERVAL %s SECOND" in sql
+    assert "MAX(version)" not in sql
+    assert params == (scheduler.CHANGE_LOG_SETTLE,)
+
+    assert timer.pop_due(now) == [1]
+    # Le bail 1 est replanifié (nouvelle tentative), le prochain réveil est proche
+    assert 0 < timer.seconds_until_next(now) <= 30
+
+def test_lease_timer_refresh_applies_changes():
+    from datetime import datetime, timedelta
+    from scheduler import LeaseTimer
+
+    now = datetime(2030, 1, 1, 12, 0, 0)
+    timer = LeaseTimer(on_due=MagicMock())
+    timer._apply(1, now - timedelta(seconds=5), True)
+    timer._apply(2, now - timedelta(seconds=5), True)
+    timer.version = 10
+
+    cursor = MagicMock()
+    cursor.fetchall.side_effect = [
+        # change_log : la version 12 n'est pas encore stable
+        [{"version": 11, "entity_id": 1, "settled": 1},
+         {"version": 12, "entity_id": 2, "settled": 0},
+         {"version": 13, "entity_id": 3, "settled": 1}],
+        # Bail 1 prolongé, bail 2 libéré, bail 3 créé
+        [{"id": 1, "leased_until": now + timedelta(hours=1), "active": True},
+         {"id": 2, "leased_until": now - timedelta(seconds=5), "active": False},
+         {"id": 3, "leased_until": now + timedelta(seconds=10), "active": True}],
+    ]
+
+    assert timer.refresh(cursor) == 3
+    assert timer.version == 11
+    sql, params = cursor.execute.call_args_list[0][0]
+    assert "FROM change_log" in sql
+    assert params[1] == 10
+
+    # Plus rien d'échu : le prochain réveil est la fin du bail 3
+    assert timer.pop_due(now) == []
+    assert timer.seconds_until_next(now) == 10
+
+def test_job_expire_leases_records_change(mock_db_sched):
+    import scheduler
+    conn = mock_db_sched.return_value
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = [{"node_id": 10, "ip": "1.1.1.1", "ssh_port": 22, "rental_id": 500,
+                                     "user_id": 1, "username": "a", "ssh_password": None}]
+
+    with patch('scheduler.run_provision_batch', return_value={500: True}):
+        scheduler.job_expire_leases()
+
+    sql, rows = cursor.executemany.call_args[0]
+    assert "INSERT INTO change_log" in sql
+    assert rows == [('rental', 500)]
+
+def test_archive_rental_chunk_moves_closed_rentals():
+    import scheduler
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = [{"id": 1}, {"id": 2}]
+
+    assert scheduler.archive_rental_chunk(conn) == 2
+
+    calls = [c[0] for c in cursor.execute.call_args_list]
+    assert "FOR UPDATE SKIP LOCKED" in calls[0][0]
+    assert "active=FALSE AND ended_at <" in calls[0][0]
+    assert "INSERT IGNORE INTO rentals_archive" in calls[1][0]
+    assert calls[1][1] == (1, 2)
+    assert calls[2] == ("DELETE FROM rentals WHERE id IN (%s,%s) AND active=FALSE", (1, 2))
+    conn.commit.assert_called_once()
+
+def test_archive_rental_chunk_rolls_back_on_error():
+    import scheduler
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = [{"id": 1}]
+    cursor.execute.side_effect = [None, Exception("deadlock")]
+
+    with pytest.raises(Exception):
+        scheduler.archive_rental_chunk(conn)
+    conn.rollback.assert_called_once()
+    conn.commit.assert_not_called()
+
+def test_job_archive_rentals_stops_on_short_chunk(mock_db_sched):
+    import scheduler
+    with patch('scheduler.RENTAL_ARCHIVE_CHUNK', 2), \
+         patch('scheduler.archive_rental_chunk', side_effect=[2, 2, 1, 2]) as mock_chunk:
+        scheduler.job_archive_rentals()
+    assert mock_chunk.call_count == 3
+
+    with patch('scheduler.RENTAL_ARCHIVE_CHUNK', 2), patch('scheduler.RENTAL_ARCHIVE_MAX_CHUNKS', 2), \
+         patch('scheduler.archive_rental_chunk', return_value=2) as mock_chunk:
+        scheduler.job_archive_rentals()
+    assert mock_chunk.call_count == 2
+
+def test_purge_change_log_chunk_deletes_expired_prefix_only():
+    import scheduler
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = [
+        {"version": 1, "expired": 1}, {"version": 2, "expired": 1},
+        {"version": 4, "expired": 0}, {"version": 5, "expired": 1},
+    ]
+    cursor.rowcount = 2
+
+    with patch('scheduler.CHANGE_LOG_PURGE_CHUNK', 10):
+        assert scheduler.purge_change_log_chunk(conn) == 2
+
+    select, delete = [c[0] for c in cursor.execute.call_args_list]
+    assert "ORDER BY version" in select[0]
+    assert select[1] == (scheduler.CHANGE_LOG_RETENTION, 11)
+    # Préfixe strict : la version 5 reste après la version 4, encore récente
+    assert delete == ("DELETE FROM change_log WHERE version <= %s", (2,))
+    conn.commit.assert_called_once()
+
+def test_purge_change_log_chunk_keeps_latest_row():
+    import scheduler
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    cursor.fetchall.return_value = [{"version": 7, "expired": 1}]
+
+    assert scheduler.purge_change_log_chunk(conn) == 0
+    assert cursor.execute.call_count == 1
+    conn.commit.assert_not_called()
+
+def test_job_purge_change_log_stops_on_short_chunk(mock_db_sched):
+    import scheduler
+    with patch('scheduler.CHANGE_LOG_PURGE_CHUNK', 2), \
+         patch('scheduler.purge_change_log_chunk', side_effect=[2, 1, 2]) as mock_chunk:
+        scheduler.job_purge_change_log()
+    assert mock_chunk.call_count == 2
+
+def test_fail_stale_provisioning_jobs_cancels_rentals():
+    import scheduler
+    conn = MagicMock()
+    cursor = conn.cursor.return_value
+    cursor.fetchall.side_effect = [
+        [{"id": "job1"}, {"id": "job2"}],
+        # Deux jobs balayés occupent chacun un slot du nœud 10
+        [{"rental_id": 1, "node_id": 10}, {"rental_id": 2, "node_id": 10}, {"rental_id": 3, "node_id": 11}],
+    ]
+
+    assert scheduler.fail_stale_provisioning_jobs(conn) == 2
+
+    calls = [c[0] for c in cursor.execute.call_args_list]
+    assert "FOR UPDATE SKIP LOCKED" in calls[0][0]
+    assert "NOT EXISTS" in calls[0][0]
+    assert calls[0][1] == (scheduler.PROVISIONING_JOB_TIMEOUT, scheduler.PROVISIONING_JOB_TIMEOUT,
+                           scheduler.PROVISIONING_SWEEP_BATCH)
+    assert calls[2] == ("UPDATE rentals SET active=FALSE, ended_at=NOW() WHERE id IN (%s,%s,%s)", (1, 2, 3))
+    assert any("UPDATE provisioning_jobs SET status='failed'" in c[0] for c in calls)
+
+    slots, changes = [c[0] for c in cursor.executemany.call_args_list][:2]
+    assert "needs_cleanup=TRUE" in slots[0]
+    assert slots[1] == [(2, 10), (1, 11)]
+    assert changes[1] == [('rental', 1), ('rental', 2), ('rental', 3)]
+    # Registre des comptes conservé : la Tâche 4 supprime ceux déjà créés
+    assert not any("node_accounts" in c[0] for c in calls)
+    conn.commit.assert_called_once()
+
+def test_fail_stale_provisioning_jobs_nothing_to_sweep():
+    import scheduler
+    conn = MagicMock()
+    conn.cursor.return_value.fetchall.return_value = []
+
+    assert scheduler.fail_stale_provisioning_jobs(conn) == 0
+    conn.rollback.assert_called_once()
+    conn.commit.assert_not_called()
+
+def test_sweep_provisioning_jobs_lane_registered():
+    import scheduler
+    lane = next(l for l in scheduler.build_job_lanes() if l.name == "sweep_provisioning_jobs")
+    assert lane.interval == scheduler.PROVISIONING_SWEEP_INTERVAL